@@ -13,6 +13,17 @@ if __name__ == "__main__":
         p.strip_dirs()
         p.sort_stats('cumulative').print_stats(50)
 
+    elif config.getboolean('general', 'frame_profile'):
+        from zkit.profiler import profiler
+
+        profiler.enable()
+        game = bootstrap_game()
+        try:
+            game.loop()
+        finally:
+            profiler.write_trace(config.get('general', 'trace_file'))
+            print(profiler.summary())
+
     else:
         try:
             game = bootstrap_game()
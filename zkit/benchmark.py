@@ -0,0 +1,450 @@
+"""
+Benchmarks of zkit subsystems.
+
+Runs without a display, using the dummy SDL drivers, and every scenario is
+seeded, so runs on one machine can be compared:
+
+    python -m zkit.benchmark                    # run everything
+    python -m zkit.benchmark physics pathfind   # run some scenarios
+    python -m zkit.benchmark --scale 4          # 4x the sprites and cells
+    python -m zkit.benchmark --save base.json   # keep results as baseline
+    python -m zkit.benchmark --compare base.json
+
+Each scenario builds its world once and then times a step, such as one
+physics update or one draw, many times.  The report has the median and
+percentiles of the step in ms, and the throughput in items (sprites,
+queries, events...) per second.  With --compare, scenarios whose median
+is slower than the baseline by more than --threshold are flagged, and
+the exit status is 1.
+"""
+import os
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import argparse
+import json
+import random
+import sys
+from collections import OrderedDict
+from math import sqrt
+from time import perf_counter
+
+import pygame
+from pygame import Rect
+
+from zkit.euclid import Vector2, Vector3
+
+
+__all__ = ['scenario',
+           'scenarios',
+           'run_scenario',
+           'stats',
+           'compare',
+           'main']
+
+
+# name: function(scale) -> (step, items per step)
+scenarios = OrderedDict()
+
+
+def scenario(name):
+    """Register a function which builds a benchmark
+
+    The function takes the scale, and returns a function to be timed and
+    the number of items it handles each time it is called.
+    """
+    def decorator(func):
+        scenarios[name] = func
+        return func
+    return decorator
+
+
+def scaled(n, scale):
+    """Return count of things scaled, at least 1"""
+    return max(1, int(round(n * scale)))
+
+
+def scaled_side(n, scale):
+    """Return side of a square map, scaled so its area grows with scale"""
+    return max(4, int(round(n * sqrt(scale))))
+
+
+class Sound(object):
+    def play(self):
+        pass
+
+
+class Body(pygame.sprite.DirtySprite):
+    """Sprite with what PhysicsGroup and HexMapView need"""
+
+    def __init__(self, position, radius=.4, size=16):
+        super(Body, self).__init__()
+        self.position = Vector3(*position)
+        self.velocity = Vector3(0, 0, 0)
+        self.acceleration = Vector3(0, 0, 0)
+        self.max_velocity = [.15, .15, 100]
+        self.radius = radius
+        self.gravity = True
+        self.bounce_sound = Sound()
+        self.image = pygame.Surface((size, size))
+        self.rect = self.image.get_rect()
+        self.anchor = Vector2(size / 2, size)
+
+
+class Scene(object):
+    def raise_event(self, originator, event_name, **kwargs):
+        pass
+
+
+def open_model(side):
+    from zkit.hex_model import HexMapModel, Cell, evenr_to_axial
+
+    model = HexMapModel()
+    for q in range(side):
+        for r in range(side):
+            model.add_cell(evenr_to_axial((q, r)),
+                           Cell(filename='tileGrass.png'))
+    return model
+
+
+def fake_resources():
+    """Make tiles and backdrop, so the view does not need the data files"""
+    from zkit import resources
+
+    colors = {'tileGrass.png': (40, 160, 40, 255),
+              'tileRock_full.png': (120, 120, 120, 255),
+              'tileMagic_full.png': (160, 40, 160, 255)}
+    for i, (filename, color) in enumerate(sorted(colors.items())):
+        tile = pygame.Surface((40, 40 + i * 6), pygame.SRCALPHA)
+        tile.fill(color)
+        resources.tiles.setdefault(filename, tile)
+    backdrop = pygame.Surface((640, 480))
+    backdrop.fill((10, 20, 30))
+    resources.images.setdefault('backdrop', backdrop)
+
+
+def physics_scenario(group_class, scale):
+    from zkit.hex_model import axial_to_sprites
+
+    side = scaled_side(30, scale)
+    group = group_class(open_model(side))
+    for i in range(scaled(200, scale)):
+        coords = random.uniform(1, side - 2), random.uniform(1, side - 2)
+        body = Body(axial_to_sprites(coords) + (random.uniform(0, 5),))
+        body.velocity.x = random.uniform(-.05, .05)
+        body.velocity.y = random.uniform(-.05, .05)
+        group.add(body)
+        group.collide_walls.add(body)
+    scene = Scene()
+    timestep = group.timestep
+    bodies = group.sprites()
+
+    def step():
+        # keep the bodies moving, so they are not put to sleep
+        group.update(timestep, scene)
+        for body in bodies:
+            if body in group.sleeping:
+                body.velocity.x = random.uniform(-.05, .05)
+                group.wake_sprite(body)
+
+    return step, len(bodies)
+
+
+@scenario('physics')
+def physics(scale):
+    from zkit.physics import PhysicsGroup
+    return physics_scenario(PhysicsGroup, scale)
+
+
+@scenario('physics_array')
+def physics_array(scale):
+    from zkit.physics import ArrayPhysicsGroup
+    return physics_scenario(ArrayPhysicsGroup, scale)
+
+
+@scenario('pathfind')
+def pathfind(scale):
+    from zkit.environ.maze import new_maze
+
+    model = new_maze(scaled_side(40, scale), scaled_side(40, scale))
+    lowered = sorted(coords for coords, cell in model.cells
+                     if not cell.raised)
+    queries = [(random.choice(lowered), random.choice(lowered))
+               for i in range(20)]
+
+    def step():
+        for start, end in queries:
+            model.pathfind(start, end)
+
+    return step, len(queries)
+
+
+@scenario('maze')
+def maze(scale):
+    from zkit.environ.maze import new_maze
+
+    side = scaled_side(40, scale)
+
+    def step():
+        new_maze(side, side)
+
+    return step, side * side
+
+
+def quadtree_scenario(scale, into):
+    from zkit.hex_view import SpriteRect
+    from zkit.quadtree import FastQuadTree
+
+    size = scaled_side(2000, scale)
+    rects = [Rect(random.randrange(size), random.randrange(size),
+                  random.randrange(8, 64), random.randrange(8, 64))
+             for i in range(scaled(1000, scale))]
+    # items are hashable, like those hex_view puts in its trees, so the
+    # set made by hit can be compared with hit_into
+    tree = FastQuadTree([SpriteRect(None, rect) for rect in rects])
+    queries = rects[:200]
+    hits = list()
+
+    def step_into():
+        for rect in queries:
+            del hits[:]
+            tree.hit_into(rect, hits)
+
+    def step_hit():
+        for rect in queries:
+            tree.hit(rect)
+
+    return (step_into if into else step_hit), len(queries)
+
+
+@scenario('quadtree')
+def quadtree(scale):
+    return quadtree_scenario(scale, True)
+
+
+@scenario('quadtree_hit')
+def quadtree_hit(scale):
+    return quadtree_scenario(scale, False)
+
+
+def hex_view_scenario(scale, moving_share, on_screen=False):
+    from zkit.hex_model import axial_to_sprites
+    from zkit.hex_view import HexMapView
+
+    fake_resources()
+    side = scaled_side(30, scale)
+    model = open_model(side)
+    for coords, cell in model.cells:
+        if random.random() < .2:
+            cell.raised = True
+            cell.height = random.choice((1, 2))
+            cell.filename = 'tileRock_full.png'
+    surface = pygame.Surface((640, 480), pygame.SRCALPHA)
+    view = HexMapView(None, model, 20)
+    view.draw(surface)
+    sprites = list()
+    for i in range(scaled(200, scale)):
+        if on_screen:
+            coords = view.coords_from_surface((random.uniform(0, 640),
+                                               random.uniform(0, 480)))
+        else:
+            coords = random.uniform(0, side), random.uniform(0, side)
+        sprite = Body(axial_to_sprites(coords) + (0,),
+                      size=random.choice((8, 16, 32)))
+        sprites.append(sprite)
+    view.add(*sprites)
+    view.draw(surface)
+    moving = sprites[::int(round(1. / moving_share))]
+
+    def step():
+        for sprite in moving:
+            sprite.position.x += random.uniform(-.1, .1)
+            sprite.position.y += random.uniform(-.1, .1)
+            sprite.dirty = 1
+        view.clear(surface)
+        view.draw(surface)
+
+    return step, len(sprites)
+
+
+@scenario('hex_view')
+def hex_view(scale):
+    return hex_view_scenario(scale, .2)
+
+
+@scenario('hex_view_moving')
+def hex_view_moving(scale):
+    # every sprite is in view and moves each frame
+    return hex_view_scenario(scale, 1., on_screen=True)
+
+
+@scenario('eventgroup')
+def eventgroup(scale):
+    from zkit.eventgroup import EventGroup, subscribe
+
+    class Listener(pygame.sprite.Sprite):
+        def __init__(self, key):
+            super(Listener, self).__init__()
+            self.key = key
+            self.handled = 0
+
+        @subscribe(pygame.KEYDOWN, key=pygame.K_SPACE)
+        def on_space(self, event, delta):
+            self.handled += 1
+
+        @subscribe('ping')
+        def on_ping(self, event, delta):
+            self.handled += 1
+
+    class Ping(object):
+        event_key = 'ping'
+
+    group = EventGroup()
+    group.add(*[Listener(i) for i in range(scaled(500, scale))])
+    keys = [pygame.event.Event(pygame.KEYDOWN, key=key)
+            for key in (pygame.K_SPACE, pygame.K_a)] * 5
+    pings = [Ping() for i in range(10)]
+    items = len(keys) + len(pings)
+
+    def step():
+        for ping in pings:
+            group.publish_event(ping)
+        group.update(keys, 16)
+
+    return step, items
+
+
+def stats(samples, items=1):
+    """Return dict of statistics of step times, in ms"""
+    ordered = sorted(samples)
+    n = len(ordered)
+
+    def percentile(p):
+        return ordered[min(n - 1, int(p / 100. * n))]
+
+    median = percentile(50)
+    return {'samples': n,
+            'mean': sum(ordered) / n,
+            'min': ordered[0],
+            'median': median,
+            'p90': percentile(90),
+            'p99': percentile(99),
+            'max': ordered[-1],
+            'throughput': items * 1000. / median if median else 0.}
+
+
+def run_scenario(name, scale=1., repeat=50, warmup=3, seed=0):
+    """Build a scenario and return statistics of its step"""
+    random.seed(seed)
+    step, items = scenarios[name](scale)
+    for i in range(warmup):
+        step()
+    samples = list()
+    for i in range(repeat):
+        start = perf_counter()
+        step()
+        samples.append((perf_counter() - start) * 1000.)
+    result = stats(samples, items)
+    result['items'] = items
+    result['scale'] = scale
+    return result
+
+
+def compare(results, baseline, threshold=.1):
+    """Return list of (name, ratio) of scenarios slower than the baseline
+
+    :param threshold: fraction the median may grow before it is flagged
+    """
+    regressions = list()
+    for name, result in results.items():
+        try:
+            base = baseline[name]
+        except KeyError:
+            continue
+        if base.get('scale') != result.get('scale') or not base['median']:
+            continue
+        ratio = result['median'] / base['median']
+        if ratio > 1 + threshold:
+            regressions.append((name, ratio))
+    return regressions
+
+
+def report(results, baseline=None):
+    width = max([len("scenario")] + [len(name) for name in results])
+    lines = ["%-*s %8s %9s %9s %9s %9s %12s" %
+             (width, "scenario", "items", "median", "p90", "p99", "max",
+              "items/s")]
+    for name, r in results.items():
+        line = "%-*s %8d %7.3fms %7.3fms %7.3fms %7.3fms %12.0f" % \
+               (width, name, r['items'], r['median'], r['p90'], r['p99'],
+                r['max'], r['throughput'])
+        if baseline and name in baseline and baseline[name]['median']:
+            line += "  %+6.1f%%" % ((r['median'] / baseline[name]['median']
+                                     - 1) * 100)
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m zkit.benchmark',
+                                     description=__doc__.split('\n\n')[0])
+    parser.add_argument('names', nargs='*', metavar='scenario',
+                        help='scenarios to run; default is all')
+    parser.add_argument('--scale', type=float, default=1.,
+                        help='multiplies sprites, queries and map area')
+    parser.add_argument('--repeat', type=int, default=50,
+                        help='timed steps of each scenario')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', metavar='FILE',
+                        help='write results as a baseline')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare results with a baseline')
+    parser.add_argument('--threshold', type=float, default=.1,
+                        help='growth of the median flagged as regression')
+    parser.add_argument('--output', metavar='FILE',
+                        help='also write the report to a file')
+    parser.add_argument('--list', action='store_true',
+                        help='list scenarios and exit')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        print("\n".join(scenarios))
+        return 0
+
+    names = args.names or list(scenarios)
+    unknown = [name for name in names if name not in scenarios]
+    if unknown:
+        parser.error("unknown scenario: %s" % ", ".join(unknown))
+
+    pygame.init()
+    results = OrderedDict()
+    for name in names:
+        results[name] = run_scenario(name, args.scale, args.repeat,
+                                     seed=args.seed)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+
+    text = report(results, baseline)
+    regressions = list()
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for name, ratio in regressions:
+            text += "\nREGRESSION %s: median is %.2fx the baseline" % (
+                name, ratio)
+    print(text)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.write(text + "\n")
+    if args.save:
+        with open(args.save, 'w') as fp:
+            json.dump(results, fp, indent=2)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""
+Broadphase for sprite vs. sprite collisions.
+
+collide_hex measures distance after projecting axial coords onto the hex
+plane.  The sprite coordinates used by the physics are that same plane,
+rotated, so distances between sprite positions are the distances that
+collide_hex tests.  The spatial hash can therefore bucket sprite positions
+directly, without converting to axial coords.
+"""
+from math import floor
+
+
+__all__ = ['SpatialHash']
+
+
+class SpatialHash(object):
+    """Uniform grid of buckets for finding items near a point
+
+    Items are stored in the bucket containing their position.  Moving an
+    item only touches the buckets when it crosses into a new one.  The
+    bucket size should be about the diameter of the largest item.
+
+    :param cell_size: width and height of a bucket
+    """
+
+    def __init__(self, cell_size=2.0):
+        self.cell_size = float(cell_size)
+        self.max_radius = 0.0
+        self.buckets = dict()
+        self.keys = dict()
+
+    def key(self, x, y):
+        size = self.cell_size
+        return int(floor(x / size)), int(floor(y / size))
+
+    def __contains__(self, item):
+        return item in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def insert(self, item, x, y, radius=0.0):
+        if item in self.keys:
+            self.remove(item)
+        if radius > self.max_radius:
+            self.max_radius = radius
+        key = self.key(x, y)
+        self.keys[item] = key
+        try:
+            self.buckets[key].add(item)
+        except KeyError:
+            self.buckets[key] = {item}
+
+    def move(self, item, x, y):
+        key = self.key(x, y)
+        old = self.keys[item]
+        if key == old:
+            return
+        bucket = self.buckets[old]
+        bucket.discard(item)
+        if not bucket:
+            del self.buckets[old]
+        self.keys[item] = key
+        try:
+            self.buckets[key].add(item)
+        except KeyError:
+            self.buckets[key] = {item}
+
+    def remove(self, item):
+        key = self.keys.pop(item, None)
+        if key is None:
+            return
+        bucket = self.buckets[key]
+        bucket.discard(item)
+        if not bucket:
+            del self.buckets[key]
+
+    def query(self, x, y, reach):
+        """Return list of items in the buckets within reach of a point
+
+        The items are only candidates; they can be up to a bucket further
+        away than reach.
+        """
+        size = self.cell_size
+        x0 = int(floor((x - reach) / size))
+        x1 = int(floor((x + reach) / size))
+        y0 = int(floor((y - reach) / size))
+        y1 = int(floor((y + reach) / size))
+        buckets = self.buckets
+        retval = list()
+        for bx in range(x0, x1 + 1):
+            for by in range(y0, y1 + 1):
+                bucket = buckets.get((bx, by))
+                if bucket:
+                    retval.extend(bucket)
+        return retval
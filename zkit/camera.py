@@ -0,0 +1,71 @@
+"""
+Camera of a map view.
+
+The camera keeps its position in pixels of the map layer at zoom 1, so
+zooming does not move it.  At any zoom, the map layer is drawn with cells
+of radius * zoom, and the camera position in the map layer is
+position * zoom.
+"""
+from math import floor
+
+from pygame import Rect
+
+from zkit.euclid import Vector2
+
+
+__all__ = ['Camera']
+
+
+class Camera(object):
+    """Position and zoom of a view of the map
+
+    :param position: point of the map at the center of the screen, in
+                     pixels at zoom 1, or None to center on the map
+    :param zoom: scale of the map
+    """
+    min_zoom = .25
+    max_zoom = 4.
+
+    def __init__(self, position=None, zoom=1.):
+        self.position = None
+        if position is not None:
+            self.position = Vector2(*position)
+        self.zoom = float(zoom)
+
+    def look_at(self, x, y):
+        """Put a point of the map, in pixels at zoom 1, at the center"""
+        self.position = Vector2(x, y)
+
+    def pan(self, dx, dy):
+        """Move the camera by some pixels of the screen"""
+        zoom = self.zoom
+        self.position.x += dx / zoom
+        self.position.y += dy / zoom
+
+    def zoom_to(self, zoom, anchor=None):
+        """Change the zoom
+
+        :param zoom: new zoom; clamped to min_zoom and max_zoom
+        :param anchor: offset from the center of the screen of a point
+                       which stays over the same place of the map
+        """
+        zoom = min(max(float(zoom), self.min_zoom), self.max_zoom)
+        if anchor is not None and self.position is not None:
+            ax, ay = anchor
+            self.position.x += ax / self.zoom - ax / zoom
+            self.position.y += ay / self.zoom - ay / zoom
+        self.zoom = zoom
+
+    def zoom_by(self, factor, anchor=None):
+        """Multiply the zoom by factor; see zoom_to"""
+        self.zoom_to(self.zoom * factor, anchor)
+
+    def viewport(self, size):
+        """Return rect of the map layer in view, at the current zoom
+
+        :param size: size of the screen
+        """
+        w, h = size
+        x = int(floor(self.position.x * self.zoom - w / 2.))
+        y = int(floor(self.position.y * self.zoom - h / 2.))
+        return Rect(x, y, w, h)
@@ -0,0 +1,133 @@
+"""
+Cache of map layer chunks.
+
+The map layer is split into square chunks of pixels.  Chunks are rendered
+when they are first needed and kept until the cache goes over its memory
+budget, when the least recently used chunks are dropped.  Only chunks
+which intersect the viewport are ever rendered, so memory and the cost of
+a frame do not grow with the size of the map.
+
+Besides its surface, a chunk keeps the surfaces cut from it to draw over
+sprites, so they are made, counted and dropped with it.
+"""
+from collections import OrderedDict
+from math import floor
+
+from pygame import Rect
+
+
+__all__ = ['Chunk',
+           'ChunkCache']
+
+
+def surface_bytes(surface):
+    return surface.get_bytesize() * surface.get_width() * \
+        surface.get_height()
+
+
+class Chunk(object):
+    """Surface of a chunk, and the surfaces cut from it
+
+    :param surface: surface of the chunk
+    :param upper: list of objects with a surface, drawn over sprites
+    """
+    __slots__ = ['surface', 'upper', 'nbytes']
+
+    def __init__(self, surface, upper=None):
+        self.surface = surface
+        self.upper = list() if upper is None else upper
+        self.nbytes = 0
+        self.measure()
+
+    def measure(self):
+        """Count the bytes of the surfaces, and return them"""
+        self.nbytes = surface_bytes(self.surface) + \
+            sum(surface_bytes(i.surface) for i in self.upper)
+        return self.nbytes
+
+
+class ChunkCache(object):
+    """LRU cache of chunks with a memory budget
+
+    :param size: width and height of a chunk, in pixels
+    :param budget: bytes of surfaces to keep
+    :param render: function that takes a chunk rect and returns a Chunk
+    """
+
+    def __init__(self, size, budget, render):
+        self.size = int(size)
+        self.budget = budget
+        self.render = render
+        self.chunks = OrderedDict()
+        self.nbytes = 0
+
+        # chunks in view are not dropped, even if over budget
+        self.pinned = set()
+
+    def __contains__(self, key):
+        return key in self.chunks
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def rect(self, key):
+        """Return rect of the map layer covered by a chunk"""
+        size = self.size
+        return Rect(key[0] * size, key[1] * size, size, size)
+
+    def keys(self, rect):
+        """Return keys of all chunks which intersect rect"""
+        size = float(self.size)
+        x0 = int(floor(rect.left / size))
+        x1 = int(floor((rect.right - 1) / size))
+        y0 = int(floor(rect.top / size))
+        y1 = int(floor((rect.bottom - 1) / size))
+        return [(x, y) for y in range(y0, y1 + 1) for x in range(x0, x1 + 1)]
+
+    def get(self, key):
+        """Return a Chunk, rendering it if it is not cached"""
+        chunks = self.chunks
+        try:
+            chunk = chunks[key]
+        except KeyError:
+            chunk = self.render(self.rect(key))
+            chunks[key] = chunk
+            self.nbytes += chunk.nbytes
+            self.evict(key)
+        else:
+            chunks.move_to_end(key)
+        return chunk
+
+    def changed(self, key):
+        """Count the size of a cached chunk again, after it was changed"""
+        chunk = self.chunks[key]
+        old = chunk.nbytes
+        self.nbytes += chunk.measure() - old
+
+    def cached(self, rect):
+        """Return (key, Chunk) of the cached chunks which intersect rect"""
+        chunks = self.chunks
+        return [(key, chunks[key]) for key in self.keys(rect)
+                if key in chunks]
+
+    def evict(self, keep=None):
+        """Drop least recently used chunks until under budget
+
+        :param keep: key of a chunk not to drop, besides the pinned ones
+        """
+        pinned = self.pinned
+        for key in list(self.chunks):
+            if self.nbytes <= self.budget:
+                break
+            if key not in pinned and key != keep:
+                self.discard(key)
+
+    def discard(self, key):
+        chunk = self.chunks.pop(key, None)
+        if chunk is not None:
+            self.nbytes -= chunk.nbytes
+
+    def clear(self):
+        self.chunks.clear()
+        self.pinned.clear()
+        self.nbytes = 0
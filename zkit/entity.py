@@ -203,12 +203,13 @@ class GameEntity(pygame.sprite.DirtySprite):
                 group.needs_refresh = True
 
     def handle_internal_events(self, scene):
-        events = filter_belong(self, filter_interested(scene, ('Collision',)))
+        bus = scene.events
+        events = filter_belong(self, bus.involving('Collision', self))
         for event, other in events:
             self.on_collide(scene, other)
             self._collided.add(other)
 
-        events = filter_belong(self, filter_interested(scene, ('Separation',)))
+        events = filter_belong(self, bus.involving('Separation', self))
         for event, other in events:
             self.on_separate(scene, other)
             try:
@@ -254,13 +255,18 @@ class Rock(GameEntity):
 
 
 class Door(GameEntity):
-    def __init__(self, filename, key, cell):
+    def __init__(self, filename, key, cell, coords):
         super(Door, self).__init__(filename)
-        assert (key is not None and cell is not None)
+        assert (key is not None and cell is not None and coords is not None)
         self.key = key
         self.cell = cell
+        self.coords = coords
         self.visible = False
 
+    def cell_changed(self, scene):
+        scene.model.touch_cell(self.coords)
+        scene.view.invalidate_cell(self.coords)
+
     def handle_internal_events(self, scene):
         interested = scene.state['events'].get('Switch', None)
         if not interested:
@@ -276,13 +282,13 @@ class Door(GameEntity):
                     cell.filename = 'tileMagic_full.png'
                     cell.height = 3
                     cell.raised = True
-                    self.trigger_view_refresh()
+                    self.cell_changed(scene)
             else:
                 if cell.raised:
                     cell.filename = 'tileGrass_full.png'
                     cell.height = 0
                     cell.raised = False
-                    self.trigger_view_refresh()
+                    self.cell_changed(scene)
 
 
 class CallbackEntity(GameEntity):
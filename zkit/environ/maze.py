@@ -1,6 +1,9 @@
 import itertools
 import random
 
+from zkit.environ import util
+from zkit.hex_model import HexMapModel, Cell, evenr_to_axial
+
 
 def build_maze_from_hex(model, lower_limit=None, upper_limit=None,
                         height=1.0,
@@ -8,7 +11,7 @@ def build_maze_from_hex(model, lower_limit=None, upper_limit=None,
                         lowered_tile='tileGrass.png',
                         num_adjacent=1,
                         start_raised=True,
-                        closed_set=set()):
+                        closed_set=None):
     def available_neighbors(coord):
         return [c for c in neighbors(coord) if coord_available(c)]
 
@@ -32,6 +35,9 @@ def build_maze_from_hex(model, lower_limit=None, upper_limit=None,
         cell.height = 0.0
         cell.filename = lowered_tile
 
+    if closed_set is None:
+        closed_set = set()
+
     if start_raised:
         # Set all cells to raised
         for cell in model.cells:
@@ -65,7 +71,7 @@ def build_maze_from_hex(model, lower_limit=None, upper_limit=None,
         except IndexError:
             current = open_heap.pop()
         open_neighbors = available_neighbors(current)
-    return
+    model.touch_cell()
 
 
 def new_maze(map_width=10,
@@ -73,8 +79,9 @@ def new_maze(map_width=10,
              tile_height=1.0,
              raised_tile='tileRock_full.png',
              lowered_tile='tileGrass.png',
-             num_adjacent=1):
-    model = HexMapModel()
+             num_adjacent=1,
+             model_class=HexMapModel):
+    model = model_class()
     for q, r in itertools.product(range(map_width), range(map_height)):
         coords = evenr_to_axial((q, r))
         cell = Cell()
@@ -0,0 +1,212 @@
+"""
+Scene event bus.
+
+Events raised in a scene are kwargs dicts, kept for a number of frames so
+everything updated in the frame after the event can see it.  Events are
+stored in generations, one for each frame, and each generation indexes its
+events by name and by participant (the originator, left and right of the
+event), so finding the events of one entity does not scan every event in
+the scene.  Expiring events drops whole generations.
+
+The bus can be used like the old dict of lists in scene.state['events']:
+bus.get(name, default) and bus[name] return a list of the live events
+with that name, oldest first, and events can be read like the old kwargs
+dicts, with event['left'] or event.get('key').
+
+Events are slotted records which are reused once they expire, so do not
+keep a reference to an event after the frame it was handled in.
+"""
+from collections import deque
+
+
+__all__ = ['EventBus',
+           'SceneEvent']
+
+
+class SceneEvent(object):
+    """Event raised in a scene
+
+    Contact events only need the participants, so other kwargs of the
+    event are kept in extra, which is None if there are none.  originator,
+    left and right are always keys of the event, and are None if they
+    were not given.
+    """
+    __slots__ = ['name', 'originator', 'left', 'right', 'extra']
+
+    def __init__(self, name=None, originator=None, left=None, right=None,
+                 extra=None):
+        self.name = name
+        self.originator = originator
+        self.left = left
+        self.right = right
+        self.extra = extra
+
+    def __getitem__(self, key):
+        if key == 'originator':
+            return self.originator
+        if key == 'left':
+            return self.left
+        if key == 'right':
+            return self.right
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __repr__(self):
+        return "<SceneEvent %r>" % self.name
+
+
+class Generation(object):
+    """Events raised in one frame"""
+    __slots__ = ['by_name', 'by_participant']
+
+    def __init__(self):
+        self.by_name = dict()
+        self.by_participant = dict()
+
+
+class EventBus(object):
+    """Events of a scene, indexed by name and by participant
+
+    :param lifetime: number of calls to expire an event survives; the
+                     default of 2 keeps events raised during one update
+                     until the end of the next update
+    """
+
+    def __init__(self, lifetime=2):
+        self.lifetime = lifetime
+        self.generations = deque([Generation()])
+
+        # expired events, to be reused
+        self.pool = list()
+
+    def raise_event(self, originator, event_name, **kwargs):
+        """Add an event to the current generation and return it"""
+        try:
+            event = self.pool.pop()
+        except IndexError:
+            event = SceneEvent()
+        left = kwargs.pop('left', None)
+        right = kwargs.pop('right', None)
+        event.name = event_name
+        event.originator = originator
+        event.left = left
+        event.right = right
+        event.extra = kwargs or None
+        generation = self.generations[-1]
+
+        try:
+            generation.by_name[event_name].append(event)
+        except KeyError:
+            generation.by_name[event_name] = [event]
+
+        by_participant = generation.by_participant
+        participants = [originator] if originator is not None else []
+        if left is not None and left is not originator:
+            participants.append(left)
+        if right is not None and right is not originator and \
+                right is not left:
+            participants.append(right)
+        for participant in participants:
+            index = event_name, participant
+            try:
+                by_participant[index].append(event)
+            except KeyError:
+                by_participant[index] = [event]
+            except TypeError:
+                # unhashable participants cannot be looked up
+                pass
+        return event
+
+    def expire(self):
+        """Start a new generation, dropping the oldest one if it is due"""
+        generations = self.generations
+        if len(generations) < self.lifetime:
+            generations.append(Generation())
+        else:
+            generation = generations.popleft()
+            self._recycle(generation)
+            generations.append(generation)
+
+    def clear(self):
+        generations = self.generations
+        for generation in generations:
+            self._recycle(generation)
+        generation = generations.pop()
+        generations.clear()
+        generations.append(generation)
+
+    def _recycle(self, generation):
+        pool = self.pool
+        for events in generation.by_name.values():
+            for event in events:
+                event.originator = event.left = event.right = None
+                event.extra = None
+            pool.extend(events)
+        generation.by_name.clear()
+        generation.by_participant.clear()
+
+    def get(self, event_name, default=None):
+        """Return list of live events with the name, or default"""
+        retval = list()
+        for generation in self.generations:
+            events = generation.by_name.get(event_name)
+            if events:
+                retval.extend(events)
+        if retval:
+            return retval
+        return default
+
+    def involving(self, event_name, participant):
+        """Return list of live events with the name, and the participant as
+        originator, left or right
+        """
+        retval = list()
+        index = event_name, participant
+        for generation in self.generations:
+            events = generation.by_participant.get(index)
+            if events:
+                retval.extend(events)
+        return retval
+
+    def names(self):
+        """Return set of the names of all live events"""
+        retval = set()
+        for generation in self.generations:
+            retval.update(generation.by_name)
+        return retval
+
+    def __getitem__(self, event_name):
+        events = self.get(event_name)
+        if events is None:
+            raise KeyError(event_name)
+        return events
+
+    def __contains__(self, event_name):
+        return any(event_name in generation.by_name
+                   for generation in self.generations)
+
+    def __iter__(self):
+        return iter(self.names())
+
+    def __len__(self):
+        return len(self.names())
+
+    def keys(self):
+        return self.names()
+
+    def items(self):
+        return [(name, self[name]) for name in self.names()]
@@ -1,3 +1,6 @@
+from operator import attrgetter
+from time import perf_counter
+
 from pygame.sprite import Group
 
 from heapq import heappush
@@ -16,95 +19,264 @@ def subscribe(event_key, **filter_kwargs):
     return decorator
 
 
+def compile_filters(filter_kwargs):
+    """Return function which tests if an event matches filters
+
+    The attributes of the event are checked in order, and checking stops
+    at the first that does not match.  Returns None if there are no
+    filters, so every event matches.
+    """
+    if not filter_kwargs:
+        return None
+
+    if len(filter_kwargs) == 1:
+        (key, value), = filter_kwargs.items()
+        get = attrgetter(key)
+
+        def match(event):
+            return get(event) == value
+        return match
+
+    filters = [(attrgetter(k), v) for k, v in filter_kwargs.items()]
+
+    def match(event):
+        for get, value in filters:
+            if get(event) != value:
+                return False
+        return True
+    return match
+
+
 class Subscription(object):
+    """Handler of a sprite for events with a key
+
+    filter_kwargs is compiled into the match function when the
+    subscription is made; after changing it, call compile_filters.
+    """
 
     def __init__(self, handler, event_key, **filter_kwargs):
         self.handler = handler
         self.event_key = event_key
         self.filter_kwargs = filter_kwargs
         self.sprite = None
+        self.match = None
+        self.compile_filters()
+
+    def compile_filters(self):
+        self.match = compile_filters(self.filter_kwargs)
 
     def execute_handler(self, event, delta):
         self.handler(self.sprite, event, delta)
 
 
+class EventQueue(object):
+    """Priority queue of sprite events
+
+    Events are kept in a list for each priority, and the priorities in a
+    heap, so pushing and popping events of a priority already in the queue
+    does not touch the heap, and events are never compared.  The smaller
+    the priority number, the sooner the event is popped.  Events with the
+    same priority are popped in reverse insertion order.
+
+    max_depth is the largest number of events the queue has held since
+    it was last reset.
+    """
+
+    def __init__(self):
+        self.buckets = dict()
+        self.priorities = list()
+        self.depth = 0
+        self.max_depth = 0
+
+    def __len__(self):
+        return self.depth
+
+    def __bool__(self):
+        return self.depth > 0
+
+    def push(self, priority, event):
+        try:
+            self.buckets[priority].append(event)
+        except KeyError:
+            self.buckets[priority] = [event]
+            heappush(self.priorities, priority)
+        self.depth += 1
+        if self.depth > self.max_depth:
+            self.max_depth = self.depth
+
+    def pop(self):
+        """Return (priority, event) of the next event
+
+        :raises IndexError: if the queue is empty
+        """
+        priority = self.priorities[0]
+        bucket = self.buckets[priority]
+        event = bucket.pop()
+        if not bucket:
+            del self.buckets[priority]
+            heappop(self.priorities)
+        self.depth -= 1
+        return priority, event
+
+    def clear(self):
+        self.buckets.clear()
+        del self.priorities[:]
+        self.depth = 0
+
+    def reset_max_depth(self):
+        self.max_depth = self.depth
+
+
 class EventGroup(Group):
 
     class PossibleInfiniteEventLoopError(Exception):
         pass
 
     MAX_SPRITE_EVENTS_PER_UPDATE = 100000
+    DEFAULT_EVENT_PRIORITY = 99999
 
     def __init__(self, *sprites):
+        # subscriptions by event key, and the subscriptions of each sprite
+        self.subscriptions = dict()
+        self.sprite_subscriptions = dict()
+
+        # number of removed subscriptions still in the list of each key
+        self.dead_subscriptions = dict()
+        self.sprite_events = EventQueue()
+
+        # stats of the last update; handler_times is only kept if profile
+        # is set, and holds seconds spent in handlers for each event key
+        self.profile = False
+        self.events_handled = 0
+        self.queue_depth = 0
+        self.handler_time = 0.
+        self.handler_times = dict()
         super(EventGroup, self).__init__(*sprites)
-        self.subscriptions = list()
-        self.sprite_events = list()
 
-    def add(self, *sprites):
-        super(EventGroup, self).add(*sprites)
-        for sprite in sprites:
-            self.bind_subscriptions(sprite)
+    def add_internal(self, sprite, layer=None):
+        super(EventGroup, self).add_internal(sprite)
+        self.bind_subscriptions(sprite)
+
+    def remove_internal(self, sprite):
+        super(EventGroup, self).remove_internal(sprite)
+        self.unbind_subscriptions(sprite)
 
     def bind_subscriptions(self, sprite):
-        for key in dir(sprite):
-            value = getattr(sprite, key)
+        # look at the class attributes, so properties are not evaluated
+        instance_dict = getattr(sprite, "__dict__", {})
+        for key, value in instance_dict.items():
             if self._is_event_handler_function(key, value):
                 self._bind_subscription(sprite, value)
+        seen = set(instance_dict)
+        for cls in type(sprite).__mro__:
+            for key, value in vars(cls).items():
+                if key in seen:
+                    continue
+                seen.add(key)
+                if self._is_event_handler_function(key, value):
+                    self._bind_subscription(sprite, getattr(sprite, key))
+
+    def unbind_subscriptions(self, sprite):
+        # removed subscriptions are left in the lists of their keys, and
+        # skipped by _handle_event; a list is compacted once more than half
+        # of it is dead, so removing many sprites takes linear time
+        subscriptions = self.sprite_subscriptions.pop(sprite, ())
+        dead = self.dead_subscriptions
+        for subscription in subscriptions:
+            subscription.sprite = None
+            key = subscription.event_key
+            count = dead.get(key, 0) + 1
+            if count * 2 > len(self.subscriptions[key]):
+                self._compact_subscriptions(key)
+            else:
+                dead[key] = count
+
+    def _compact_subscriptions(self, key):
+        # a new list is made, instead of changing the old one, because
+        # the old one may be in use by _handle_event
+        self.dead_subscriptions.pop(key, None)
+        remaining = [i for i in self.subscriptions[key]
+                     if i.sprite is not None]
+        if remaining:
+            self.subscriptions[key] = remaining
+        else:
+            del self.subscriptions[key]
 
     def _is_event_handler_function(self, key, value):
-        return callable(value) and key.startswith("on_")
+        return key.startswith("on_") and callable(value)
 
     def _bind_subscription(self, sprite, subscription_factory):
         subscription = subscription_factory()
         subscription.sprite = sprite
-        self.subscriptions.append(subscription)
+        key = subscription.event_key
+        try:
+            self.subscriptions[key].append(subscription)
+        except KeyError:
+            self.subscriptions[key] = [subscription]
+        try:
+            self.sprite_subscriptions[sprite].append(subscription)
+        except KeyError:
+            self.sprite_subscriptions[sprite] = [subscription]
 
     def update(self, events, delta):
         super(EventGroup, self).update(delta)
-        self._unsubscribe_removed_sprites()
         # first handle passed-in events (presumably pygame events)
         for event in events:
             self._handle_event(event, delta)
 
         # now handle sprite published events until they are exhausted
         # NOTE: It's possible to get into an infinite loop here
+        queue = self.sprite_events
+        queue.reset_max_depth()
+        handle = self._handle_event
+        if self.profile:
+            self.handler_times.clear()
+            handle = self._profile_event
         events_handled = 0
-        while self.sprite_events:
-            _, event = heappop(self.sprite_events)
-            self._handle_event(event, delta)
-            events_handled += 1
-            if events_handled > self.MAX_SPRITE_EVENTS_PER_UPDATE:
-                msg = INFINITE_UPDATE_MSG % events_handled
-                raise self.PossibleInfiniteEventLoopError(msg)
-
-    def _unsubscribe_removed_sprites(self):
-        remaining_valid_subscriptions = list()
-        for subscription in self.subscriptions:
-            if self.has(subscription.sprite):
-                remaining_valid_subscriptions.append(subscription)
-        self.subscriptions = remaining_valid_subscriptions
+        start = perf_counter()
+        try:
+            while queue:
+                _, event = queue.pop()
+                handle(event, delta)
+                events_handled += 1
+                if events_handled > self.MAX_SPRITE_EVENTS_PER_UPDATE:
+                    msg = INFINITE_UPDATE_MSG % events_handled
+                    raise self.PossibleInfiniteEventLoopError(msg)
+        finally:
+            self.handler_time = perf_counter() - start
+            self.events_handled = events_handled
+            self.queue_depth = queue.max_depth
 
     def _get_matching_subscription(self, event):
         # Note that the event can either be a pygame event, or any type
         # that has an event_key property
-        for subscription in self.subscriptions:
-            if hasattr(event, "type"):
-                key = event.type
-            else:
-                key = event.event_key
+        try:
+            key = event.type
+        except AttributeError:
+            key = event.event_key
 
-            event_key = subscription.event_key
-            filters = subscription.filter_kwargs
-            if event_key == key and self._filters_match(event, **filters):
+        for subscription in self.subscriptions.get(key, ()):
+            # sprites removed by an earlier handler do not get the event
+            if subscription.sprite is None:
+                continue
+            match = subscription.match
+            if match is None or match(event):
                 yield subscription
 
-    def _filters_match(self, event, **filter_kwargs):
-        return all(getattr(event, k) == v for k, v in filter_kwargs.items())
-
     def _handle_event(self, event, delta):
         for subscription in self._get_matching_subscription(event):
             subscription.execute_handler(event, delta)
 
+    def _profile_event(self, event, delta):
+        start = perf_counter()
+        self._handle_event(event, delta)
+        elapsed = perf_counter() - start
+        key = getattr(event, "type", None)
+        if key is None:
+            key = event.event_key
+        times = self.handler_times
+        times[key] = times.get(key, 0.) + elapsed
+
     @staticmethod
     def publish(sprite, event):
         for group in sprite.groups():
@@ -114,12 +286,13 @@ class EventGroup(Group):
     def publish_event(self, event):
         """Publish a sprite event to be handled during the current update.
 
-Sprite events are pushed into a priority heap. Event objects can set a
+Sprite events are pushed into a priority queue. Event objects can set a
 event_priority attribute to cause themselves to be executed in an arbitrary
 order. The smaller the event_priority number, the higher priority the event
 is. When events have the same event_priority they will be executed in reverse
 insertion order. The default priority is assumed to be 99999
 
         """
-        event_priority = getattr(event, "event_priority", 99999)
-        heappush(self.sprite_events, (event_priority, event))
+        event_priority = getattr(event, "event_priority",
+                                 self.DEFAULT_EVENT_PRIORITY)
+        self.sprite_events.push(event_priority, event)
@@ -0,0 +1,297 @@
+"""
+Flow fields (Dijkstra maps) for many agents sharing one goal.
+
+A flow field stores the cost from every reachable cell to the goal and the
+next cell to step into.  It is built once and every agent looks up its next
+step in O(1):
+
+    field = model.flow_field(hero_coords)
+    next_coords = field.next_step(my_coords)
+
+Costs use the same rules as pathfind: entering a cell costs 1 + cell.cost
+and raised cells are never entered.
+
+When a cell changes, HexMapModel.touch_cell repairs the fields that cover
+it; only the cells whose route passes through the changed cell, and the
+cells it opens up, are searched again.
+"""
+from heapq import heappush, heappop
+
+import numpy
+
+from zkit.environ import util
+
+inf = float('inf')
+
+
+__all__ = ['FlowField',
+           'ArrayFlowField']
+
+
+class FlowField(object):
+    """Flow field for any HexMapModel
+
+    :param model: HexMapModel
+    :param goal: axial coords of the goal
+    :param max_cost: cells which cost more than this to reach the goal are
+                     not included.  None for no limit.
+    """
+
+    def __init__(self, model, goal, max_cost=None):
+        self.model = model
+        self.goal = int(goal[0]), int(goal[1])
+        self.max_cost = max_cost
+        self._distance = dict()
+        self._next = dict()
+        self._build()
+
+    def _build(self):
+        self._distance.clear()
+        self._next.clear()
+        if self.goal not in self.model._data:
+            return
+        self._distance[self.goal] = 0
+        self._search([(0, self.goal)])
+
+    def _search(self, heap):
+        """Dijkstra from the cells in heap, which have their distance"""
+        neighbors = self.model.neighbor_table()
+        cells = self.model._data
+        max_cost = self.max_cost
+        distance = self._distance
+        next_step = self._next
+        while heap:
+            d, current = heappop(heap)
+            if d > distance.get(current, inf):
+                continue
+            # stepping from a neighbor into current costs this much
+            d += 1 + cells[current].cost
+            if max_cost is not None and d > max_cost:
+                continue
+            for coords in neighbors.get(current, ()):
+                if d < distance.get(coords, d + 1) and \
+                        not cells[coords].raised:
+                    distance[coords] = d
+                    next_step[coords] = current
+                    heappush(heap, (d, coords))
+
+    def repair(self, coords):
+        """Update the field after the cell at coords changed
+
+        The cells whose route to the goal passes through the changed cell
+        lose their distance, and get it back from their neighbors that
+        kept theirs; a search from them also spreads any shortcut the
+        change made.
+        """
+        coords = int(coords[0]), int(coords[1])
+        if coords == self.goal:
+            self._build()
+            return
+
+        distance = self._distance
+        next_step = self._next
+        surrounding = util.surrounding_noclip
+
+        # the changed cell and every cell which steps through it
+        lost = [coords]
+        frontier = [coords]
+        while frontier:
+            current = frontier.pop()
+            for n in surrounding(current):
+                if next_step.get(n) == current:
+                    lost.append(n)
+                    frontier.append(n)
+        for n in lost:
+            distance.pop(n, None)
+            next_step.pop(n, None)
+
+        # each lost cell starts from its best neighbor which kept its
+        # distance
+        neighbors = self.model.neighbor_table()
+        cells = self.model._data
+        max_cost = self.max_cost
+        heap = list()
+        for n in lost:
+            cell = cells.get(n)
+            if cell is None or cell.raised:
+                continue
+            best = best_step = None
+            for step in neighbors.get(n, ()):
+                d = distance.get(step)
+                if d is None:
+                    continue
+                d += 1 + cells[step].cost
+                if max_cost is not None and d > max_cost:
+                    continue
+                if best is None or d < best:
+                    best = d
+                    best_step = step
+            if best is not None:
+                distance[n] = best
+                next_step[n] = best_step
+                heappush(heap, (best, n))
+        self._search(heap)
+
+    def __contains__(self, coords):
+        return (int(coords[0]), int(coords[1])) in self._distance
+
+    def __len__(self):
+        return len(self._distance)
+
+    def distance(self, coords):
+        """Return cost to reach the goal from coords, or None"""
+        return self._distance.get((int(coords[0]), int(coords[1])))
+
+    def next_step(self, coords):
+        """Return coords of the next cell towards the goal, or None
+
+        None is returned for the goal and for cells outside of the field.
+        """
+        return self._next.get((int(coords[0]), int(coords[1])))
+
+    def path(self, coords):
+        """Return list of coords from coords to the goal, or None"""
+        coords = int(coords[0]), int(coords[1])
+        if coords not in self:
+            return None
+        path = [coords]
+        while coords != self.goal:
+            coords = self.next_step(coords)
+            path.append(coords)
+        return path
+
+    def affected_by(self, coords):
+        """True if a change to the cell at coords may change this field"""
+        if coords is None:
+            return True
+        coords = int(coords[0]), int(coords[1])
+        if coords in self._distance:
+            return True
+        distance = self._distance
+        return any(n in distance for n in util.surrounding_noclip(coords))
+
+
+class ArrayFlowField(FlowField):
+    """Flow field for an ArrayHexMapModel
+
+    The search runs on flat plane indices instead of coordinate tuples, and
+    the directions are picked for all cells at once with numpy.  Planes are
+    padded by one cell on each side, so neighbors never wrap around rows.
+    """
+
+    def _build(self):
+        array = self.model._data
+        self._generation = array.generation
+        rows, cols = array.shape
+        self._col0, self._row0 = array.origin
+        self._width = width = cols + 2
+        self._height = rows + 2
+
+        # cost of stepping into each cell, inf if it cannot be entered
+        enter = numpy.full((rows + 2, width), inf)
+        open_cells = array.plane('present') & ~array.plane('raised')
+        enter[1:-1, 1:-1] = numpy.where(
+            open_cells, 1.0 + array.plane('cost'), inf)
+        enter = enter.ravel()
+
+        # flat neighbor offsets for each parity of row
+        offsets = list()
+        for parity in (0, 1):
+            row = list()
+            for dq, dr in util.neighbor_mat:
+                r1 = parity + dr
+                dc = dq + ((r1 + (r1 & 1)) >> 1) - parity
+                row.append(dr * width + dc)
+            offsets.append(row)
+        row_parity = ((numpy.arange(rows + 2) + self._row0 - 1) & 1).tolist()
+
+        distance = numpy.full(enter.shape, inf)
+        goal = self._index(self.goal)
+        if goal < 0 or not array.has(self.goal):
+            self._distance = distance
+            self._next = numpy.full(enter.shape, -1, dtype=numpy.intp)
+            return
+
+        max_cost = inf if self.max_cost is None else self.max_cost
+        enter_list = enter.tolist()
+        dist = distance.tolist()
+        goal_cost = 1 + array.cost[array.index(self.goal)]
+        dist[goal] = 0.0
+        heap = [(0.0, goal)]
+        while heap:
+            d, i = heappop(heap)
+            if d > dist[i]:
+                continue
+            d += enter_list[i] if i != goal else goal_cost
+            if d > max_cost:
+                continue
+            for o in offsets[row_parity[i // width]]:
+                j = i + o
+                if d < dist[j] and enter_list[j] != inf:
+                    dist[j] = d
+                    heappush(heap, (d, j))
+
+        distance = numpy.array(dist)
+        self._distance = distance
+
+        # the next step of a cell is the neighbor with the cheapest
+        # cost to the goal, including the cost of stepping into it
+        inner = numpy.flatnonzero(numpy.isfinite(distance))
+        parity = numpy.repeat(numpy.array(row_parity), width)[inner]
+        neighbor_index = inner[:, None] + numpy.array(offsets)[parity]
+        through = distance[neighbor_index] + enter[neighbor_index]
+        through[neighbor_index == goal] = goal_cost
+        best = numpy.argmin(through, axis=1)
+        next_step = numpy.full(enter.shape, -1, dtype=numpy.intp)
+        next_step[inner] = neighbor_index[numpy.arange(len(inner)), best]
+        next_step[goal] = -1
+        self._next = next_step
+
+    def _index(self, coords):
+        q, r = int(coords[0]), int(coords[1])
+        col = q + ((r + (r & 1)) >> 1) - self._col0 + 1
+        row = r - self._row0 + 1
+        if 0 < col < self._width - 1 and 0 < row < self._height - 1:
+            return row * self._width + col
+        return -1
+
+    def _coords(self, index):
+        row, col = divmod(index, self._width)
+        row += self._row0 - 1
+        col += self._col0 - 1
+        return col - ((row + (row & 1)) >> 1), row
+
+    def __contains__(self, coords):
+        i = self._index(coords)
+        return i >= 0 and self._distance.item(i) != inf
+
+    def __len__(self):
+        return int(numpy.isfinite(self._distance).sum())
+
+    def distance(self, coords):
+        i = self._index(coords)
+        if i < 0:
+            return None
+        d = self._distance.item(i)
+        return None if d == inf else d
+
+    def next_step(self, coords):
+        i = self._index(coords)
+        if i < 0:
+            return None
+        j = self._next.item(i)
+        return None if j < 0 else self._coords(j)
+
+    def repair(self, coords):
+        # the whole field is searched again; the plane search is fast
+        # enough that tracking the cells which step through coords does
+        # not pay for itself
+        self._build()
+
+    def affected_by(self, coords):
+        if coords is None or \
+                self._generation != self.model._data.generation:
+            return True
+        if coords in self:
+            return True
+        return any(n in self for n in util.surrounding_noclip(coords))
@@ -0,0 +1,412 @@
+"""
+Dense storage for hex maps.
+
+HexMapModel normally keeps one Cell object per coordinate in a dict.  That
+is fine for the small pyweek maps, but generated maps get large quickly.
+CellArray keeps the cell attributes in flat, contiguous planes indexed by
+even-r offset coordinates and hands out lightweight CellView objects which
+read and write through to the planes.
+
+Each plane is a python buffer (array.array or bytearray) with a numpy array
+sharing its memory.  Single cell access goes through the buffer, which is
+much quicker than indexing numpy, and bulk operations use numpy.
+
+CellArray behaves like the dict used by HexMapModel, so the model code does
+not need to know which storage is being used:
+
+    model = ArrayHexMapModel()
+    model.add_cell((0, 0), Cell(filename='tileGrass.png'))
+"""
+from array import array
+
+import numpy
+
+from zkit.hex_model import HexMapModel, Cell
+from zkit.flowfield import ArrayFlowField
+from zkit.environ import util
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+
+__all__ = ['ArrayHexMapModel',
+           'CellArray',
+           'CellView']
+
+# name, array typecode (None for bytearray), numpy dtype
+plane_types = (('cost', 'i', numpy.int32),
+               ('raised', None, numpy.bool_),
+               ('height', 'f', numpy.float32),
+               ('tile', 'H', numpy.uint16),
+               ('present', None, numpy.bool_))
+
+
+def new_buffer(typecode, size):
+    if typecode is None:
+        return bytearray(size)
+    return array(typecode, bytes(array(typecode).itemsize * size))
+
+
+class CellView(object):
+    """Cell-like proxy for one cell of a CellArray
+
+    Views are cheap to create and hold no state of their own; changing an
+    attribute changes the array.  Two views of the same cell are equal.
+    """
+
+    __slots__ = ['_array', '_i', '_gen', 'coords']
+
+    def __init__(self, array, coords, index):
+        self._array = array
+        self._i = index
+        self._gen = array.generation
+        self.coords = coords
+
+    def _index(self):
+        # the index changes if the array was resized since the view was made
+        if self._gen != self._array.generation:
+            self._i = self._array.index(self.coords)
+            self._gen = self._array.generation
+        return self._i
+
+    @property
+    def cost(self):
+        return self._array.cost[self._index()]
+
+    @cost.setter
+    def cost(self, value):
+        self._array.cost[self._index()] = int(value)
+
+    @property
+    def raised(self):
+        return bool(self._array.raised[self._index()])
+
+    @raised.setter
+    def raised(self, value):
+        self._array.raised[self._index()] = 1 if value else 0
+
+    @property
+    def height(self):
+        return self._array.height[self._index()]
+
+    @height.setter
+    def height(self, value):
+        self._array.height[self._index()] = float(value)
+
+    @property
+    def filename(self):
+        return self._array.tile_names[self._array.tile[self._index()]]
+
+    @filename.setter
+    def filename(self, value):
+        self._array.tile[self._index()] = self._array.intern_tile(value)
+
+    def to_json(self):
+        return {
+            "cost": self.cost,
+            "filename": self.filename,
+            "raised": self.raised,
+            "height": self.height
+        }
+
+    def __eq__(self, other):
+        return isinstance(other, CellView) and \
+            other._array is self._array and other.coords == self.coords
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.coords)
+
+    def __repr__(self):
+        return '<CellView {}>'.format(self.coords)
+
+
+class CellArray(MutableMapping):
+    """Mapping of axial coords to cells, backed by contiguous planes
+
+    The planes are flat and row-major in even-r offset coordinates.  They
+    grow automatically when a cell is stored outside of the current bounds.
+    Filenames are interned into a small table and stored as tile ids.
+    """
+
+    def __init__(self, width=0, height=0):
+        self.generation = 0
+        self.tile_names = [None]
+        self._tile_ids = {None: 0}
+        self._col0 = 0
+        self._row0 = 0
+        self._stride = 0
+        self._rows = 0
+        self._len = 0
+        self._planes = dict()
+        self._allocate(0, 0, width, height)
+
+    def _allocate(self, col0, row0, width, height):
+        old = self._planes
+        ocol0, orow0 = self._col0, self._row0
+        ostride, orows = self._stride, self._rows
+
+        size = width * height
+        self._col0 = col0
+        self._row0 = row0
+        self._stride = width
+        self._rows = height
+        self._planes = dict()
+        for name, typecode, dtype in plane_types:
+            buf = new_buffer(typecode, size)
+            self._planes[name] = numpy.frombuffer(buf, dtype=dtype)
+            setattr(self, name, buf)
+
+        self._neighbor_offsets = [
+            [self._offset(dq, dr, parity) for dq, dr in util.neighbor_mat]
+            for parity in (0, 1)]
+        self.generation += 1
+
+        if not old or not ostride or not orows:
+            return
+
+        # copy the old planes into the new ones
+        dc = ocol0 - col0
+        dr = orow0 - row0
+        for name, prev in old.items():
+            new = self._planes[name].reshape(height, width)
+            new[dr:dr + orows, dc:dc + ostride] = prev.reshape(orows, ostride)
+
+    def _offset(self, dq, dr, parity):
+        # flat offset of an axial neighbor for a cell on a row of parity
+        r1 = parity + dr
+        dc = dq + ((r1 + (r1 & 1)) >> 1) - ((parity + parity) >> 1)
+        return dr * self._stride + dc
+
+    def _grow_to(self, col, row):
+        col0, row0 = self._col0, self._row0
+        col1, row1 = col0 + self._stride, row0 + self._rows
+        if not self._stride or not self._rows:
+            col0, row0, col1, row1 = col, row, col + 1, row + 1
+
+        # double the size on each axis that needs it, so loading maps one
+        # cell at a time does not copy the arrays for every cell
+        if col < col0:
+            col0 = col - (col1 - col0)
+        elif col >= col1:
+            col1 = col + (col1 - col0)
+        if row < row0:
+            row0 = row - (row1 - row0)
+        elif row >= row1:
+            row1 = row + (row1 - row0)
+
+        self._allocate(col0, row0, col1 - col0, row1 - row0)
+
+    @property
+    def shape(self):
+        """(rows, cols) of the 2d planes"""
+        return self._rows, self._stride
+
+    @property
+    def origin(self):
+        """even-r (col, row) of the first element of the planes"""
+        return self._col0, self._row0
+
+    def plane(self, name):
+        """Return a 2d (row, col) numpy view of an attribute plane
+
+        The view shares memory with the array, but is only valid until the
+        array is resized.
+
+        :param name: one of cost, raised, height, tile or present
+        """
+        return self._planes[name].reshape(self._rows, self._stride)
+
+    def intern_tile(self, filename):
+        try:
+            return self._tile_ids[filename]
+        except KeyError:
+            tile_id = len(self.tile_names)
+            self.tile_names.append(filename)
+            self._tile_ids[filename] = tile_id
+            return tile_id
+
+    def index(self, coords):
+        """Return the flat index for axial coords, or -1 if out of bounds"""
+        q, r = coords[0], coords[1]
+        if type(q) is not int or type(r) is not int:
+            q, r = int(q), int(r)
+        col = q + ((r + (r & 1)) >> 1) - self._col0
+        row = r - self._row0
+        if 0 <= col < self._stride and 0 <= row < self._rows:
+            return row * self._stride + col
+        return -1
+
+    def coords_at(self, index):
+        """Return the axial coords of a flat index"""
+        row, col = divmod(index, self._stride)
+        row += self._row0
+        col += self._col0
+        return col - ((row + (row & 1)) >> 1), row
+
+    def has(self, coords):
+        i = self.index(coords)
+        return i >= 0 and self.present[i] == 1
+
+    def raised_at(self, coords):
+        """True if the cell exists and is raised"""
+        i = self.index(coords)
+        return i >= 0 and self.present[i] == 1 and self.raised[i] == 1
+
+    def neighbors(self, coords, avoid_raised=True):
+        """Return list of axial coords of existing neighbors of a cell"""
+        q, r = int(coords[0]), int(coords[1])
+        i = self.index((q, r))
+        row = r - self._row0
+        col = i - row * self._stride
+        present = self.present
+        raised = self.raised
+        if i >= 0 and 0 < row < self._rows - 1 and 0 < col < self._stride - 1:
+            # fast path, all neighbors are inside of the planes
+            offsets = self._neighbor_offsets[r & 1]
+            if avoid_raised:
+                return [(q + n[0], r + n[1]) for n, o in
+                        zip(util.neighbor_mat, offsets)
+                        if present[i + o] and not raised[i + o]]
+            return [(q + n[0], r + n[1]) for n, o in
+                    zip(util.neighbor_mat, offsets) if present[i + o]]
+
+        retval = list()
+        for coord in util.surrounding_noclip((q, r)):
+            j = self.index(coord)
+            if j >= 0 and present[j] and not (avoid_raised and raised[j]):
+                retval.append(coord)
+        return retval
+
+    def __getitem__(self, coords):
+        i = self.index(coords)
+        if i < 0 or not self.present[i]:
+            raise KeyError(coords)
+        return CellView(self, (int(coords[0]), int(coords[1])), i)
+
+    def get(self, coords, default=None):
+        # same as index(), inlined because get_cell is called very often
+        q, r = coords[0], coords[1]
+        if type(q) is not int or type(r) is not int:
+            q, r = int(q), int(r)
+        col = q + ((r + (r & 1)) >> 1) - self._col0
+        row = r - self._row0
+        if 0 <= col < self._stride and 0 <= row < self._rows:
+            i = row * self._stride + col
+            if self.present[i]:
+                return CellView(self, (q, r), i)
+        return default
+
+    def __contains__(self, coords):
+        return self.has(coords)
+
+    def __setitem__(self, coords, cell):
+        q, r = (int(i) for i in coords)
+        i = self.index((q, r))
+        if i < 0:
+            self._grow_to(q + ((r + (r & 1)) >> 1), r)
+            i = self.index((q, r))
+
+        if not self.present[i]:
+            self.present[i] = 1
+            self._len += 1
+
+        self.cost[i] = int(cell.cost)
+        self.raised[i] = 1 if cell.raised else 0
+        self.height[i] = float(cell.height)
+        self.tile[i] = self.intern_tile(cell.filename)
+
+    def __delitem__(self, coords):
+        i = self.index(coords)
+        if i < 0 or not self.present[i]:
+            raise KeyError(coords)
+        self.present[i] = 0
+        self.cost[i] = 0
+        self.raised[i] = 0
+        self.height[i] = 0.0
+        self.tile[i] = 0
+        self._len -= 1
+
+    def clear(self):
+        self._len = 0
+        self._planes = dict()
+        self._allocate(0, 0, 0, 0)
+
+    def __len__(self):
+        return self._len
+
+    def indices(self):
+        """Return numpy array of the flat indices of all existing cells"""
+        return numpy.flatnonzero(self._planes['present'])
+
+    def __iter__(self):
+        coords_at = self.coords_at
+        return (coords_at(i) for i in self.indices().tolist())
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        coords_at = self.coords_at
+        return [(coords_at(i), CellView(self, coords_at(i), i))
+                for i in self.indices().tolist()]
+
+    def values(self):
+        return [cell for coords, cell in self.items()]
+
+    def bounds(self):
+        """Return (width, height) of the occupied even-r rectangle"""
+        if not self._len:
+            return 0, 0
+        present = self.plane('present')
+        rows = numpy.flatnonzero(present.any(axis=1))
+        cols = numpy.flatnonzero(present.any(axis=0))
+        return int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1)
+
+    @property
+    def nbytes(self):
+        return sum(i.nbytes for i in self._planes.values())
+
+
+class ArrayHexMapModel(HexMapModel):
+    """HexMapModel using a CellArray for storage
+
+    get_cell returns CellView objects instead of Cell objects.  They have
+    the same attributes, so views, physics and the maze generator can use
+    either model.
+    """
+    flow_field_class = ArrayFlowField
+
+    def __init__(self, width=0, height=0):
+        super(ArrayHexMapModel, self).__init__()
+        self._data = CellArray(width, height)
+
+    def surrounding(self, coords, avoid_raised=True):
+        return self._data.neighbors(coords, avoid_raised)
+
+    def get_cell(self, coords):
+        return self._data.get(coords, None)
+
+    def _calc_bounds(self):
+        self._width, self._height = self._data.bounds()
+
+    @classmethod
+    def from_model(cls, model):
+        """Return a copy of another model using array storage"""
+        new = cls()
+        for coords, cell in model.cells:
+            new._data[coords] = cell
+        new._trigger_bounds_update()
+        return new
+
+    def to_model(self):
+        """Return a copy of this model using Cell objects"""
+        new = HexMapModel()
+        for coords, cell in self.cells:
+            new._data[coords] = Cell(**cell.to_json())
+        new._trigger_bounds_update()
+        return new
@@ -1,10 +1,14 @@
-from heapq import heappush, heappop
+from collections import OrderedDict
 from math import sqrt
 import random
 import json
 import codecs
-import time
+
+import numpy
+
 from zkit.environ import util
+from zkit.pathfind import AStarSearch, ClusterGraph
+from zkit.flowfield import FlowField
 
 
 # even-r : 'pointy top'
@@ -19,6 +23,12 @@ __all__ = ['HexMapModel',
            'sprites_to_hex',
            'collide_hex',
            'hex_round',
+           'hex_round_array',
+           'evenr_to_axial_array',
+           'axial_to_evenr_array',
+           'pixel_to_axial_array',
+           'sprites_to_axial_array',
+           'axial_to_sprites_array',
            'dist_axial',
            'dist_axial2']
 
@@ -45,6 +55,29 @@ def hex_round(coords):
     return cube_to_axial((rx, ry, rz))
 
 
+def hex_round_array(q, r):
+    """hex_round for arrays of axial coords
+
+    :param q: array of axial q coords
+    :param r: array of axial r coords
+    :return: (q, r) int arrays
+    """
+    q = numpy.asarray(q, dtype=float)
+    r = numpy.asarray(r, dtype=float)
+    s = -q - r
+    rq = numpy.round(q)
+    rr = numpy.round(r)
+    rs = numpy.round(s)
+    dq = numpy.abs(rq - q)
+    dr = numpy.abs(rr - r)
+    ds = numpy.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = numpy.where(fix_q, -rr - rs, rq)
+    rr = numpy.where(fix_r, -rq - rs, rr)
+    return rq.astype(int), rr.astype(int)
+
+
 def axial_to_pixel(coords, size):
     return size * sqrt_3 * (coords[0] - 0.5 * (coords[1] & 1)), \
            size * 3 / 2 * coords[1]
@@ -56,6 +89,14 @@ def pixel_to_axial(coords, size):
     return (ratio_13 * sqrt_3 * x - ratio_13 * y) / size, ratio_32 * y / size
 
 
+def pixel_to_axial_array(x, y, size):
+    """pixel_to_axial for arrays of pixel coords; returns (q, r) arrays"""
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    size = float(size)
+    return (ratio_13 * sqrt_3 * x - ratio_13 * y) / size, ratio_32 * y / size
+
+
 def axial_to_cube(coords):
     return coords[0], coords[1], -coords[0] - coords[1]
 
@@ -105,6 +146,20 @@ def evenr_to_axial(coords):
     return qq, r
 
 
+def axial_to_evenr_array(q, r):
+    """axial_to_evenr for int arrays of axial coords"""
+    q = numpy.asarray(q, dtype=int)
+    r = numpy.asarray(r, dtype=int)
+    return q + ((r + (r & 1)) >> 1), r
+
+
+def evenr_to_axial_array(q, r):
+    """evenr_to_axial for int arrays of even-r coords"""
+    q = numpy.asarray(q, dtype=int)
+    r = numpy.asarray(r, dtype=int)
+    return q - ((r + (r & 1)) >> 1), r
+
+
 # special purpose function for sprites only
 def sprites_to_axial(coords):
     x, y = coords[:2]
@@ -118,6 +173,20 @@ def axial_to_sprites(coords):
     return sqrt_3 * (q + r / 2.), ratio_32 * r
 
 
+def sprites_to_axial_array(x, y):
+    """sprites_to_axial for arrays of sprite coords"""
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    return ratio_13 * sqrt_3 * x - ratio_13 * y, ratio_23 * y
+
+
+def axial_to_sprites_array(q, r):
+    """axial_to_sprites for arrays of axial coords"""
+    q = numpy.asarray(q, dtype=float)
+    r = numpy.asarray(r, dtype=float)
+    return sqrt_3 * (q + r / 2.), ratio_32 * r
+
+
 # special purpose function for sprites only
 def sprites_to_hex(coords):
     return hex_round(sprites_to_axial(coords))
@@ -175,9 +244,26 @@ class Cell(object):
         }
 
 
+# pixel offsets (radius 1) from a cell to each neighbor, for wall tests
+_wall_offset = 0, .1
+_neighbor_pixels = tuple(cube_to_pixel(axial_to_cube(n), 1)
+                         for n in util.neighbor_mat)
+
+
 class HexMapModel(object):
+    # max number of cells expanded by one call to pathfind
+    pathfind_budget = 4096
+
+    # number of flow fields kept by flow_field
+    flow_field_cache_size = 8
+    flow_field_class = FlowField
+
     def __init__(self):
         self._data = dict()
+        self._neighbors = None
+        self._walls = None
+        self.hierarchy = None
+        self._flow_fields = OrderedDict()
         self._width = None
         self._height = None
         self._dirty = False
@@ -195,28 +281,111 @@ class HexMapModel(object):
         :param radius: axial coords
         :return: list of coords
         """
-        wall_offset = [0, .1]
+        # hex_round, inlined
+        q0 = coords[0]
+        r0 = coords[1]
+        s0 = -q0 - r0
+        q = round(q0)
+        r = round(r0)
+        s = round(s0)
+        dq = abs(q - q0)
+        dr = abs(r - r0)
+        if dq > dr and dq > abs(s - s0):
+            q = -r - s
+        elif dr > abs(s - s0):
+            r = -q - s
+        q = int(q)
+        r = int(r)
+
+        walls = self._walls
+        if walls is None:
+            walls = self.wall_masks()
+        mask = walls.get((q, r))
+        if not mask:
+            return list()
+
+        x, y = cube_to_pixel(axial_to_cube(
+            (q0 - _wall_offset[0] - q, r0 - _wall_offset[1] - r)), 1)
+        rr = radius + .9
+        rr *= rr
         retval = list()
-        round_coords = [int(i) for i in hex_round(coords)]
-        neighbors = list(util.surrounding_noclip(round_coords))
-
-        if not len(set(neighbors)) == 6:
-            pass
+        for i, (nx, ny) in enumerate(_neighbor_pixels):
+            if mask & (1 << i):
+                dx = nx - x
+                dy = ny - y
+                if (dx * dx) + (dy * dy) < rr:
+                    dq, dr = util.neighbor_mat[i]
+                    retval.append((q + dq, r + dr))
+        return retval
 
-        for n in neighbors:
-            neigh = tuple([int(i) for i in n])
-            cell = self._data.get(neigh, None)
+    def collidecircles(self, q, r, radius):
+        """test many circles against level geometry at once
 
-            if cell is None:
-                continue
+        Same test as collidecircle, for arrays of circles.
 
-            if not cell.raised:
-                continue
+        :param q: array of axial q coords
+        :param r: array of axial r coords
+        :param radius: array of radii, or one radius for all
+        :return: array of bool, True where a circle hits a wall
+        """
+        q = numpy.asarray(q, dtype=float)
+        r = numpy.asarray(r, dtype=float)
+        hit = numpy.zeros(q.shape, dtype=bool)
+        if not len(q):
+            return hit
+
+        rq, rr = hex_round_array(q, r)
+        masks = self.wall_masks()
+        mask = numpy.array([masks.get(i, 0) for i in
+                            zip(rq.tolist(), rr.tolist())], dtype=int)
+        near = numpy.flatnonzero(mask)
+        if not len(near):
+            return hit
+
+        # local pixel coords of each circle, relative to its cell
+        lq = q[near] - _wall_offset[0] - rq[near]
+        lr = r[near] - _wall_offset[1] - rr[near]
+        x, y = cube_to_pixel(axial_to_cube((lq, lr)), 1)
+        limit = numpy.broadcast_to(radius, q.shape)[near] + .9
+        limit *= limit
+        mask = mask[near]
+        for i, (nx, ny) in enumerate(_neighbor_pixels):
+            dx = nx - x
+            dy = ny - y
+            hit[near] |= ((mask & (1 << i)) != 0) & \
+                ((dx * dx) + (dy * dy) < limit)
+        return hit
+
+    def wall_masks(self):
+        """Return dict of axial coords => bitmask of raised neighbors
+
+        Bit i is set if the neighbor in direction util.neighbor_mat[i] is
+        raised.  Coords without raised neighbors are left out, so they
+        do not need to be cells themselves.  The table is kept up to
+        date by touch_cell.
+        """
+        if self._walls is None:
+            walls = dict()
+            for coords, cell in self._data.items():
+                if cell.raised:
+                    self._set_wall(walls, coords, True)
+            self._walls = walls
+        return self._walls
 
-            new = coords[0] - wall_offset[0], coords[1] - wall_offset[1]
-            if collide_hex(new, neigh, radius, .9):
-                retval.append(neigh)
-        return retval
+    @staticmethod
+    def _set_wall(walls, coords, raised):
+        q, r = coords
+        for i, (dq, dr) in enumerate(util.neighbor_mat):
+            key = q - dq, r - dr
+            mask = walls.get(key, 0)
+            if raised:
+                walls[key] = mask | (1 << i)
+            elif mask & (1 << i):
+                mask &= ~(1 << i)
+                if mask:
+                    walls[key] = mask
+                else:
+                    del walls[key]
 
     def _make_file_data(self):
         return {
@@ -236,9 +405,11 @@ class HexMapModel(object):
             data = json.load(fob)
             self._width = data["width"]
             self._height = data["height"]
-            self._data = dict()
+            self._data.clear()
             for key, cell_data in data["data"].items():
                 self._data[eval(key)] = Cell(**cell_data)
+            self._neighbors = None
+            self.touch_cell()
 
     def get_cell(self, coords):
         return self._data.get(tuple(coords), None)
@@ -251,12 +422,109 @@ class HexMapModel(object):
         coords = tuple(coords)
         assert (len(coords) == 2)
         coords = tuple(int(i) for i in coords)
+        if self._neighbors is not None and coords not in self._data:
+            self._link_neighbors(coords)
         self._data[coords] = cell
         self._trigger_bounds_update()
+        self.touch_cell(coords)
 
     def remove_cell(self, coords):
         del self._data[coords]
+        if self._neighbors is not None:
+            self._unlink_neighbors(tuple(coords))
         self._trigger_bounds_update()
+        self.touch_cell(coords)
+
+    def touch_cell(self, coords=None):
+        """Call after changing raised, height or cost of a cell
+
+        Cached pathfinding and wall data is rebuilt for the area around
+        the cell.  If coords is None, everything is rebuilt.
+
+        :param coords: axial coords of the cell that changed, or None
+        """
+        if self.hierarchy is not None:
+            self.hierarchy.touch(coords)
+
+        if self._walls is not None:
+            if coords is None:
+                self._walls = None
+            else:
+                coords = int(coords[0]), int(coords[1])
+                cell = self._data.get(coords)
+                self._set_wall(self._walls, coords,
+                               cell is not None and cell.raised)
+
+        fields = self._flow_fields
+        if coords is None:
+            fields.clear()
+            return
+        for field in fields.values():
+            if field.affected_by(coords):
+                field.repair(coords)
+
+    def flow_field(self, goal, max_cost=None):
+        """Return a flow field leading every cell to the goal
+
+        Fields are cached per goal cell, so any number of agents chasing
+        the same goal can share one.  A change near the cells they cover,
+        reported with touch_cell, repairs them in place.
+
+        :param goal: axial coords
+        :param max_cost: cells further away than this are not included
+        :return: FlowField
+        """
+        goal = int(goal[0]), int(goal[1])
+        fields = self._flow_fields
+        field = fields.get(goal)
+        if field is not None:
+            if field.max_cost is None or \
+                    (max_cost is not None and max_cost <= field.max_cost):
+                fields.move_to_end(goal)
+                return field
+
+        field = self.flow_field_class(self, goal, max_cost)
+        fields[goal] = field
+        fields.move_to_end(goal)
+        while len(fields) > self.flow_field_cache_size:
+            fields.popitem(last=False)
+        return field
+
+    def enable_hierarchy(self, cluster_size=16):
+        """Use hierarchical pathfinding for long distance queries
+
+        Once enabled, pathfind() only returns the path to the first
+        waypoint of the route for queries longer than cluster_size,
+        with complete set to False.  Call it again to continue.
+        """
+        self.hierarchy = ClusterGraph(self, cluster_size)
+
+    def neighbor_table(self):
+        """Return dict of axial coords => tuple of neighboring coords
+
+        The table only depends on which cells exist, so it is built once
+        and kept up to date by add_cell and remove_cell.  Raised cells are
+        included.
+        """
+        if self._neighbors is None:
+            data = self._data
+            self._neighbors = {
+                coords: tuple(n for n in util.surrounding_noclip(coords)
+                              if n in data) for coords in data}
+        return self._neighbors
+
+    def _link_neighbors(self, coords):
+        table = self._neighbors
+        neighbors = tuple(n for n in util.surrounding_noclip(coords)
+                          if n in table)
+        table[coords] = neighbors
+        for n in neighbors:
+            table[n] += (coords,)
+
+    def _unlink_neighbors(self, coords):
+        table = self._neighbors
+        for n in table.pop(coords, ()):
+            table[n] = tuple(i for i in table[n] if i != coords)
 
     def _trigger_bounds_update(self):
         self._width = None
@@ -317,13 +585,22 @@ class HexMapModel(object):
 
     def neighboring_radius(self, center, radius,
                            blacklist=set(), avoid_raised=True):
-        neighbors = set()
-        neighbors.add(center)
+        table = self.neighbor_table()
+        data = self._data
+        center = int(center[0]), int(center[1])
+        neighbors = {center}
+        frontier = [center]
         for i in range(radius):
-            tmp = set()
-            for n in neighbors:
-                tmp.update(set(self.surrounding(n, avoid_raised)))
-            neighbors.update(tmp)
+            new = list()
+            for coords in frontier:
+                for n in table.get(coords, ()):
+                    if n in neighbors:
+                        continue
+                    if avoid_raised and data[n].raised:
+                        continue
+                    neighbors.add(n)
+                    new.append(n)
+            frontier = new
 
         neighbors.difference_update(blacklist)
 
@@ -339,59 +616,48 @@ class HexMapModel(object):
                         avoid_raised=True):
         neighbors = self.neighboring_radius(home, radius, blacklist,
                                             avoid_raised)
+        end = random.choice(list(neighbors))
+
+        # the search may also walk from outside of the area back into it
+        neighbors.add((int(current[0]), int(current[1])))
+        return self.pathfind(current, end, blacklist, avoid_raised,
+                             within=neighbors)
+
+    def search(self, current, end, blacklist=None, avoid_raised=True,
+               within=None):
+        """Return a new AStarSearch which can be stepped over many frames
+
+        :param current: axial coords to search from
+        :param end: axial coords to search to
+        :param blacklist: set of axial coords that cannot be entered
+        :param avoid_raised: if True, raised cells cannot be entered
+        :param within: if not None, set of the only axial coords to enter
+        :return: AStarSearch
+        """
+        return AStarSearch(self, current, end, blacklist, avoid_raised,
+                           within)
+
+    def pathfind(self, current, end, blacklist=None, avoid_raised=True,
+                 within=None, budget=None):
+        """Find the cheapest path between two cells
+
+        Entering a cell costs 1 + cell.cost.  The search gives up after
+        expanding budget cells (pathfind_budget by default); in that case
+        the path leads to the cell closest to the end found so far.
 
-        blacklist.update(
-            {coord for coord in self._data})
-        blacklist.difference_update(neighbors)
-        return self.pathfind(current, random.choice(list(neighbors)), blacklist,
-                             avoid_raised)
-
-    def pathfind(self, current, end, blacklist=set(), avoid_raised=True):
-        def cell_available(cell):
-            return coord_available(cell[1])
-
-        def coord_available(coord):
-            return coord not in closed_set and coord not in blacklist
-
-        def retrace_path(c):
-            path = []
-            while parent.get(c, None) is not None:
-                c = parent[c]
-                path.append(c)
-            return list(reversed(path)) or None
-
-        start_time = time.time()
-        parent = {}
-        open_heap = []
-        open_set = set()
-        closed_set = set()
-        current = current[0], current[1]
-        open_set.add(current)
-        open_heap.append(current)
-        while open_set:
-            if time.time() - start_time > .0125:
-                try:
-                    return retrace_path(current), False
-                except:
-                    return None, True
-
-            current = heappop(open_heap)
-
-            if current == end:
-                return retrace_path(current), True
-
-            open_set.remove(current)
-            closed_set.add(current)
-            cells = filter(
-                cell_available,
-                ((self.dist(coord, end) + self.get_cell(coord).cost, coord)
-                 for coord in self.surrounding(current, avoid_raised)))
-            # Push the highest costing tiles first, so we'll check them last
-            # Should keep working when there's a dead end
-            for cell in cells:
-                parent[cell[1]] = current
-                if cell[1] not in open_set:
-                    open_set.add(cell[1])
-                    heappush(open_heap, cell[1])
-
-        return None, True
+        If enable_hierarchy() was called, long queries only return the path
+        to the first waypoint of the route.
+
+        :return: (list of axial coords from current to end, complete)
+        """
+        hierarchy = self.hierarchy
+        if hierarchy is not None and avoid_raised and not blacklist and \
+                within is None and \
+                self.dist(current[:2], end[:2]) > hierarchy.cluster_size:
+            return hierarchy.pathfind(current, end)
+
+        if budget is None:
+            budget = self.pathfind_budget
+        search = self.search(current, end, blacklist, avoid_raised, within)
+        search.step(budget)
+        return search.result()
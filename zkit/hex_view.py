@@ -1,11 +1,15 @@
-from math import sin, cos, pi, sqrt, ceil
-from itertools import product
+from collections import OrderedDict
+from math import sin, cos, pi, sqrt, ceil, floor
 
+import numpy
 import pygame
 import pygame.gfxdraw
 from pygame.transform import smoothscale
 
+from zkit.camera import Camera
+from zkit.chunks import Chunk, ChunkCache
 from zkit.euclid import Vector2, Vector3
+from zkit import config
 from zkit import resources
 from zkit.hex_model import *
 from zkit import quadtree
@@ -15,7 +19,8 @@ __all__ = ['HexMapView']
 
 
 class UpperLayerRect:
-    def __init__(self, surface, rect, layer):
+    def __init__(self, surface, rect, layer, coords=None):
+        self.coords = coords
         self.rect = rect
         self.surface = surface
         self.layer = layer
@@ -25,6 +30,81 @@ class UpperLayerRect:
         self.bottom = rect.bottom
 
 
+class SpriteRect(object):
+    """Rect of the screen where a sprite was drawn, for the quadtree"""
+    __slots__ = ['sprite', 'rect']
+
+    def __init__(self, sprite, rect):
+        self.sprite = sprite
+        self.rect = rect
+
+
+def offset_blit(surface, x, y):
+    """Return blit function for a surface placed at (x, y)"""
+    blit = surface.blit
+
+    def offset_blit(image, dest):
+        return blit(image, (dest[0] - x, dest[1] - y))
+
+    return offset_blit
+
+
+class ScaledTiles(object):
+    """Sets of tiles scaled to a width, for the last few widths used
+
+    Zooming back to a recent zoom level reuses its tiles, instead of
+    scaling all the tiles again.
+
+    :param size: number of sets of tiles to keep
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.sets = OrderedDict()
+
+    def __contains__(self, width):
+        return int(width) in self.sets
+
+    def __len__(self):
+        return len(self.sets)
+
+    def get(self, width):
+        """Return dict of tile filename => tile scaled to width"""
+        width = int(width)
+        sets = self.sets
+        try:
+            sets.move_to_end(width)
+            return sets[width]
+        except KeyError:
+            pass
+
+        tiles = dict()
+        for filename, image in resources.tiles.items():
+            if filename.startswith('tile'):
+                iw, ih = image.get_size()
+                height = width * (float(ih) / iw)
+                tiles[filename] = smoothscale(image, (width, int(height)))
+
+        sets[width] = tiles
+        while len(sets) > self.size:
+            sets.popitem(last=False)
+        return tiles
+
+    def clear(self):
+        self.sets.clear()
+
+
+def draw_order(coords):
+    """Sort key which puts axial coords in the order cells are drawn"""
+    q, r = coords
+    return r, q + ((r + (r & 1)) >> 1)
+
+
+def upper_order(upper):
+    """Sort key which puts UpperLayerRects in the order cells are drawn"""
+    return draw_order(upper.coords)
+
+
 class HexMapView(pygame.sprite.LayeredUpdates):
     border_color = 61, 55, 42, 64
     line_color = 61, 42, 42
@@ -32,11 +112,23 @@ class HexMapView(pygame.sprite.LayeredUpdates):
     hover_color = 192, 184, 190, 128
     select_color = 195, 177, 142
 
+    # priority and ms per call of prefetch, for the scheduler
+    prefetch_priority = 1
+    prefetch_cost = 5.
+
+    # when more than this share of at least rebuild_sprites sprites in
+    # sprite_rects was drawn in a frame, their overlaps are found with a
+    # LinearQuadTree built for the frame, instead of moving each one in
+    # sprite_quadtree
+    rebuild_share = .75
+    rebuild_sprites = 200
+
     def __init__(self, scene, data, radius):
         super(HexMapView, self).__init__(default_layer=1)
         self.scene = scene
         self.data = data
         self.hex_radius = radius
+        self.base_radius = radius
         self.tilt = .84
         self.size_ratio = 1.3
 
@@ -49,6 +141,31 @@ class HexMapView(pygame.sprite.LayeredUpdates):
         # set this to True to trigger a map redraw
         self.needs_refresh = None
 
+        # cells to redraw on the next draw; see invalidate_cell
+        self.dirty_cells = set()
+
+        # the map layer is drawn in chunks, which are composited into
+        # map_buffer.  the viewport is the part of the map layer in view;
+        # it follows the camera.
+        self.camera = Camera()
+        self.viewport = None
+        self._zoom = None
+        self.tile_sets = ScaledTiles(config.getint('display', 'tile_sets'))
+        self.chunks = None
+        self._composited = None
+
+        # rect covered by the tiles of each cell, found when the cell is
+        # first looked up, and how far the tiles of any cell reach from
+        # its center, to find the cells in an area
+        self.cell_rects = dict()
+        self.cell_reach = None
+
+        # rect covering every tile, placed at the center of a cell
+        self.tile_extent = None
+
+        # height of the tallest cell, found when the map is refreshed
+        self.max_height = None
+
         self.overlap_limit = None
         self.rect = None
         self.lostsprites = list()
@@ -61,8 +178,20 @@ class HexMapView(pygame.sprite.LayeredUpdates):
         self.project = None
         self.map_buffer = None
         self.voff = None
-        self.pixel_offset = None
-        self.layer_quadtree = None
+
+        # where each sprite was last drawn, kept from frame to frame.  the
+        # quadtree is stale after frames that used a LinearQuadTree instead.
+        self.sprite_quadtree = None
+        self.sprite_rects = dict()
+        self._sprite_quadtree_stale = False
+
+        # sprites are drawn between physics steps if this is set
+        self.physics = None
+
+        # chunks around the viewport are drawn in the spare time of frames
+        # if this is set to a FrameScheduler
+        self.scheduler = None
+        self._prefetching = False
         self.set_radius(radius)
         self.spritedict["hover"] = None
 
@@ -93,32 +222,31 @@ class HexMapView(pygame.sprite.LayeredUpdates):
 
     def get_hex_tile(self):
         def draw_tile(blit, cell, coords):
-            x, y = coords - (half_width, half_height)
+            x = int(coords[0] - half_width)
+            y = int(coords[1] - half_height)
             tile = tile_dict[cell.filename]
-            return blit(tile, (int(x), int(y)))
+            if blit is None:
+                return pygame.Rect((x, y), tile.get_size())
+            return blit(tile, (x, y))
 
-        tile_dict = dict()
         ph = self.hex_radius * 2
         pw = (sqrt(3) / 2 * ph)
         ph *= self.tilt
         half_width = int(pw / 2.)
         half_height = int(ph / 2.)
-        pw += 1
+        tile_dict = self.tile_sets.get(pw + 1)
 
-        for filename, image in resources.tiles.items():
-            if filename.startswith('tile'):
-                iw, ih = image.get_size()
-                height = pw * (float(ih) / iw)
-                image = smoothscale(image, (int(pw), int(height)))
-                tile_dict[filename] = image
+        extent = pygame.Rect(-half_width, -half_height, 0, 0)
+        for tile in tile_dict.values():
+            extent.union_ip(pygame.Rect(extent.topleft, tile.get_size()))
+        self.tile_extent = extent
 
         return draw_tile
 
     def get_projection(self):
+        """Return function of axial coords => pixels of the map layer"""
         def project(i, cell=None):
-            coords = Vector2(size_sqrt3 * (i[0] + i[1] / 2.), size_ratio * i[1])
-            coords += screen_offset
-            return coords
+            return Vector2(size_sqrt3 * (i[0] + i[1] / 2.), size_ratio * i[1])
 
         # cache of the expensive axial => cart transform
         cache = dict()
@@ -132,21 +260,18 @@ class HexMapView(pygame.sprite.LayeredUpdates):
         size_ratio = self.hex_radius * pw / ph * self.size_ratio
         self.voff = size_ratio
 
-        rw, rh = self.rect.size
-        mw = pw * self.data.size[0] * 1.05
-        mh = ph * self.data.size[1] * 3. / 4. * 1.15
-        hw = int((rw / 2.) - (mw / 2.))
-        hh = int((rh / 2.) - (mh / 2.))
-        hh *= 1.6
-
-        self.__w = pw
-        self.__h = ph
-
-        screen_offset = Vector2(hw + pw, hh + ph / 2.)
-        map_rect = pygame.Rect((hw, hh), (mw, mh))
-
-        self.map_rect = map_rect
-        self.pixel_offset = screen_offset
+        # rect of the map layer covered by the bottom tiles of the map
+        w, h = self.data.size
+        if w and h:
+            corners = [project(evenr_to_axial((q, r)))
+                       for q in (0, w - 1) for r in (0, min(1, h - 1), h - 1)]
+            xs = [i.x for i in corners]
+            ys = [i.y for i in corners]
+            self.map_rect = pygame.Rect(
+                int(min(xs) - pw / 2.), int(min(ys) - ph / 2.),
+                int(max(xs) - min(xs) + pw), int(max(ys) - min(ys) + ph))
+        else:
+            self.map_rect = pygame.Rect(0, 0, 0, 0)
 
         def cached_project(i, cell=None, use_cache=False):
             if use_cache:
@@ -161,16 +286,312 @@ class HexMapView(pygame.sprite.LayeredUpdates):
 
         return cached_project
 
+    def project_array(self, q, r):
+        """project for arrays of axial coords; returns (x, y) arrays"""
+        q = numpy.asarray(q, dtype=float)
+        r = numpy.asarray(r, dtype=float)
+        return self.hex_radius * sqrt(3) * (q + r / 2.), self.voff * r
+
+    def invalidate_cell(self, coords):
+        """Redraw the cell at coords on the next draw
+
+        Use after changing the height or tile of a cell.  Only the area of
+        the screen covered by the cell, before and after the change, is
+        redrawn.
+
+        :param coords: axial coords
+        """
+        self.dirty_cells.add((int(coords[0]), int(coords[1])))
+
+    def draw_cell(self, coords, cell, blit, upper_blit=None):
+        """Draw the tiles of a cell
+
+        :param coords: axial coords
+        :param cell: Cell
+        :param blit: blit function of the map buffer
+        :param upper_blit: blit function for the raised tiles only, or None
+        :return: list of rects of the raised tiles
+        """
+        draw_tile = self._hex_tile
+        pos = Vector2(*self.project(coords, cell))
+        rects = list()
+        if cell.height > 0:
+            draw_tile(blit, self.default_cell, pos)
+            for i in range(int(ceil(cell.height))):
+                pos.y -= self.voff / 2
+                draw_tile(blit, cell, pos)
+                if upper_blit is not None:
+                    rects.append(draw_tile(upper_blit, cell, pos))
+        else:
+            draw_tile(blit, cell, pos)
+        return rects
+
+    def cell_rect(self, coords, cell, pos=None):
+        """Return rect of the screen covered by the tiles of a cell
+
+        :param pos: projected coords, if they are known
+        """
+        draw_tile = self._hex_tile
+        if pos is None:
+            pos = self.project(coords, cell)
+        pos = Vector2(*pos)
+        if cell.height > 0:
+            rect = draw_tile(None, self.default_cell, pos)
+            for i in range(int(ceil(cell.height))):
+                pos.y -= self.voff / 2
+                rect.union_ip(draw_tile(None, cell, pos))
+            return rect
+        return draw_tile(None, cell, pos)
+
+    def base_rect(self, coords, pos=None):
+        """Return rect of the bottom tile of a cell, ignoring height
+
+        :param pos: projected coords, if they are known
+        """
+        if pos is None:
+            pos = self.project(coords)
+        return self._hex_tile(None, self.default_cell, pos)
+
+    def update_reach(self):
+        """Find how far the tiles of any cell reach from its center"""
+        extent = self.tile_extent
+        raised = int(ceil(self.max_height)) * self.voff / 2
+        # a pixel more on each side, for rounding tiles to whole pixels
+        self.cell_reach = (1 - extent.left, 1 + raised - extent.top,
+                           1 + extent.right, 1 + extent.bottom)
+
+    def cells_in_rect(self, rect):
+        """Return coords of cells whose tiles overlap rect, in draw order"""
+        left, top, right, bottom = self.cell_reach
+        width = self.hex_radius * sqrt(3)
+        voff = self.voff
+        get_cell = self.data.get_cell
+        cell_rects = self.cell_rects
+        hits = list()
+
+        # rows, and cells in each row, whose center is close enough for
+        # their tiles to reach rect
+        r0 = int(floor((rect.top - bottom) / voff))
+        r1 = int(ceil((rect.bottom + top) / voff))
+        for r in range(r0, r1 + 1):
+            q0 = int(floor((rect.left - right) / width - r / 2.))
+            q1 = int(ceil((rect.right + left) / width - r / 2.))
+            for q in range(q0, q1 + 1):
+                coords = q, r
+                cell_rect = cell_rects.get(coords)
+                if cell_rect is None:
+                    cell = get_cell(coords)
+                    if cell is None:
+                        continue
+                    cell_rect = self.cell_rect(coords, cell)
+                    cell_rects[coords] = cell_rect
+                if cell_rect.colliderect(rect):
+                    hits.append(coords)
+        return hits
+
+    def redraw_cells(self):
+        """Redraw cells passed to invalidate_cell into the cached chunks
+
+        :return: list of rects of the screen that changed, or None if the
+                 whole map must be redrawn
+        """
+        get_cell = self.data.get_cell
+        cell_rects = self.cell_rects
+        damaged = list()
+        for coords in self.dirty_cells:
+            cell = get_cell(coords)
+
+            # removed cells can change the layout of the map
+            if cell is None:
+                return None
+
+            if cell.height > self.max_height:
+                self.max_height = cell.height
+                self.update_reach()
+
+            # a cell which was never looked up is in no cached chunk
+            new = self.cell_rect(coords, cell)
+            old = cell_rects.get(coords)
+            cell_rects[coords] = new
+            damaged.append(new if old is None else new.union(old))
+
+        # merge overlapping areas, so no cell is drawn twice in one place
+        merged = list()
+        while damaged:
+            rect = damaged.pop()
+            i = rect.collidelist(damaged)
+            while i >= 0:
+                rect.union_ip(damaged.pop(i))
+                i = rect.collidelist(damaged)
+            merged.append(rect)
+
+        chunks = self.chunks
+        for rect in merged:
+            for key, chunk in chunks.cached(rect):
+                surface = chunk.surface
+                chunk_rect = chunks.rect(key)
+                area = rect.clip(chunk_rect)
+                surface.set_clip(area.move(-chunk_rect.x, -chunk_rect.y))
+                surface.fill((0, 0, 0, 0))
+                blit = offset_blit(surface, chunk_rect.x, chunk_rect.y)
+                for coords in self.cells_in_rect(area):
+                    self.draw_cell(coords, get_cell(coords), blit)
+                surface.set_clip(None)
+
+        self._recut_upper_cells(merged)
+        self.dirty_cells.clear()
+
+        vx, vy = self.viewport.topleft
+        screen = [rect.move(-vx, -vy).clip(self.rect) for rect in merged]
+        return [rect for rect in screen if rect]
+
+    def _owner_area(self, rect):
+        # area of the top left corners of the cuts which may overlap rect
+        w, h = self.tile_extent.size
+        return pygame.Rect(rect.x - w, rect.y - h, rect.w + w, rect.h + h)
+
+    def _recut_upper_cells(self, damaged):
+        # cuts of the cached chunks which may include a changed cell
+        chunks = self.chunks
+        changed = dict()
+        for rect in damaged:
+            changed.update(chunks.cached(self._owner_area(rect)))
+        for key, chunk in changed.items():
+            chunk.upper = [up for up in chunk.upper
+                           if up.rect.collidelist(damaged) < 0]
+            chunk.upper.extend(self.cut_upper_cells(chunks.rect(key),
+                                                    damaged))
+            chunks.changed(key)
+
+    def cut_upper_cells(self, rect, damaged=None):
+        """Cut the raised tiles of tall cells to draw over sprites
+
+        A cut belongs to the chunk which has its top left corner.
+
+        :param rect: rect of a chunk
+        :param damaged: list of rects; if given, only cuts which overlap
+                        one of them are made
+        :return: list of UpperLayerRect of the cuts of the chunk
+        """
+        get_cell = self.data.get_cell
+        upper = list()
+        for coords in self.cells_in_rect(rect):
+            cell = get_cell(coords)
+            if not cell.height > 0:
+                continue
+
+            pos = Vector2(*self.project(coords, cell))
+            pos.y -= self.voff / 2
+            cut = self._hex_tile(None, cell, pos)
+            if not rect.collidepoint(cut.topleft):
+                continue
+            if damaged is not None and cut.collidelist(damaged) < 0:
+                continue
+            surf = pygame.Surface(cut.size, pygame.SRCALPHA)
+
+            # the surface holds the raised tiles of this cell and of
+            # the cells drawn before it which overlap it
+            upper_blit = offset_blit(surf, cut.x, cut.y)
+            order = draw_order(coords)
+            for other in self.cells_in_rect(cut):
+                if draw_order(other) > order:
+                    break
+                other_cell = get_cell(other)
+                if other_cell.height > 0:
+                    self.draw_cell(other, other_cell, lambda *a: None,
+                                   upper_blit)
+
+            upper.append(UpperLayerRect(surf, cut, 1, coords))
+        return upper
+
+    def upper_in_rect(self, rect, hits):
+        """Add the cuts of tall cells which overlap rect of the map to hits
+
+        The chunks which own the cuts are rendered if they are not cached.
+        """
+        chunks = self.chunks
+        for key in chunks.keys(self._owner_area(rect)):
+            for up in chunks.get(key).upper:
+                if up.rect.colliderect(rect):
+                    hits.append(up)
+        return hits
+
+    def render_chunk(self, rect):
+        """Return Chunk with the cells that overlap a rect of the map"""
+        surface = pygame.Surface(rect.size, pygame.SRCALPHA)
+        get_cell = self.data.get_cell
+        blit = offset_blit(surface, rect.x, rect.y)
+        for coords in self.cells_in_rect(rect):
+            self.draw_cell(coords, get_cell(coords), blit)
+        return Chunk(surface, self.cut_upper_cells(rect))
+
+    def prefetch(self):
+        """Draw the chunks around the viewport which are not cached yet
+
+        Deferred to the scheduler when the viewport moves, so scrolling
+        finds the chunks ready.  Chunks are drawn while the frame has time
+        left, and not at all while frames are over budget, or once the
+        chunk budget is full.
+
+        :return: True if there are more chunks to draw
+        """
+        scheduler = self.scheduler
+        if scheduler.degraded:
+            return True
+        chunks = self.chunks
+        size = chunks.size
+        for key in chunks.keys(self.viewport.inflate(size * 2, size * 2)):
+            if key in chunks:
+                continue
+            if chunks.nbytes + size * size * 4 > chunks.budget:
+                break
+            chunks.get(key)
+            if scheduler.remaining() < self.prefetch_cost:
+                return True
+        self._prefetching = False
+        return False
+
+    def composite(self, rect):
+        """Redraw part of map_buffer from the backdrop and the chunks
+
+        :param rect: rect of the screen
+        """
+        buffer = self.map_buffer
+        chunks = self.chunks
+        vx, vy = self.viewport.topleft
+        buffer.set_clip(rect)
+        buffer.blit(self.background, (0, 0))
+        for key in chunks.keys(rect.move(vx, vy)):
+            x, y = chunks.rect(key).topleft
+            buffer.blit(chunks.get(key).surface, (x - vx, y - vy))
+        buffer.set_clip(None)
+
+    def scroll(self, dx, dy):
+        """Move the camera over the map by some pixels of the screen"""
+        self.camera.pan(dx, dy)
+
+    def zoom(self, factor, point=None):
+        """Zoom the camera by factor
+
+        :param point: point of the screen which stays over the same place
+                      of the map, or None for the center of the screen
+        """
+        anchor = None
+        if point is not None and self.rect is not None:
+            anchor = (point[0] - self.rect.width / 2.,
+                      point[1] - self.rect.height / 2.)
+        self.camera.zoom_by(factor, anchor)
+
     def set_radius(self, radius):
-        self.hex_radius = radius
-        self.overlap_limit = int(radius * .25)
+        """Set radius of the cells, at zoom 1"""
+        self.base_radius = radius
         self.needs_cache = True
 
     def select_cell(self, cell):
         self._selected.append(cell)
 
     def highlight_cell(self, cell):
-        if self._old_hovered is not cell:
+        if self._old_hovered != cell:
             self._old_hovered = self._hovered
             self._hovered = cell
 
@@ -178,23 +599,28 @@ class HexMapView(pygame.sprite.LayeredUpdates):
         if self.rect is None:
             return None
 
-        x, y = point
-        x -= self.pixel_offset.x
-        y -= self.pixel_offset.y
-        y *= .45
-        x *= .8
-        return pixel_to_axial((x, y), self.hex_radius * .8)
+        # inverse of the projection
+        x = point[0] + self.viewport.x
+        y = point[1] + self.viewport.y
+        r = y / self.voff
+        q = x / (self.hex_radius * sqrt(3)) - r / 2.
+        return q, r
+
+    def cell_coords_from_surface(self, point):
+        """Return axial coords of the cell cell_from_surface returns"""
+        coords = self.coords_from_surface(point)
+        if coords is not None:
+            q, r = hex_round(coords)
+            return int(q), int(r)
+        return None
 
     def cell_from_surface(self, point):
         if self.rect is None:
             return None
 
-        coords = self.coords_from_surface(point)
+        coords = self.cell_coords_from_surface(point)
         if coords is not None:
-            x, y = coords
-            x = int(x)
-            y = int(y)
-            return self.data.get_cell((x, y))
+            return self.data.get_cell(coords)
         return None
 
     def clear(self, surface, bgk=None):
@@ -214,81 +640,108 @@ class HexMapView(pygame.sprite.LayeredUpdates):
 
     def remove_internal(self, sprite):
         super(HexMapView, self).remove_internal(sprite)
+        item = self.sprite_rects.pop(sprite, None)
+        if item is not None:
+            self.sprite_quadtree.discard(item)
         try:
             del self.dirtydict[sprite]
         except:
             pass
 
     def draw(self, surface):
+        camera = self.camera
+        if camera.zoom != self._zoom:
+            self.needs_cache = True
+
         if self.needs_cache:
             buffer_size = surface.get_size()
-            self.map_buffer = pygame.Surface(buffer_size, pygame.SRCALPHA)
-            self.map_buffer.blit(self.background, (0, 0))
+            if self.map_buffer is None or \
+                    self.map_buffer.get_size() != buffer_size:
+                self.map_buffer = pygame.Surface(buffer_size,
+                                                 pygame.SRCALPHA)
             self.rect = self.map_buffer.get_rect()
+            if self.sprite_quadtree is None:
+                self.sprite_quadtree = quadtree.DynamicQuadTree(self.rect)
+            self._zoom = camera.zoom
+            self.hex_radius = self.base_radius * camera.zoom
+            self.overlap_limit = int(self.hex_radius * .25)
+            self.chunks = ChunkCache(
+                config.getint('display', 'chunk_size'),
+                config.getint('display', 'chunk_budget') * 1024 * 1024,
+                self.render_chunk)
             self.project = self.get_projection()
             self._hex_draw = self.get_hex_draw()
             self._hex_tile = self.get_hex_tile()
+            if camera.position is None:
+                x, y = self.map_rect.center
+                camera.look_at(x / camera.zoom, y / camera.zoom)
             self.needs_cache = False
-            self.needs_refresh = True
+
+            # only the tiles are scaled; cells are laid out again as the
+            # chunks they are in are drawn
+            self.cell_rects = dict()
+            self._composited = None
+            if self.max_height is None:
+                self.needs_refresh = True
+            else:
+                self.update_reach()
 
         self.rect = self.map_buffer.get_rect()
+        self.viewport = camera.viewport(self.rect.size)
         dirty = self.lostsprites
         project = self.project
-        draw_tile = self._hex_tile
         draw_hex = self._hex_draw
-        get_cell = self.data.get_cell
         surface_blit = surface.blit
         surface_rect = surface.get_rect()
-        buffer_blit = self.map_buffer.blit
         dirty_append = dirty.append
         spritedict = self.spritedict
 
         self.lostsprites = list()
         refreshed = False
 
-        # draw the cell tiles, a thread will blit the tiles in the background
-        # this is rendering the background and all hex tiles
+        # redraw only the cells that changed, if the map did not move
+        if self.dirty_cells and not self.needs_refresh:
+            damaged = self.redraw_cells()
+            if damaged is None:
+                self.needs_refresh = True
+            else:
+                for rect in damaged:
+                    self.composite(rect)
+                    dirty_append(surface_blit(self.map_buffer, rect, rect))
+                for sprite, rect in spritedict.items():
+                    if sprite != "hover" and rect and \
+                            rect.collidelist(damaged) >= 0:
+                        sprite.dirty = 1
+
+        # the map changed; chunks are drawn again when they are needed
         if self.needs_refresh:
+            heights = [cell.height for coords, cell in self.data.cells]
+            self.max_height = max(heights) if heights else 0
+            self.update_reach()
+            self.cell_rects = dict()
+            self.chunks.clear()
+            self.dirty_cells.clear()
+            self._composited = None
+            self.needs_refresh = False
+
+        # draw the visible chunks when the viewport moves
+        vx, vy = self.viewport.topleft
+        if self._composited != (vx, vy):
             for sprite in spritedict.keys():
                 try:
                     sprite.dirty = 1
                 except:
                     pass
 
-            upper_buffer = pygame.Surface(surface.get_size(), pygame.SRCALPHA)
-            buffer2_blit = upper_buffer.blit
-            upper_cells = list()
-
-            # get in draw order
-            ww, hh = self.data.size
-            for rr, qq in product(range(hh), range(ww)):
-                pos = evenr_to_axial((qq, rr))
-                cell = get_cell(pos)
-                pos = Vector2(*project(pos, cell))
-
-                # draw tall columns
-                if cell.height > 0:
-                    rects = list()
-
-                    draw_tile(buffer_blit, self.default_cell, pos)
-                    for i in range(int(ceil(cell.height))):
-                        # pos.y -= self.hex_radius / 2 * float(cell.height)
-                        pos.y -= self.voff / 2
-                        draw_tile(buffer_blit, cell, pos)
-                        rect = draw_tile(buffer2_blit, cell, pos)
-                        rects.append(rect)
-
-                    rect = rects[0].unionall(rects[:1])
-                    surf = pygame.Surface(rect.size, pygame.SRCALPHA)
-                    surf.blit(upper_buffer, (0, 0), rect)
-                    upper_cells.append(UpperLayerRect(surf, rect, 1))
-                else:
-                    draw_tile(buffer_blit, cell, pos)
-
-            self.layer_quadtree = quadtree.FastQuadTree(upper_cells, 4)
-            rect = surface_blit(self.map_buffer, self.rect)
-            dirty_append(rect)
-            self.needs_refresh = False
+            chunks = self.chunks
+            chunks.pinned = set(chunks.keys(self.viewport))
+            self.composite(self.rect)
+            self._composited = vx, vy
+            if self.scheduler is not None and not self._prefetching:
+                self._prefetching = True
+                self.scheduler.defer(self.prefetch, self.prefetch_priority,
+                                     self.prefetch_cost)
+            dirty_append(surface_blit(self.map_buffer, self.rect))
             refreshed = True
 
         # draw cell lines (outlines and highlights) to the surface
@@ -296,12 +749,12 @@ class HexMapView(pygame.sprite.LayeredUpdates):
         for pos, cell in self.data.cells:
             if cell in self._selected:
                 fill = self.select_color
-            elif cell is self._hovered:
+            elif cell == self._hovered:
                 fill = self.hover_color
             else:
                 continue
             old_rect = spritedict.get("hover", None)
-            pos = Vector3(*project(pos, cell))
+            pos = Vector3(*project(pos, cell)) - (vx, vy, 0)
             rect = draw_hex(surface, pos, self.border_color, fill)
             if not refreshed:
                 if old_rect:
@@ -316,15 +769,30 @@ class HexMapView(pygame.sprite.LayeredUpdates):
         surface.unlock()
 
         overlap_limit = self.overlap_limit
-        for sprite in [s for s in self.sprites() if s.visible & s.dirty]:
-            # hover is the internal name for the tile cursor
-            if sprite == "hover":
-                continue
-
-            pos = sprites_to_axial(sprite.position)
-            x, y = project(pos, use_cache=False)
+        physics = self.physics
+        sprites = [s for s in self.sprites() if s.visible & s.dirty]
+        if physics is None:
+            positions = [sprite.position for sprite in sprites]
+        else:
+            positions = [physics.interpolated(sprite) for sprite in sprites]
+
+        # project the sprites at once
+        if sprites:
+            xyz = numpy.array([tuple(p) for p in positions], dtype=float)
+            x, y = self.project_array(*sprites_to_axial_array(xyz[:, 0],
+                                                              xyz[:, 1]))
+            x -= vx
+            y -= vy
+            points = zip(x.tolist(), y.tolist(), xyz[:, 2].tolist())
+        else:
+            points = ()
+
+        drawn = list()
+        hits = list()
+        upper_in_rect = self.upper_in_rect
+        for sprite, (x, y, z) in zip(sprites, points):
             pos = (int(round(x - sprite.anchor.x, 0)),
-                   int(round(y - sprite.anchor.y - sprite.position.z, 0)))
+                   int(round(y - sprite.anchor.y - z, 0)))
 
             if not sprite.dirty == 2:
                 sprite.dirty -= 1
@@ -338,17 +806,7 @@ class HexMapView(pygame.sprite.LayeredUpdates):
 
             old_rect = spritedict[sprite]
             spritedict[sprite] = rect
-
-            for _sprite, _rect in spritedict.items():
-                if _sprite == "hover":
-                    continue
-
-                if _sprite is sprite or not _rect:
-                    continue
-
-                if rect.colliderect(_rect):
-                    sprite.dirty = 1
-                    _sprite.dirty = 1
+            drawn.append((sprite, rect))
 
             if not refreshed:
                 if old_rect:
@@ -361,13 +819,63 @@ class HexMapView(pygame.sprite.LayeredUpdates):
                     dirty_append(rect)
 
                 sprite_layer = sprite._layer
-                for up in self.layer_quadtree.hit(rect):
+                del hits[:]
+                upper_in_rect(rect.move(vx, vy), hits)
+                if len(hits) > 1:
+                    hits.sort(key=upper_order)
+                for up in hits:
                     if sprite_layer <= up.layer + 1:
-                        if rect.bottom < up.bottom - overlap_limit:
-                            overlap = rect.clip(up.rect)
+                        up_rect = up.rect.move(-vx, -vy)
+                        if rect.bottom < up_rect.bottom - overlap_limit:
+                            overlap = rect.clip(up_rect)
                             if overlap:
                                 surface.set_clip(overlap)
-                                surface_blit(up.surface, up.rect)
+                                surface_blit(up.surface, up_rect)
                                 surface.set_clip(None)
 
+        # sprites which overlap a sprite that was drawn must be drawn
+        # again next frame, or the clear will leave holes in them
+        tree = self.sprite_quadtree
+        sprite_rects = self.sprite_rects
+        items = list()
+        for sprite, rect in drawn:
+            item = sprite_rects.get(sprite)
+            if item is None:
+                item = sprite_rects[sprite] = SpriteRect(sprite, rect)
+            else:
+                item.rect = rect
+            items.append(item)
+
+        count = len(sprite_rects)
+        if count >= self.rebuild_sprites and \
+                len(drawn) > self.rebuild_share * count:
+            # most sprites moved; one build is cheaper than moving each
+            self._sprite_quadtree_stale = True
+            frame_tree = quadtree.LinearQuadTree(list(sprite_rects.values()))
+            rects = [rect for sprite, rect in drawn]
+            for (sprite, rect), hit in zip(drawn, frame_tree.hit_many(rects)):
+                for item in hit:
+                    if item.sprite is not sprite:
+                        sprite.dirty = 1
+                        item.sprite.dirty = 1
+            return dirty
+
+        if self._sprite_quadtree_stale:
+            tree.clear()
+            for item in sprite_rects.values():
+                tree.insert(item)
+            self._sprite_quadtree_stale = False
+        else:
+            for item in items:
+                if item in tree:
+                    tree.update(item)
+                else:
+                    tree.insert(item)
+        for sprite, rect in drawn:
+            del hits[:]
+            for item in tree.hit_into(rect, hits):
+                if item.sprite is not sprite:
+                    sprite.dirty = 1
+                    item.sprite.dirty = 1
+
         return dirty
@@ -12,7 +12,7 @@ from zkit.entity import *
 from zkit.euclid import Point2, Vector3
 from zkit.hero import Hero
 from zkit.levels import loader
-from zkit.physics import PhysicsGroup
+from zkit.physics import PhysicsGroup, ArrayPhysicsGroup
 from zkit.resources import maps
 from zkit.scenes import Scene
 from zkit.modes.editor import EditMode
@@ -89,7 +89,14 @@ class LevelScene(Scene):
         self.model = model
         self.view = hex_view.HexMapView(self, self.model,
                                         config.getint('display', 'hex_radius'))
-        self.velocity_updates = PhysicsGroup(data=self.model)
+        self.velocity_updates = self.build_physics()
+        self.view.physics = self.velocity_updates
+        self.view.scheduler = self.game.scheduler
+
+    def build_physics(self):
+        if config.getboolean('world', 'vectorized_physics'):
+            return ArrayPhysicsGroup(data=self.model)
+        return PhysicsGroup(data=self.model)
 
     def new_hero(self):
         # adds new hero, but doesn't remove old one
@@ -131,7 +138,7 @@ class LevelScene(Scene):
         door_sprite_file_name = 'smallRockStone.png'
         coords = evenr_to_axial(position)
         cell = self.view.data.get_cell(coords)
-        door = Door(door_sprite_file_name, door_key, cell)
+        door = Door(door_sprite_file_name, door_key, cell, coords)
         self.view.add(door)
         self.internal_event_group.add(door)
         return door
@@ -217,7 +224,7 @@ class LevelScene(Scene):
         if self.mode is not None:
             self.mode.update(delta, events)
 
-        self.velocity_updates.update(delta, self)
+        self.velocity_updates.advance(delta, self)
 
     def resume(self):
         print("Resuming level scene")
@@ -233,7 +240,9 @@ class LevelScene(Scene):
         self.movement_accel = config.getfloat('world', 'player_move_accel')
         self.damage = dict()
         self.needs_refresh = True
-        self.velocity_updates = PhysicsGroup(data=self.model)
+        self.velocity_updates = self.build_physics()
+        self.view.physics = self.velocity_updates
+        self.view.scheduler = self.game.scheduler
         self.internal_event_group = pygame.sprite.Group()
         self.pygame_event_group = pygame.sprite.Group()
         self.timers = pygame.sprite.Group()
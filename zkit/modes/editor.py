@@ -8,7 +8,7 @@ __all__ = ['EditMode']
 
 
 class EditMode(LevelSceneMode):
-    def handle_click(self, button, cell):
+    def handle_click(self, button, cell, coords):
         view = self.scene.view
 
         # left click
@@ -21,7 +21,9 @@ class EditMode(LevelSceneMode):
                 cell.height = 0
                 cell.filename = 'tileGrass.png'
 
-            view.needs_refresh = True
+            # only the clusters and cached data near the cell are rebuilt
+            view.data.touch_cell(coords)
+            view.invalidate_cell(coords)
 
     def update(self, delta, events):
         super(EditMode, self).update(delta, events)
@@ -10,7 +10,7 @@ class LevelSceneMode(object):
     def __init__(self, scene):
         self.scene = scene
 
-    def handle_click(self, button, cell):
+    def handle_click(self, button, cell, coords):
         pass
 
     def draw(self, surface):
@@ -34,4 +34,6 @@ class LevelSceneMode(object):
             if event.type == MOUSEBUTTONUP:
                 cell = self.get_nearest_cell(event.pos)
                 if cell:
-                    self.handle_click(event.button, cell)
+                    coords = self.scene.view.cell_coords_from_surface(
+                        event.pos)
+                    self.handle_click(event.button, cell, coords)
@@ -0,0 +1,475 @@
+"""
+A* pathfinding for hex maps.
+
+Searches are objects so they can be spread over several frames:
+
+    search = model.search(start, end)
+    while not search.step(500):
+        # yield to the game loop, continue next frame
+        ...
+    path, complete = search.result()
+
+Moving into a cell costs 1 + cell.cost, so the hex distance is an
+admissible heuristic and the first path found is the cheapest one.
+"""
+from heapq import heappush, heappop
+
+
+__all__ = ['AStarSearch',
+           'ClusterGraph',
+           'cells_dijkstra',
+           'hex_distance']
+
+
+def hex_distance(cell0, cell1):
+    q0, r0 = cell0
+    q1, r1 = cell1
+    dq = q0 - q1
+    dr = r0 - r1
+    return (abs(dq) + abs(dr) + abs(dq + dr)) >> 1
+
+
+class AStarSearch(object):
+    """Resumable A* search between two cells of a HexMapModel
+
+    Call step() until it returns True, then call result().  The neighbor
+    table of the model is used, so cells must not be added or removed while
+    the search is running.  Raised cells and costs are checked when a cell
+    is expanded.
+
+    :param model: HexMapModel
+    :param start: axial coords to search from
+    :param end: axial coords to search to
+    :param blacklist: set of axial coords that cannot be entered
+    :param avoid_raised: if True, raised cells cannot be entered
+    :param within: if not None, a set of the only axial coords to enter
+    """
+
+    def __init__(self, model, start, end, blacklist=None, avoid_raised=True,
+                 within=None):
+        self.model = model
+        self.start = int(start[0]), int(start[1])
+        self.end = int(end[0]), int(end[1])
+        self.blacklist = blacklist if blacklist is not None else set()
+        self.avoid_raised = avoid_raised
+        self.within = within
+        self.neighbors = model.neighbor_table()
+        self.expanded = 0
+        self.done = False
+        self.found = False
+
+        h = hex_distance(self.start, self.end)
+        self.g = {self.start: 0}
+        self.parent = {self.start: None}
+        self.closed = set()
+        self.heap = [(h, h, self.start)]
+        self._best = h, 0, self.start
+
+    def step(self, budget=None):
+        """Expand up to budget nodes
+
+        :param budget: max number of nodes to expand, None for no limit
+        :return: True if the search is finished
+        """
+        if self.done:
+            return True
+
+        end = self.end
+        heap = self.heap
+        g_score = self.g
+        parent = self.parent
+        closed = self.closed
+        neighbors = self.neighbors
+        blacklist = self.blacklist
+        within = self.within
+        avoid_raised = self.avoid_raised
+        cells = self.model._data
+        best = self._best
+        expanded = 0
+
+        while heap:
+            if budget is not None and expanded >= budget:
+                break
+
+            f, h, current = heappop(heap)
+            if current in closed:
+                continue
+
+            if current == end:
+                self.found = True
+                self.done = True
+                self._best = 0, g_score[current], current
+                self.expanded += expanded
+                return True
+
+            closed.add(current)
+            expanded += 1
+            g = g_score[current]
+            if h < best[0] or (h == best[0] and g < best[1]):
+                best = h, g, current
+
+            for coords in neighbors.get(current, ()):
+                if coords in closed or coords in blacklist:
+                    continue
+                if within is not None and coords not in within:
+                    continue
+                cell = cells[coords]
+                if avoid_raised and cell.raised:
+                    continue
+                new_g = g + 1 + cell.cost
+                if new_g < g_score.get(coords, new_g + 1):
+                    g_score[coords] = new_g
+                    parent[coords] = current
+                    nh = hex_distance(coords, end)
+                    heappush(heap, (new_g + nh, nh, coords))
+
+        self._best = best
+        self.expanded += expanded
+        if not heap:
+            self.done = True
+        return self.done
+
+    def retrace(self, coords):
+        """Return list of coords from the start to coords"""
+        parent = self.parent
+        path = list()
+        while coords is not None:
+            path.append(coords)
+            coords = parent[coords]
+        path.reverse()
+        return path
+
+    def result(self):
+        """Return (path, complete)
+
+        If the end was reached, path is the list of coords from the start to
+        the end, including both.  If the search ran out of budget, path
+        leads to the closest cell found so far and complete is False.  If
+        there is no path, path is None and complete is True.
+        """
+        if self.found:
+            return self.retrace(self.end), True
+        if self.done:
+            return None, True
+        return self.retrace(self._best[2]), False
+
+
+def cells_dijkstra(model, sources, within, reverse=False):
+    """Return dict of coords => cost of the cheapest path from sources
+
+    Only cells in within are entered and raised cells are never entered.
+    Entering a cell costs 1 + cell.cost.  If reverse is True the costs are
+    for paths from each cell to the sources instead.
+
+    :param sources: dict of axial coords => starting cost
+    :param within: set of axial coords
+    """
+    neighbors = model.neighbor_table()
+    cells = model._data
+    dist = dict()
+    heap = [(cost, coords) for coords, cost in sources.items()]
+    heap.sort()
+    while heap:
+        d, current = heappop(heap)
+        if current in dist:
+            continue
+        dist[current] = d
+        if reverse:
+            d += 1 + cells[current].cost
+        for coords in neighbors.get(current, ()):
+            if coords in dist or coords not in within:
+                continue
+            cell = cells[coords]
+            if cell.raised:
+                continue
+            if reverse:
+                heappush(heap, (d, coords))
+            else:
+                heappush(heap, (d + 1 + cell.cost, coords))
+    return dist
+
+
+class ClusterGraph(object):
+    """Abstract graph for hierarchical pathfinding (HPA*) on hex maps
+
+    The map is split into square clusters of even-r offset cells.  Where
+    two clusters touch, each run of open cells along the border gets an
+    entrance: a pair of cells, one on each side.  The costs between
+    entrances of the same cluster are precomputed, so a long query only
+    searches the small abstract graph, then refines the first leg with a
+    normal A* search restricted to a single cluster.
+
+    Changes are tracked per cluster.  touch() marks the cluster of a cell
+    dirty, and dirty clusters are rebuilt on the next query.  The graph is
+    always built with raised cells being impassable.
+
+    :param model: HexMapModel
+    :param cluster_size: width and height of clusters in cells
+    """
+
+    def __init__(self, model, cluster_size=16):
+        self.model = model
+        self.cluster_size = cluster_size
+        self.clusters = dict()   # cluster => set of coords
+        self.borders = dict()    # (cluster, cluster) => list of (a, b)
+        self.nodes = dict()      # cluster => set of entrance coords
+        self.intra = dict()      # entrance => {entrance: cost} same cluster
+        self.inter = dict()      # entrance => {entrance: cost} other cluster
+        self._dirty = set()
+        self._build_all()
+
+    def cluster_of(self, coords):
+        q, r = coords
+        col = q + ((r + (r & 1)) >> 1)
+        return col // self.cluster_size, r // self.cluster_size
+
+    def _build_all(self):
+        self.clusters = dict()
+        cluster_of = self.cluster_of
+        for coords in self.model._data:
+            key = cluster_of(coords)
+            try:
+                self.clusters[key].add(coords)
+            except KeyError:
+                self.clusters[key] = {coords}
+
+        self.borders = dict()
+        self.nodes = dict()
+        self.intra = dict()
+        self.inter = dict()
+        self._dirty = set(self.clusters)
+        self.update()
+
+    def touch(self, coords=None):
+        """Mark the cluster of coords dirty, or all clusters if None"""
+        if coords is None:
+            self._build_all()
+            return
+
+        coords = int(coords[0]), int(coords[1])
+        key = self.cluster_of(coords)
+        cells = self.clusters.get(key)
+        exists = coords in self.model._data
+        if cells is None:
+            if not exists:
+                return
+            cells = self.clusters[key] = set()
+        if exists:
+            cells.add(coords)
+        else:
+            cells.discard(coords)
+
+        self._dirty.add(key)
+        # cells on the edge of a cluster change the entrances of neighbors
+        for n in self.model.neighbor_table().get(coords, ()):
+            other = self.cluster_of(n)
+            if other != key:
+                self._dirty.add(other)
+
+    def update(self):
+        """Rebuild dirty clusters"""
+        if not self._dirty:
+            return
+
+        dirty = self._dirty
+        self._dirty = set()
+        changed = set(dirty)
+        for key in dirty:
+            for pair in self._find_pairs(key):
+                edges = self._find_entrances(pair)
+                if edges != self.borders.get(pair):
+                    changed.update(pair)
+                    if edges:
+                        self.borders[pair] = edges
+                    else:
+                        self.borders.pop(pair, None)
+
+        for key in changed:
+            self._build_cluster(key)
+
+    def _find_pairs(self, key):
+        # every cluster pair which shares a border with this cluster
+        pairs = {pair for pair in self.borders if key in pair}
+        cluster_of = self.cluster_of
+        table = self.model.neighbor_table()
+        for coords in self.clusters.get(key, ()):
+            for n in table[coords]:
+                other = cluster_of(n)
+                if other != key:
+                    pairs.add((min(key, other), max(key, other)))
+        return pairs
+
+    def _find_entrances(self, pair):
+        first, second = pair
+        cells = self.model._data
+        table = self.model.neighbor_table()
+        cluster_of = self.cluster_of
+
+        # all open cell pairs crossing the border, a in first, b in second
+        edges = list()
+        for a in self.clusters.get(first, ()):
+            if cells[a].raised:
+                continue
+            for b in table[a]:
+                if cluster_of(b) == second and not cells[b].raised:
+                    edges.append((a, b))
+        if not edges:
+            return list()
+        edges.sort()
+
+        # group the crossing edges into runs along the border
+        parent = list(range(len(edges)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        # two crossing edges are in the same run if the cells on both sides
+        # are the same or neighbors, so each run is connected on both sides
+        by_cell = dict()
+        for i, (a, b) in enumerate(edges):
+            by_cell.setdefault(a, list()).append(i)
+        for i, (a, b) in enumerate(edges):
+            near_b = set(table[b])
+            near_b.add(b)
+            for n in table[a] + (a,):
+                for j in by_cell.get(n, ()):
+                    if edges[j][1] in near_b:
+                        parent[find(i)] = find(j)
+
+        runs = dict()
+        for i, edge in enumerate(edges):
+            runs.setdefault(find(i), list()).append(edge)
+
+        # one entrance in the middle of short runs, one at each end of
+        # long runs
+        entrances = list()
+        for run in runs.values():
+            if len(run) < 6:
+                entrances.append(run[len(run) // 2])
+            else:
+                entrances.append(run[0])
+                entrances.append(run[-1])
+        entrances.sort()
+        return entrances
+
+    def _build_cluster(self, key):
+        cells = self.model._data
+        old = self.nodes.pop(key, set())
+        for node in old:
+            self.intra.pop(node, None)
+            self.inter.pop(node, None)
+
+        nodes = set()
+        for pair, edges in self.borders.items():
+            if key not in pair:
+                continue
+            for a, b in edges:
+                for node, other in ((a, b), (b, a)):
+                    if self.cluster_of(node) != key:
+                        continue
+                    nodes.add(node)
+                    links = self.inter.setdefault(node, dict())
+                    links[other] = 1 + cells[other].cost
+
+        if not nodes:
+            return
+
+        self.nodes[key] = nodes
+        within = self.clusters.get(key, set())
+        for node in nodes:
+            dist = cells_dijkstra(self.model, {node: 0}, within)
+            self.intra[node] = {other: dist[other] for other in nodes
+                                if other != node and other in dist}
+
+    def find_route(self, start, end):
+        """Return (list of entrance coords from start to end, cost)
+
+        The route includes the start and the end.  Returns (None, None) if
+        there is no route.
+        """
+        self.update()
+        start = int(start[0]), int(start[1])
+        end = int(end[0]), int(end[1])
+        start_key = self.cluster_of(start)
+        end_key = self.cluster_of(end)
+        model = self.model
+
+        # costs from the start to entrances of the start cluster, and from
+        # entrances of the end cluster to the end
+        start_nodes = self.nodes.get(start_key, set())
+        end_nodes = self.nodes.get(end_key, set())
+        dist = cells_dijkstra(model, {start: 0},
+                              self.clusters.get(start_key, set()))
+        first = {n: dist[n] for n in start_nodes if n in dist}
+        if start_key == end_key and end in dist:
+            first[end] = dist[end]
+        dist = cells_dijkstra(model, {end: 0},
+                              self.clusters.get(end_key, set()),
+                              reverse=True)
+        last = {n: dist[n] for n in end_nodes if n in dist}
+
+        g_score = {start: 0}
+        parent = {start: None}
+        closed = set()
+        heap = [(hex_distance(start, end), start)]
+        intra = self.intra
+        inter = self.inter
+        while heap:
+            f, current = heappop(heap)
+            if current in closed:
+                continue
+            if current == end:
+                path = list()
+                cost = g_score[end]
+                while current is not None:
+                    path.append(current)
+                    current = parent[current]
+                path.reverse()
+                return path, cost
+            closed.add(current)
+            g = g_score[current]
+
+            if current == start:
+                links = list(first.items())
+            else:
+                links = list(intra.get(current, {}).items())
+                if current in last:
+                    links.append((end, last[current]))
+            links.extend(inter.get(current, {}).items())
+
+            for coords, cost in links:
+                if coords in closed:
+                    continue
+                new_g = g + cost
+                if new_g < g_score.get(coords, new_g + 1):
+                    g_score[coords] = new_g
+                    parent[coords] = current
+                    heappush(heap, (new_g + hex_distance(coords, end),
+                                    coords))
+        return None, None
+
+    def pathfind(self, start, end):
+        """Return (path, complete) for the first leg of the route
+
+        The path goes from the start to the first entrance on the route, or
+        to the end if it is in the same cluster.  complete is True if the
+        path reaches the end or there is no route at all.
+        """
+        route, cost = self.find_route(start, end)
+        if route is None:
+            return None, True
+
+        first = route[0]
+        target = route[1]
+        key = self.cluster_of(first)
+        within = self.clusters.get(key, set())
+        if self.cluster_of(target) != key:
+            # start is an entrance, and the first leg crosses the border
+            within = within | {target}
+        search = AStarSearch(self.model, first, target, within=within)
+        search.step()
+        path, complete = search.result()
+        return path, target == route[-1]
@@ -2,13 +2,49 @@
 NOTE: there are still remnants of the old zort hex map model lurking about.
       when building new game, they will have to be replaced
 """
+from math import ceil, sqrt
+
+import numpy
 import pygame
 
 from zkit import config
+from zkit.broadphase import SpatialHash
 from zkit.euclid import Vector3
+from zkit.hex_model import sprites_to_axial, sprites_to_axial_array
+
+
+__all__ = ['PhysicsGroup',
+           'ArrayPhysicsGroup',
+           'time_of_impact']
 
 
-__all__ = ['PhysicsGroup']
+def time_of_impact(start, end, center, radius):
+    """Return when a point moving from start to end enters a circle
+
+    :param start: (x, y) at time 0
+    :param end: (x, y) at time 1
+    :param center: (x, y) center of the circle
+    :param radius: radius of the circle
+    :return: time between 0 and 1, or None if the circle is not entered
+    """
+    dx = end[0] - start[0]
+    dy = end[1] - start[1]
+    fx = start[0] - center[0]
+    fy = start[1] - center[1]
+    c = (fx * fx) + (fy * fy) - radius * radius
+    if c < 0:
+        return 0.0
+    a = (dx * dx) + (dy * dy)
+    if a == 0:
+        return None
+    b = 2 * ((fx * dx) + (fy * dy))
+    discriminant = b * b - 4 * a * c
+    if discriminant < 0:
+        return None
+    t = (-b - sqrt(discriminant)) / (2 * a)
+    if 0 <= t <= 1:
+        return t
+    return None
 
 
 class PhysicsGroup(pygame.sprite.Group):
@@ -18,24 +54,108 @@ class PhysicsGroup(pygame.sprite.Group):
 
         self.gravity = Vector3(0, 0, config.getfloat('world', 'gravity'))
         self.timestep = config.getfloat('world', 'physics_tick')
+        self.max_steps = config.getint('world', 'max_physics_steps')
+        self.accumulator = 0.0
+        self.alpha = 0.0
+        self.previous = dict()
         self.gravity_delta = None
         self.ground_friction = None
+        self.awake = set()
         self.sleeping = set()
-        self.wake = set()
         self.stale = set()
+        self.contacts = dict()
+        self.contact_graph = dict()
         self.collide_walls = set()
+        # sprites in this set are swept along their path each step
+        self.continuous = set()
+        self.ccd_step = config.getfloat('world', 'ccd_step')
+        self.swept = dict()
+        self.broadphase = SpatialHash(
+            config.getfloat('world', 'broadphase_cell'))
+
+    def add_internal(self, sprite, *args):
+        super(PhysicsGroup, self).add_internal(sprite, *args)
+        position = sprite.position
+        self.broadphase.insert(sprite, position.x, position.y, sprite.radius)
+        self.awake.add(sprite)
+
+    def remove_internal(self, sprite):
+        super(PhysicsGroup, self).remove_internal(sprite)
+        self.broadphase.remove(sprite)
+        self.awake.discard(sprite)
+        self.sleeping.discard(sprite)
+        self.previous.pop(sprite, None)
+        self.continuous.discard(sprite)
+        self.swept.pop(sprite, None)
+        for other in self.contacts.pop(sprite, ()):
+            self.stale.discard((sprite, other))
+        for other in self.contact_graph.pop(sprite, ()):
+            self.contact_graph[other].discard(sprite)
+            touching = self.contacts.get(other)
+            if touching and sprite in touching:
+                touching.remove(sprite)
+                self.stale.discard((other, sprite))
+
+    def advance(self, delta, scene):
+        """Run as many fixed steps as fit in the time that has passed
+
+        Leftover time is kept for the next frame, and alpha is set to how
+        far the simulation is between the last two steps, for drawing with
+        interpolated().  If more than max_steps are due, the rest of the
+        time is dropped and the game slows down instead of falling further
+        behind.
+
+        :param delta: real time since the last call, in ms
+        :param scene: scene to raise events on
+        :return: number of steps run
+        """
+        timestep = self.timestep
+        self.accumulator += delta
+        steps = 0
+        while self.accumulator >= timestep:
+            if steps == self.max_steps:
+                self.accumulator %= timestep
+                break
+            self.previous = {sprite: tuple(sprite.position)
+                             for sprite in self.awake}
+            self.update(timestep, scene)
+            self.accumulator -= timestep
+            steps += 1
+
+        self.alpha = self.accumulator / timestep
+        for sprite in self.previous:
+            sprite.dirty = 1
+        return steps
+
+    def interpolated(self, sprite):
+        """Return position of sprite between the last two steps
+
+        :param sprite: sprite in this group
+        :return: Vector3
+        """
+        position = sprite.position
+        previous = self.previous.get(sprite)
+        if previous is None:
+            return position
+        alpha = self.alpha
+        x, y, z = previous
+        return Vector3(x + (position.x - x) * alpha,
+                       y + (position.y - y) * alpha,
+                       z + (position.z - z) * alpha)
 
     def update(self, delta, scene):
-        stale = self.stale
+        """Run one step of physics
+
+        The step is always physics_tick long; delta is ignored.  Use
+        advance() to step with real time.
+        """
         delta = self.timestep
         gravity_delta = self.gravity * delta
         ground_friction = pow(.9, delta)
         collide = self.data.collidecircle
-        self.sleeping = self.sleeping - self.wake
-        self.wake = set()
-        all_sprites = self.sprites()
+        resting = list()
 
-        for sprite in set(self.sprites()) - self.sleeping:
+        for sprite in list(self.awake):
             sleeping = True
             sprite.dirty = 1
             acceleration = sprite.acceleration
@@ -43,6 +163,9 @@ class PhysicsGroup(pygame.sprite.Group):
             velocity = sprite.velocity
             max_velocity = sprite.max_velocity
             check_walls = sprite in self.collide_walls
+            continuous = sprite in self.continuous
+            if continuous:
+                start = position.x, position.y
 
             if not position.z == 0 and sprite.gravity:
                 acceleration += gravity_delta
@@ -73,15 +196,20 @@ class PhysicsGroup(pygame.sprite.Group):
                 if not position.z:
                     velocity.x *= ground_friction
 
-                _collides = False
+                move = x
                 if check_walls:
-                    new_position = position + (x, 0, 0)
-                    axial = sprites_to_axial(new_position)
-                    _collides = collide(axial, sprite.radius)
+                    if continuous:
+                        move *= self.sweep_walls(
+                            position.x, position.y, sprite.radius, x, 0)
+                    else:
+                        new_position = position + (x, 0, 0)
+                        axial = sprites_to_axial(new_position)
+                        if collide(axial, sprite.radius):
+                            move = 0
 
-                if not _collides:
+                if move:
                     sleeping = False
-                    position.x += x
+                    position.x += move
 
                 if abs(round(x, 5)) < .005:
                     acceleration.x = 0.0
@@ -96,15 +224,20 @@ class PhysicsGroup(pygame.sprite.Group):
                 if not position.z:
                     velocity.y *= ground_friction
 
-                _collides = False
+                move = y
                 if check_walls:
-                    new_position = position + (0, y, 0)
-                    axial = sprites_to_axial(new_position)
-                    _collides = collide(axial, sprite.radius)
+                    if continuous:
+                        move *= self.sweep_walls(
+                            position.x, position.y, sprite.radius, 0, y)
+                    else:
+                        new_position = position + (0, y, 0)
+                        axial = sprites_to_axial(new_position)
+                        if collide(axial, sprite.radius):
+                            move = 0
 
-                if not _collides:
+                if move:
                     sleeping = False
-                    position.y += y
+                    position.y += move
 
                 if abs(round(y, 5)) < .005:
                     acceleration.y = 0.0
@@ -116,29 +249,437 @@ class PhysicsGroup(pygame.sprite.Group):
                     velocity.y = -max_velocity[1]
 
             if sleeping:
-                self.sleeping.add(sprite)
+                resting.append(sprite)
                 continue
 
-            axial = sprites_to_axial(position)
-            for other in all_sprites:
-                if other is sprite:
-                    continue
+            if continuous:
+                self.swept[sprite] = start
+            self.collide_sprite(sprite, scene)
 
-                collided = collide_hex(axial, sprites_to_axial(other.position),
-                                       sprite.radius, other.radius)
+        self.sleep_islands(resting)
 
-                t = (sprite, other)
-                if collided:
-                    if t not in stale:
-                        stale.add(t)
-                        scene.raise_event("PhysicsGroup", "Collision",
-                                          left=sprite, right=other)
-                else:
-                    if t in stale:
-                        stale.remove(t)
-                        scene.raise_event(self, "Separation",
-                                          left=sprite, right=other)
+    def collide_sprite(self, sprite, scene):
+        """Raise Collision and Separation events for one sprite"""
+        stale = self.stale
+        broadphase = self.broadphase
+        contacts = self.contacts
+        position = sprite.position
+
+        # distance between sprite positions is the same as the
+        # distance collide_hex measures between their axial coords
+        x, y = position.x, position.y
+        radius = sprite.radius
+        broadphase.move(sprite, x, y)
+        touching = contacts.get(sprite)
+        if touching:
+            separated = set(touching)
+        else:
+            separated = ()
+
+        # fast sprites also touch everything they passed this step
+        start = self.swept.pop(sprite, None)
+        if start is None:
+            nearby = broadphase.query(x, y, radius + broadphase.max_radius)
+        else:
+            sx, sy = start
+            reach = sqrt((x - sx) ** 2 + (y - sy) ** 2) / 2
+            nearby = broadphase.query((x + sx) / 2, (y + sy) / 2,
+                                      reach + radius + broadphase.max_radius)
+
+        for other in nearby:
+            if other is sprite:
+                continue
+
+            other_position = other.position
+            dx = other_position.x - x
+            dy = other_position.y - y
+            rr = radius + other.radius
+            collided = (dx * dx) + (dy * dy) < rr * rr
+            if not collided and start is not None:
+                collided = time_of_impact(
+                    start, (x, y),
+                    (other_position.x, other_position.y), rr) is not None
+
+            t = (sprite, other)
+            if collided:
+                if separated:
+                    separated.discard(other)
+                if t not in stale:
+                    stale.add(t)
+                    try:
+                        contacts[sprite].add(other)
+                    except KeyError:
+                        contacts[sprite] = {other}
+                    self.link(sprite, other)
+                    if other in self.sleeping:
+                        self.wake_sprite(other)
+                    scene.raise_event("PhysicsGroup", "Collision",
+                                      left=sprite, right=other)
+
+        # sprites which were touching but are not anymore
+        for other in separated:
+            stale.remove((sprite, other))
+            contacts[sprite].remove(other)
+            if (other, sprite) not in stale:
+                self.unlink(sprite, other)
+            scene.raise_event(self, "Separation",
+                              left=sprite, right=other)
+
+    def sweep_walls(self, x, y, radius, dx, dy):
+        """Return how much of a move can be made before hitting a wall
+
+        The move is checked in steps no longer than ccd_step * radius, so
+        a fast sprite cannot pass through a wall between two checks.
+
+        :param x: x position of the sprite
+        :param y: y position of the sprite
+        :param radius: radius of the sprite
+        :param dx: x part of the move
+        :param dy: y part of the move
+        :return: fraction of the move that is free, 0 to 1
+        """
+        collide = self.data.collidecircle
+        length = sqrt((dx * dx) + (dy * dy))
+        steps = max(1, int(ceil(length / (radius * self.ccd_step))))
+        free = 0.0
+        for i in range(1, steps + 1):
+            t = i / float(steps)
+            axial = sprites_to_axial((x + dx * t, y + dy * t))
+            if collide(axial, radius):
+                break
+            free = t
+        return free
+
+    def link(self, sprite, other):
+        """Join two sprites in the contact graph"""
+        graph = self.contact_graph
+        try:
+            graph[sprite].add(other)
+        except KeyError:
+            graph[sprite] = {other}
+        try:
+            graph[other].add(sprite)
+        except KeyError:
+            graph[other] = {sprite}
+
+    def unlink(self, sprite, other):
+        """Split two sprites in the contact graph"""
+        graph = self.contact_graph
+        for a, b in ((sprite, other), (other, sprite)):
+            touching = graph.get(a)
+            if touching is not None:
+                touching.discard(b)
+                if not touching:
+                    del graph[a]
+
+    def island(self, sprite):
+        """Return set of sprites connected to sprite by contacts"""
+        graph = self.contact_graph
+        island = {sprite}
+        if sprite not in graph:
+            return island
+        frontier = [sprite]
+        while frontier:
+            for other in graph.get(frontier.pop(), ()):
+                if other not in island:
+                    island.add(other)
+                    frontier.append(other)
+        return island
+
+    def sleep_islands(self, resting):
+        """Put islands to sleep if all of their sprites are at rest
+
+        A sprite that stopped moving stays awake while anything it is
+        touching, directly or through other sprites, is still moving.
+
+        :param resting: sprites that did not move this step
+        """
+        # resting sprites skip collide_sprite, but may have been put in
+        # place after they were added, so keep the broadphase up to date
+        move = self.broadphase.move
+        for sprite in resting:
+            position = sprite.position
+            move(sprite, position.x, position.y)
+
+        awake = self.awake
+        resting = set(resting)
+        checked = set()
+        for sprite in resting:
+            if sprite in checked:
+                continue
+            island = self.island(sprite)
+            checked |= island
+            if all(other in resting or other not in awake
+                   for other in island):
+                awake.difference_update(island)
+                self.sleeping.update(island)
 
     def wake_sprite(self, sprite):
-        assert (sprite in self.sprites())
-        self.wake.add(sprite)
+        """Wake a sprite and everything touching it"""
+        assert self.has(sprite)
+        if sprite in self.sleeping:
+            island = self.island(sprite)
+            self.sleeping.difference_update(island)
+            self.awake.update(island)
+
+            # sleeping sprites may have been moved by game code
+            move = self.broadphase.move
+            for other in island:
+                position = other.position
+                move(other, position.x, position.y)
+
+
+class RowVector3(Vector3):
+    """Vector3 which is three columns of a row of ArrayPhysicsGroup.state
+
+    Reading and writing x, y and z reads and writes the array, so the
+    group never copies vectors to and from the sprites.  Arithmetic
+    returns plain Vector3s.
+    """
+    __slots__ = ['_group', '_row', '_column']
+
+    def __init__(self, group, row, column):
+        self._group = group
+        self._row = row
+        self._column = column
+
+    def _get(column):
+        def get(self):
+            return self._group.state.item(self._row, self._column + column)
+
+        def set(self, value):
+            self._group.state[self._row, self._column + column] = value
+
+        return property(get, set)
+
+    x = _get(0)
+    y = _get(1)
+    z = _get(2)
+    del _get
+
+    def __copy__(self):
+        return Vector3(self.x, self.y, self.z)
+
+    copy = __copy__
+
+    def __add__(self, other):
+        return self.copy() + other
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return self.copy() - other
+
+    def __rsub__(self, other):
+        return other - self.copy()
+
+
+class ArrayPhysicsGroup(PhysicsGroup):
+    """PhysicsGroup which integrates all awake sprites at once with numpy
+
+    The position, velocity and acceleration of every sprite live in a row
+    of state, which the group owns.  When a sprite is added, its vectors
+    are replaced with RowVector3s of its row, so game code and the group
+    work on the same numbers.  Game code may still give a sprite a new
+    vector; it is moved into the row the next time the sprite is updated.
+    Rows are kept packed, so when a sprite is removed the last row takes
+    its place, and the sprite gets plain vectors back.
+
+    Radius, max_velocity and gravity are read when the sprite is added.
+
+    The results match PhysicsGroup, except that every sprite is moved
+    before any sprite is tested against the others.
+    """
+
+    # state columns of each vector
+    vector_columns = (('position', 0),
+                      ('velocity', 3),
+                      ('acceleration', 6))
+
+    def __init__(self, data):
+        super(ArrayPhysicsGroup, self).__init__(data)
+        self.rows = dict()
+        self.bodies = list()
+        self.vectors = list()
+        self.state = numpy.zeros((0, 9))
+        self.max_velocity = numpy.zeros((0, 2))
+        self.radius = numpy.zeros(0)
+        self.falls = numpy.zeros(0, dtype=bool)
+
+    def _grow(self, size):
+        # keep rows for at least size sprites, doubling the arrays
+        capacity = len(self.state)
+        if size <= capacity:
+            return
+        capacity = max(size, capacity * 2, 16)
+        for name in ('state', 'max_velocity', 'radius', 'falls'):
+            old = getattr(self, name)
+            new = numpy.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def add_internal(self, sprite, *args):
+        super(ArrayPhysicsGroup, self).add_internal(sprite, *args)
+        row = len(self.bodies)
+        self._grow(row + 1)
+        self.rows[sprite] = row
+        self.bodies.append(sprite)
+        self.vectors.append(tuple(RowVector3(self, row, column)
+                                  for name, column in self.vector_columns))
+        max_velocity = sprite.max_velocity
+        self.max_velocity[row] = max_velocity[0], max_velocity[1]
+        self.radius[row] = sprite.radius
+        self.falls[row] = bool(sprite.gravity)
+        self.adopt(sprite)
+
+    def remove_internal(self, sprite):
+        super(ArrayPhysicsGroup, self).remove_internal(sprite)
+        row = self.rows.pop(sprite)
+        for vector, (name, column) in zip(self.vectors[row],
+                                          self.vector_columns):
+            if getattr(sprite, name) is vector:
+                setattr(sprite, name, vector.copy())
+
+        # the last row fills the gap
+        last = len(self.bodies) - 1
+        if row != last:
+            moved = self.bodies[last]
+            self.bodies[row] = moved
+            self.rows[moved] = row
+            for name in ('state', 'max_velocity', 'radius', 'falls'):
+                array = getattr(self, name)
+                array[row] = array[last]
+            vectors = self.vectors[row] = self.vectors[last]
+            for vector in vectors:
+                vector._row = row
+        self.bodies.pop()
+        self.vectors.pop()
+
+    def adopt(self, sprite):
+        """Move vectors the sprite was given into its row of state"""
+        row = self.rows[sprite]
+        state = self.state
+        for vector, (name, column) in zip(self.vectors[row],
+                                          self.vector_columns):
+            value = getattr(sprite, name)
+            if value is not vector:
+                state[row, column:column + 3] = tuple(value)
+                setattr(sprite, name, vector)
+
+    def update(self, delta, scene):
+        delta = self.timestep
+        ground_friction = pow(.9, delta)
+        collide = self.data.collidecircles
+
+        # rows of the awake sprites; a slice of the arrays if all are awake
+        awake_set = self.awake
+        if not awake_set:
+            return
+        bodies = self.bodies
+        if len(awake_set) == len(bodies):
+            index = slice(0, len(bodies))
+        else:
+            index = numpy.array([i for i, sprite in enumerate(bodies)
+                                 if sprite in awake_set], dtype=numpy.intp)
+            bodies = [bodies[i] for i in index.tolist()]
+
+        vectors = self.vectors
+        rows = self.rows
+        for sprite in bodies:
+            sprite.dirty = 1
+            position, velocity, acceleration = vectors[rows[sprite]]
+            if sprite.position is not position or \
+                    sprite.velocity is not velocity or \
+                    sprite.acceleration is not acceleration:
+                self.adopt(sprite)
+
+        collide_walls = self.collide_walls
+        check_walls = numpy.array([sprite in collide_walls
+                                   for sprite in bodies], dtype=bool)
+        continuous = numpy.array([sprite in self.continuous
+                                  for sprite in bodies], dtype=bool)
+
+        state = self.state[index]
+        position = state[:, 0:3]
+        velocity = state[:, 3:6]
+        acceleration = state[:, 6:9]
+        max_velocity = self.max_velocity[index]
+        radius = self.radius[index]
+        awake = numpy.zeros(len(bodies), dtype=bool)
+        start = position[:, :2].tolist()
+
+        falling = (position[:, 2] != 0) & self.falls[index]
+        acceleration[falling] += tuple(self.gravity * delta)
+        velocity += acceleration * delta
+        dv = velocity * delta
+        numpy.minimum(dv[:, 2], 100, out=dv[:, 2])
+
+        # vertical movement, landing and bouncing
+        dz = dv[:, 2]
+        moved = dz != 0
+        position[moved, 2] += dz[moved]
+        landed = moved & (position[:, 2] < 0)
+        awake |= moved & ~landed
+        position[landed, 2] = 0.0
+        bounced = landed & (numpy.abs(velocity[:, 2]) > .2)
+        awake |= bounced
+        acceleration[landed, 2] = 0.0
+        velocity[:, 2] = numpy.where(
+            bounced, -velocity[:, 2] * .05,
+            numpy.where(landed, 0.0, velocity[:, 2]))
+
+        grounded = position[:, 2] == 0
+        for axis in (0, 1):
+            d = dv[:, axis]
+            moved = d != 0
+            velocity[moved & grounded, axis] *= ground_friction
+
+            step = numpy.where(moved, d, 0.0)
+            check = numpy.flatnonzero(moved & check_walls & ~continuous)
+            if len(check):
+                x = position[check, 0]
+                y = position[check, 1]
+                if axis:
+                    y = y + d[check]
+                else:
+                    x = x + d[check]
+                q, r = sprites_to_axial_array(x, y)
+                step[check[collide(q, r, radius[check])]] = 0.0
+
+            sweep = numpy.flatnonzero(moved & check_walls & continuous)
+            for i in sweep.tolist():
+                move = [0.0, 0.0]
+                move[axis] = step[i]
+                step[i] *= self.sweep_walls(position[i, 0], position[i, 1],
+                                            radius[i], *move)
+
+            awake |= step != 0
+            position[:, axis] += step
+
+            stopped = moved & (numpy.abs(numpy.round(d, 5)) < .005)
+            acceleration[stopped, axis] = 0.0
+            velocity[stopped, axis] = 0.0
+
+            limit = max_velocity[:, axis]
+            velocity[moved, axis] = numpy.clip(
+                velocity[moved, axis], -limit[moved], limit[moved])
+
+        for i in numpy.flatnonzero(bounced).tolist():
+            bodies[i].bounce_sound.play()
+
+        # a slice works on state in place; rows picked by index are copies
+        if not isinstance(index, slice):
+            self.state[index] = state
+
+        awake = awake.tolist()
+        resting = [sprite for sprite, is_awake in zip(bodies, awake)
+                   if not is_awake]
+
+        swept = self.swept
+        for sprite, is_awake, xy in zip(bodies, awake, start):
+            if is_awake:
+                if sprite in self.continuous:
+                    swept[sprite] = xy
+                self.collide_sprite(sprite, scene)
+
+        self.sleep_islands(resting)
@@ -0,0 +1,268 @@
+"""
+Frame profiler.
+
+Times named sections of each frame and counts things that happen in
+them, keeps the totals of recent frames for histograms, and writes Chrome
+trace files (open them at chrome://tracing or in Perfetto).
+
+Hot paths of the game are instrumented by replacing their methods with
+timed wrappers when the profiler is enabled, and the originals are put
+back when it is disabled, so a disabled profiler costs nothing:
+
+    from zkit.profiler import profiler
+    profiler.enable()
+    game.loop()
+    profiler.write_trace('trace.json')
+    print(profiler.summary())
+
+Other code can be timed with profiler.timer('name') or
+profiler.instrument(cls, 'method').  Set frame_profile in the general
+section of the config to profile the game from run_game.py.
+"""
+import json
+from collections import deque
+from functools import wraps
+from time import perf_counter
+
+
+__all__ = ['Profiler',
+           'profiler']
+
+
+class NullTimer(object):
+    """Timer used when the profiler is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+null_timer = NullTimer()
+
+
+class Timer(object):
+    __slots__ = ['profiler', 'name', 'start']
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.add_time(self.name, self.start, perf_counter())
+        return False
+
+
+class Profiler(object):
+    """Record times and counters of frames
+
+    :param max_frames: number of recent frames kept for histograms
+    :param max_events: most trace events kept; older events are dropped
+    """
+
+    def __init__(self, max_frames=600, max_events=200000):
+        self.enabled = False
+        self.epoch = perf_counter()
+
+        # ms of each timer and value of each counter in this frame
+        self.times = dict()
+        self.counters = dict()
+
+        # (times, counters) of recent frames
+        self.frames = deque(maxlen=max_frames)
+
+        # chrome trace events
+        self.events = deque(maxlen=max_events)
+
+        # (owner, attribute name, original value or None)
+        self._patched = list()
+
+    def enable(self):
+        """Start recording, and instrument the hot paths of the game"""
+        if not self.enabled:
+            self.enabled = True
+            self.instrument_game()
+
+    def disable(self):
+        """Stop recording, and remove all instrumentation"""
+        self.enabled = False
+        while self._patched:
+            owner, attr, original = self._patched.pop()
+            if original is None:
+                delattr(owner, attr)
+            else:
+                setattr(owner, attr, original)
+
+    def clear(self):
+        self.times.clear()
+        self.counters.clear()
+        self.frames.clear()
+        self.events.clear()
+
+    def timer(self, name):
+        """Return context manager which times a section of code"""
+        if self.enabled:
+            return Timer(self, name)
+        return null_timer
+
+    def add_time(self, name, start, end):
+        """Record a section that ran from start to end, in seconds"""
+        ms = (end - start) * 1000.
+        times = self.times
+        times[name] = times.get(name, 0.) + ms
+        self.events.append({'name': name, 'ph': 'X', 'pid': 0, 'tid': 0,
+                            'ts': (start - self.epoch) * 1e6,
+                            'dur': ms * 1000.})
+
+    def count(self, name, value=1):
+        """Add value to a counter of this frame"""
+        counters = self.counters
+        counters[name] = counters.get(name, 0) + value
+
+    def set_counter(self, name, value):
+        """Set a counter of this frame, for values that are not summed"""
+        self.counters[name] = value
+
+    def end_frame(self):
+        """Keep the times and counters of this frame and start a new one"""
+        if self.counters:
+            self.events.append({'name': 'counters', 'ph': 'C', 'pid': 0,
+                                'ts': (perf_counter() - self.epoch) * 1e6,
+                                'args': dict(self.counters)})
+        self.frames.append((self.times, self.counters))
+        self.times = dict()
+        self.counters = dict()
+
+    def instrument(self, owner, attr, name=None, after=None, timed=True):
+        """Replace a method with one that records it
+
+        :param owner: class with the method
+        :param attr: name of the method
+        :param name: name of the timer; default is Class.method
+        :param after: function called with (profiler, self, result) after
+                      each call, to record counters
+        :param timed: if False, only after is called
+        """
+        original = getattr(owner, attr)
+        if name is None:
+            name = "%s.%s" % (owner.__name__, attr)
+        add_time = self.add_time
+
+        @wraps(original)
+        def wrapper(obj, *args, **kwargs):
+            start = perf_counter()
+            result = original(obj, *args, **kwargs)
+            if timed:
+                add_time(name, start, perf_counter())
+            if after is not None:
+                after(self, obj, result)
+            return result
+
+        self._patched.append((owner, attr, vars(owner).get(attr)))
+        setattr(owner, attr, wrapper)
+
+    def instrument_game(self):
+        """Instrument the game loop, physics, drawing and events"""
+        from zkit.eventbus import EventBus
+        from zkit.eventgroup import EventGroup
+        from zkit.hex_model import HexMapModel
+        from zkit.hex_view import HexMapView
+        from zkit.physics import PhysicsGroup, ArrayPhysicsGroup
+        from zkit.scheduler import FrameScheduler
+
+        def awake(profiler, group, result):
+            profiler.set_counter('sprites awake', len(group.awake))
+
+        def dirty(profiler, view, result):
+            profiler.count('dirty rects', len(result or ()))
+
+        def raised(profiler, bus, result):
+            profiler.count('events raised')
+
+        def frame(profiler, scheduler, result):
+            profiler.end_frame()
+
+        # phases of Game.loop are timed by its scheduler
+        run = FrameScheduler.run
+        add_time = self.add_time
+
+        @wraps(run)
+        def run_phase(scheduler, name, func, *args):
+            start = perf_counter()
+            try:
+                return run(scheduler, name, func, *args)
+            finally:
+                add_time('loop.' + name, start, perf_counter())
+
+        self._patched.append((FrameScheduler, 'run',
+                              vars(FrameScheduler).get('run')))
+        FrameScheduler.run = run_phase
+
+        self.instrument(FrameScheduler, 'end_frame', after=frame,
+                        timed=False)
+        name = 'PhysicsGroup.update'
+        self.instrument(PhysicsGroup, 'update', name, awake)
+        self.instrument(ArrayPhysicsGroup, 'update', name, awake)
+        self.instrument(HexMapView, 'draw', after=dirty)
+        self.instrument(HexMapView, 'clear')
+        self.instrument(EventGroup, 'update')
+        self.instrument(HexMapModel, 'pathfind')
+        self.instrument(EventBus, 'raise_event', after=raised, timed=False)
+
+    def frame_times(self, name):
+        """Return list of ms of a timer in the recent frames"""
+        return [times.get(name, 0.) for times, counters in self.frames]
+
+    def histogram(self, name, bins=(1, 2, 4, 8, 16, 33, 66)):
+        """Return count of recent frames in each bin of a timer
+
+        A frame counts in the first bin that is at least its time, in ms;
+        the last count is of frames slower than every bin.
+        """
+        counts = [0] * (len(bins) + 1)
+        for ms in self.frame_times(name):
+            for i, edge in enumerate(bins):
+                if ms <= edge:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+        return counts
+
+    def summary(self):
+        """Return text with the mean, 95th percentile and worst frame of
+        every timer, and the mean of every counter
+        """
+        names = set()
+        counter_names = set()
+        for times, counters in self.frames:
+            names.update(times)
+            counter_names.update(counters)
+        lines = list()
+        for name in sorted(names):
+            values = sorted(self.frame_times(name))
+            mean = sum(values) / len(values)
+            p95 = values[min(len(values) - 1, int(len(values) * .95))]
+            lines.append("%-28s mean %7.3fms  p95 %7.3fms  max %7.3fms" %
+                         (name, mean, p95, values[-1]))
+        for name in sorted(counter_names):
+            values = [counters.get(name, 0) for t, counters in self.frames]
+            lines.append("%-28s mean %9.1f" %
+                         (name, sum(values) / float(len(values))))
+        return "\n".join(lines)
+
+    def write_trace(self, path):
+        """Write the recorded events to a Chrome trace file"""
+        with open(path, 'w') as fp:
+            json.dump({'traceEvents': list(self.events),
+                       'displayTimeUnit': 'ms'}, fp)
+
+
+# profiler of the game
+profiler = Profiler()
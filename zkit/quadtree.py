@@ -1,11 +1,16 @@
 """
-Two classes for quadtree collision detection.
+Classes for quadtree collision detection.
 
 A quadtree is used with pyscroll to detect overlapping tiles.
+
+FastQuadTree and LinearQuadTree are built once from all of their items;
+DynamicQuadTree can be changed after it is built.
 """
 
 import itertools
+from math import ceil, floor, inf
 
+import numpy
 from pygame import Rect
 
 
@@ -24,9 +29,10 @@ class FastQuadTree(object):
     original code from http://pygame.org/wiki/QuadTree
     """
 
-    __slots__ = ['items', 'cx', 'cy', 'nw', 'sw', 'ne', 'se']
+    __slots__ = ['items', 'rects', 'cx', 'cy', 'nw', 'sw', 'ne', 'se',
+                 'x0', 'y0', 'x1', 'y1']
 
-    def __init__(self, items, depth=4, boundary=None):
+    def __init__(self, items, depth=4, boundary=None, region=None):
         """Creates a quad-tree.
 
         @param items:
@@ -38,16 +44,27 @@ class FastQuadTree(object):
 
         @param boundary:
             The bounding rectangle of all of the items in the quad-tree.
+
+        @param region:
+            Used when building sub-quadrants; (x0, y0, x1, y1) of the
+            points this quadrant owns.  Queries report an item only from
+            the quadrant owning the top left of its overlap with the
+            query, so an item in many quadrants is found once.
         """
 
         # The sub-quadrants are empty to start with.
         self.nw = self.ne = self.se = self.sw = None
+        self.cx = self.cy = None
+        if region is None:
+            region = -inf, -inf, inf, inf
+        x0, y0, x1, y1 = self.x0, self.y0, self.x1, self.y1 = region
 
         # If we've reached the maximum depth then insert all items into this
         # quadrant.
         depth -= 1
         if depth == 0 or not items:
             self.items = items
+            self.rects = [Rect(item) for item in items]
             return
 
         # Find this quadrant's centre.
@@ -68,10 +85,11 @@ class FastQuadTree(object):
 
         for item in items:
             # Which of the sub-quadrants does the item overlap?
-            in_nw = item.left <= cx and item.top <= cy
-            in_sw = item.left <= cx and item.bottom >= cy
-            in_ne = item.right >= cx and item.top <= cy
-            in_se = item.right >= cx and item.bottom >= cy
+            r = Rect(item)
+            in_nw = r.left <= cx and r.top <= cy
+            in_sw = r.left <= cx and r.bottom >= cy
+            in_ne = r.right >= cx and r.top <= cy
+            in_se = r.right >= cx and r.bottom >= cy
 
             # If it overlaps all 4 quadrants then insert it at the current
             # depth, otherwise append it to a list to be inserted under every
@@ -84,22 +102,35 @@ class FastQuadTree(object):
                 if in_se: se_items.append(item)
                 if in_sw: sw_items.append(item)
 
-        # Create the sub-quadrants, recursively.
+        # collidelistall is much faster with plain rects than with items
+        # that have a rect attribute
+        self.rects = [Rect(item) for item in self.items]
+
+        # Create the sub-quadrants, recursively.  Points on the centre
+        # lines are owned by the quadrants to the east and south.
+        left, top = boundary.left, boundary.top
+        right, bottom = boundary.right, boundary.bottom
+        mx = min(max(cx, x0), x1)
+        my = min(max(cy, y0), y1)
         if nw_items:
             self.nw = FastQuadTree(nw_items, depth,
-                                   (boundary.left, boundary.top, cx, cy))
+                                   (left, top, cx - left, cy - top),
+                                   (x0, y0, mx, my))
 
         if ne_items:
             self.ne = FastQuadTree(ne_items, depth,
-                                   (cx, boundary.top, boundary.right, cy))
+                                   (cx, top, right - cx, cy - top),
+                                   (mx, y0, x1, my))
 
         if se_items:
             self.se = FastQuadTree(se_items, depth,
-                                   (cx, cy, boundary.right, boundary.bottom))
+                                   (cx, cy, right - cx, bottom - cy),
+                                   (mx, my, x1, y1))
 
         if sw_items:
             self.sw = FastQuadTree(sw_items, depth,
-                                   (boundary.left, cy, cx, boundary.bottom))
+                                   (left, cy, cx - left, bottom - cy),
+                                   (x0, my, mx, y1))
 
     def __iter__(self):
         return itertools.chain(self.items, self.nw, self.ne, self.se, self.sw)
@@ -114,22 +145,7 @@ class FastQuadTree(object):
             The bounding rectangle being tested against the quad-tree. This
             must possess left, top, right and bottom attributes.
         """
-
-        # Find the hits at the current level.
-        _hits = rect.collidelistall(self.items)
-        hits = set(self.items[i] for i in _hits)
-
-        # Recursively check the lower quadrants.
-        if self.nw and rect.left <= self.cx and rect.top <= self.cy:
-            hits |= self.nw.hit(rect)
-        if self.sw and rect.left <= self.cx and rect.bottom >= self.cy:
-            hits |= self.sw.hit(rect)
-        if self.ne and rect.right >= self.cx and rect.top <= self.cy:
-            hits |= self.ne.hit(rect)
-        if self.se and rect.right >= self.cx and rect.bottom >= self.cy:
-            hits |= self.se.hit(rect)
-
-        return hits
+        return set(self.hit_into(rect, []))
 
     def hit_rect(self, rect):
         """Returns the items that overlap a bounding rectangle.
@@ -157,3 +173,715 @@ class FastQuadTree(object):
             hits |= self.se.hit_rect(rect)
 
         return hits
+
+    def hit_into(self, rect, out, dedupe=True):
+        """Appends the items that overlap a rectangle to a list.
+
+        Unlike hit, no sets are made and the quadrants are searched
+        without recursion, so the only allocations are the lists made by
+        collidelistall.
+
+        @param rect:
+            The pygame.Rect being tested against the quad-tree.
+
+        @param out:
+            The list to append the items to.
+
+        @param dedupe:
+            If False, an item stored in several quadrants may be appended
+            more than once, which saves a little time.
+
+        @return:
+            out
+        """
+        left, top, right, bottom = rect.left, rect.top, rect.right, rect.bottom
+        append = out.append
+        collide = rect.collidelistall
+        stack = [self]
+        pop = stack.pop
+        push = stack.append
+        while stack:
+            node = pop()
+            hits = collide(node.rects)
+            if hits:
+                items = node.items
+                if dedupe:
+                    rects = node.rects
+                    x0, y0, x1, y1 = node.x0, node.y0, node.x1, node.y1
+                    for i in hits:
+                        r = rects[i]
+                        x = r.left if r.left > left else left
+                        y = r.top if r.top > top else top
+                        if x0 <= x < x1 and y0 <= y < y1:
+                            append(items[i])
+                else:
+                    for i in hits:
+                        append(items[i])
+
+            cx = node.cx
+            if cx is None:
+                continue
+            cy = node.cy
+            if left <= cx:
+                if node.nw and top <= cy:
+                    push(node.nw)
+                if node.sw and bottom >= cy:
+                    push(node.sw)
+            if right >= cx:
+                if node.ne and top <= cy:
+                    push(node.ne)
+                if node.se and bottom >= cy:
+                    push(node.se)
+        return out
+
+    def hit_many(self, rects, outs=None):
+        """Finds the items that overlap each of many rectangles.
+
+        The quad-tree is walked once for all of the rectangles; each
+        quadrant is only tested against the rectangles that reach it.
+
+        @param rects:
+            A sequence of pygame.Rects.
+
+        @param outs:
+            A list for each rect to append its items to, or None to make
+            new lists.
+
+        @return:
+            outs
+        """
+        if outs is None:
+            outs = [[] for rect in rects]
+        stack = [(self, range(len(rects)))]
+        while stack:
+            node, active = stack.pop()
+            items = node.items
+            node_rects = node.rects
+            x0, y0, x1, y1 = node.x0, node.y0, node.x1, node.y1
+            for j in active:
+                rect = rects[j]
+                hits = rect.collidelistall(node_rects)
+                if hits:
+                    append = outs[j].append
+                    left, top = rect.left, rect.top
+                    for i in hits:
+                        r = node_rects[i]
+                        x = r.left if r.left > left else left
+                        y = r.top if r.top > top else top
+                        if x0 <= x < x1 and y0 <= y < y1:
+                            append(items[i])
+
+            cx = node.cx
+            if cx is None:
+                continue
+            cy = node.cy
+            west = [j for j in active if rects[j].left <= cx]
+            east = [j for j in active if rects[j].right >= cx]
+            if node.nw:
+                stack.append((node.nw, [j for j in west
+                                        if rects[j].top <= cy]))
+            if node.sw:
+                stack.append((node.sw, [j for j in west
+                                        if rects[j].bottom >= cy]))
+            if node.ne:
+                stack.append((node.ne, [j for j in east
+                                        if rects[j].top <= cy]))
+            if node.se:
+                stack.append((node.se, [j for j in east
+                                        if rects[j].bottom >= cy]))
+        return outs
+
+    def hit_point(self, x, y, out):
+        """Appends the items which contain a point to a list.
+
+        Only the quadrants which own the point are searched; that is one
+        quadrant on each level.
+
+        @return:
+            out
+        """
+        append = out.append
+        node = self
+        while node is not None:
+            rects = node.rects
+            for i in range(len(rects)):
+                if rects[i].collidepoint(x, y):
+                    append(node.items[i])
+            cx = node.cx
+            if cx is None:
+                break
+            if x < cx:
+                node = node.nw if y < node.cy else node.sw
+            else:
+                node = node.ne if y < node.cy else node.se
+        return out
+
+    def hit_circle(self, x, y, radius, out):
+        """Appends the items which overlap a circle to a list.
+
+        @return:
+            out
+        """
+        # the circle touches items whose right or bottom edge is on its
+        # left or top, so the rect reaches one more pixel that way
+        size = int(ceil(radius * 2)) + 2
+        rect = Rect(int(floor(x - radius)) - 1, int(floor(y - radius)) - 1,
+                    size, size)
+        left, top, right, bottom = rect.left, rect.top, rect.right, rect.bottom
+        limit = radius * radius
+        append = out.append
+        collide = rect.collidelistall
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            rects = node.rects
+            x0, y0, x1, y1 = node.x0, node.y0, node.x1, node.y1
+            for i in collide(rects):
+                r = rects[i]
+                # same as hit_into, so an item is only found once
+                ox = r.left if r.left > left else left
+                oy = r.top if r.top > top else top
+                if not (x0 <= ox < x1 and y0 <= oy < y1):
+                    continue
+
+                # keep only the items that touch the circle
+                dx = dy = 0
+                if x < r.left:
+                    dx = r.left - x
+                elif x > r.right:
+                    dx = x - r.right
+                if y < r.top:
+                    dy = r.top - y
+                elif y > r.bottom:
+                    dy = y - r.bottom
+                if dx * dx + dy * dy <= limit:
+                    append(node.items[i])
+
+            cx = node.cx
+            if cx is None:
+                continue
+            cy = node.cy
+            if left <= cx:
+                if node.nw and top <= cy:
+                    stack.append(node.nw)
+                if node.sw and bottom >= cy:
+                    stack.append(node.sw)
+            if right >= cx:
+                if node.ne and top <= cy:
+                    stack.append(node.ne)
+                if node.se and bottom >= cy:
+                    stack.append(node.se)
+        return out
+
+
+class _Node(object):
+    """Quadrant of a DynamicQuadTree"""
+
+    __slots__ = ['parent', 'depth', 'cx', 'cy', 'hw', 'hh', 'bounds',
+                 'items', 'rects', 'count', 'children']
+
+    def __init__(self, parent, depth, cx, cy, hw, hh, loose):
+        self.parent = parent
+        self.depth = depth
+        self.cx = cx
+        self.cy = cy
+        self.hw = hw
+        self.hh = hh
+
+        # items can stick out of the quadrant by the loose factor
+        left = int(floor(cx - hw * loose))
+        top = int(floor(cy - hh * loose))
+        self.bounds = Rect(left, top,
+                           int(ceil(cx + hw * loose)) - left,
+                           int(ceil(cy + hh * loose)) - top)
+        self.items = []
+        self.rects = []
+
+        # number of items in this quadrant and all below it
+        self.count = 0
+        self.children = None
+
+
+class DynamicQuadTree(object):
+    """A loose quad-tree which items can be added to and removed from.
+
+    Items are kept in the smallest quadrant whose loose bounds contain
+    them.  The loose bounds of a quadrant are larger than the quadrant, so
+    small items never get stuck in a large quadrant because they cross its
+    centre line.  Quadrants are split when they hold more than max_items,
+    and merged again when their quadrant and the ones below hold no more
+    than half of that.
+
+    Items must be hashable, and a pygame.Rect can be made from them; for
+    example, objects with a .rect attribute.  After the rect of an item
+    changes, call update.  Items which do not fit in the boundary are kept
+    at the top of the tree, so any rect can be stored.
+    """
+
+    def __init__(self, boundary, items=(), max_items=8, max_depth=8,
+                 loose=2.0):
+        """Creates a quad-tree.
+
+        @param boundary:
+            The area most items will be in.
+
+        @param items:
+            A sequence of items to store in the quad-tree.
+
+        @param max_items:
+            Split a quadrant when it holds more than this many items.
+
+        @param max_depth:
+            The maximum number of levels of quadrants.
+
+        @param loose:
+            How much larger the bounds of a quadrant are than the quadrant.
+        """
+        boundary = Rect(boundary)
+        self.max_items = max_items
+        self.max_depth = max_depth
+        self.loose = loose
+        self.root = _Node(None, 1, boundary.centerx, boundary.centery,
+                          boundary.width / 2., boundary.height / 2., loose)
+
+        # the quadrant holding each item
+        self.nodes = dict()
+        for item in items:
+            self.insert(item)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, item):
+        return item in self.nodes
+
+    def __iter__(self):
+        return iter(list(self.nodes))
+
+    def insert(self, item):
+        """Add an item, or update it if it is already in the quad-tree"""
+        if item in self.nodes:
+            self.remove(item)
+        self._insert(self.root, item, Rect(item))
+
+    def remove(self, item):
+        """Remove an item; raises KeyError if it is not in the quad-tree"""
+        node = self.nodes.pop(item)
+        i = node.items.index(item)
+        del node.items[i]
+        del node.rects[i]
+        parent = node
+        while parent is not None:
+            parent.count -= 1
+            parent = parent.parent
+        self._merge(node)
+
+    def discard(self, item):
+        """Remove an item if it is in the quad-tree"""
+        if item in self.nodes:
+            self.remove(item)
+
+    def update(self, item):
+        """Move an item after its rect changed"""
+        node = self.nodes[item]
+        rect = Rect(item)
+
+        # in the same quadrant, just keep the new rect
+        if node.bounds.contains(rect) or node.parent is None:
+            if node.children is None or self._child(node, rect) is None:
+                node.rects[node.items.index(item)] = rect
+                return
+
+        self.remove(item)
+        self._insert(self.root, item, rect)
+
+    def clear(self):
+        root = self.root
+        self.root = _Node(None, 1, root.cx, root.cy, root.hw, root.hh,
+                          self.loose)
+        self.nodes.clear()
+
+    def hit(self, rect):
+        """Returns the items that overlap a bounding rectangle.
+
+        Returns the set of all items in the quad-tree that overlap with a
+        bounding rectangle.
+
+        @param rect:
+            The bounding rectangle being tested against the quad-tree.
+        """
+        return set(self.hit_into(Rect(rect), []))
+
+    def hit_into(self, rect, out):
+        """Appends the items that overlap a rectangle to a list.
+
+        Items are only stored once, so there are no duplicates.
+
+        @param rect:
+            The pygame.Rect being tested against the quad-tree.
+
+        @param out:
+            The list to append the items to.
+
+        @return:
+            out
+        """
+        append = out.append
+        collide = rect.collidelistall
+        colliderect = rect.colliderect
+        stack = [self.root]
+        pop = stack.pop
+        push = stack.append
+        while stack:
+            node = pop()
+            hits = collide(node.rects)
+            if hits:
+                items = node.items
+                for i in hits:
+                    append(items[i])
+            children = node.children
+            if children is not None:
+                for child in children:
+                    if child.count and colliderect(child.bounds):
+                        push(child)
+        return out
+
+    def hit_rect(self, rect):
+        """Returns the rects of the items that overlap a rectangle.
+
+        @param rect:
+            The bounding rectangle being tested against the quad-tree.
+        """
+        rect = Rect(rect)
+        hits = set()
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            rects = node.rects
+            for i in rect.collidelistall(rects):
+                hits.add(tuple(rects[i]))
+            if node.children is not None:
+                stack.extend(child for child in node.children
+                             if child.count and rect.colliderect(child.bounds))
+        return hits
+
+    def _child(self, node, rect):
+        # the child quadrant which can hold rect, or None
+        cx, cy = rect.center
+        children = node.children
+        child = children[(cx >= node.cx) + 2 * (cy >= node.cy)]
+        if child.bounds.contains(rect):
+            return child
+        return None
+
+    def _insert(self, node, item, rect):
+        while True:
+            node.count += 1
+            if node.children is None:
+                break
+            child = self._child(node, rect)
+            if child is None:
+                break
+            node = child
+
+        node.items.append(item)
+        node.rects.append(rect)
+        self.nodes[item] = node
+        if node.children is None and len(node.items) > self.max_items \
+                and node.depth < self.max_depth:
+            self._split(node)
+
+    def _split(self, node):
+        hw = node.hw / 2.
+        hh = node.hh / 2.
+        depth = node.depth + 1
+        loose = self.loose
+        node.children = [_Node(node, depth, node.cx + dx * hw,
+                               node.cy + dy * hh, hw, hh, loose)
+                         for dy in (-1, 1) for dx in (-1, 1)]
+
+        # move the items which fit into the new quadrants
+        items = node.items
+        rects = node.rects
+        node.items = []
+        node.rects = []
+        for item, rect in zip(items, rects):
+            child = self._child(node, rect)
+            if child is None:
+                node.items.append(item)
+                node.rects.append(rect)
+                self.nodes[item] = node
+            else:
+                self._insert(child, item, rect)
+
+    def _merge(self, node):
+        # collapse the highest quadrant that holds few enough items
+        limit = self.max_items // 2
+        target = None
+        while node is not None:
+            if node.children is not None and node.count <= limit:
+                target = node
+            node = node.parent
+        if target is None:
+            return
+
+        stack = list(target.children)
+        target.children = None
+        while stack:
+            node = stack.pop()
+            for item, rect in zip(node.items, node.rects):
+                target.items.append(item)
+                target.rects.append(rect)
+                self.nodes[item] = target
+            if node.children is not None:
+                stack.extend(node.children)
+
+
+def _spread_bits(v):
+    # put a 0 bit between each of the 16 low bits of v
+    v = (v | (v << 8)) & 0x00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F
+    v = (v | (v << 2)) & 0x33333333
+    v = (v | (v << 1)) & 0x55555555
+    return v
+
+
+def _ranges(starts, counts):
+    # concatenated aranges of starts[i] .. starts[i] + counts[i]
+    total = int(counts.sum())
+    offsets = numpy.cumsum(counts) - counts
+    return numpy.repeat(starts - offsets, counts) + numpy.arange(total)
+
+
+class LinearQuadTree(object):
+    """A static quad-tree packed into flat arrays.
+
+    Items are sorted by the Morton code of their centre, so every
+    quadrant holds a run of consecutive items.  A quadrant keeps the
+    bounds of its items instead of its own area, like a bounding volume
+    hierarchy, so items are never stored twice.  The depth is chosen from
+    the number of items, and quadrants with few items are not split.
+
+    The quadrants are kept in flat lists and numpy arrays, not as an
+    object for each quadrant.  hit_into walks the lists; hit_many tests
+    all of the queries against a level of the tree at once with numpy.
+
+    Items must be hashable, and a pygame.Rect can be made from them.
+    Items with no area never collide, and are left out.
+    """
+
+    def __init__(self, items, leaf_size=8, max_depth=12):
+        """Creates a quad-tree.
+
+        @param items:
+            A sequence of items to store in the quad-tree.
+
+        @param leaf_size:
+            Quadrants with no more than this many items are not split.
+
+        @param max_depth:
+            The most levels of quadrants.
+        """
+        rects = [Rect(item) for item in items]
+        keep = [i for i, rect in enumerate(rects) if rect.width and
+                rect.height]
+        items = [items[i] for i in keep]
+        bounds = numpy.array([tuple(rects[i]) for i in keep],
+                             dtype=numpy.int64).reshape(-1, 4)
+        bounds[:, 2] += bounds[:, 0]
+        bounds[:, 3] += bounds[:, 1]
+        n = len(items)
+
+        # about leaf_size items in each quadrant of the lowest level
+        depth = 0
+        while (4 ** depth) * leaf_size < n and depth < max_depth:
+            depth += 1
+        self.depth = depth
+
+        codes = numpy.zeros(n, dtype=numpy.int64)
+        if n and depth:
+            cx = bounds[:, 0] + bounds[:, 2]
+            cy = bounds[:, 1] + bounds[:, 3]
+            scale = (1 << depth) - 1
+            x0, x1 = cx.min(), cx.max()
+            y0, y1 = cy.min(), cy.max()
+            qx = (cx - x0) * scale // max(x1 - x0, 1)
+            qy = (cy - y0) * scale // max(y1 - y0, 1)
+            codes = _spread_bits(qx) | (_spread_bits(qy) << 1)
+        order = numpy.argsort(codes, kind='stable')
+        codes = codes[order]
+        bounds = bounds[order]
+        order = order.tolist()
+        self.items = [items[i] for i in order]
+        self.rects = [rects[keep[i]] for i in order]
+
+        # the quadrants of each level are the runs of items which share
+        # the leading bits of their codes
+        levels = list()
+        for level in range(depth + 1):
+            prefix = codes >> (2 * (depth - level))
+            if n:
+                starts = numpy.flatnonzero(
+                    numpy.concatenate(([True], prefix[1:] != prefix[:-1])))
+            else:
+                starts = numpy.zeros(0, dtype=numpy.int64)
+            levels.append(starts)
+
+        node_start = numpy.concatenate(levels)
+        node_end = numpy.concatenate(
+            [numpy.append(starts[1:], n) for starts in levels])
+        child_start = numpy.zeros(len(node_start), dtype=numpy.int64)
+        child_end = numpy.zeros(len(node_start), dtype=numpy.int64)
+        first = 0
+        for level, starts in enumerate(levels[:-1]):
+            below = levels[level + 1]
+            base = first + len(starts)
+            ends = numpy.append(starts[1:], n)
+            count = ends - starts
+            split = count > leaf_size
+            i = slice(first, base)
+            child_start[i] = numpy.where(
+                split, base + numpy.searchsorted(below, starts), 0)
+            child_end[i] = numpy.where(
+                split, base + numpy.searchsorted(below, ends), 0)
+            first = base
+
+        node_bounds = numpy.zeros((len(node_start), 4), dtype=numpy.int64)
+        if n:
+            first = 0
+            for starts in levels:
+                i = slice(first, first + len(starts))
+                for j, reduce in enumerate((numpy.minimum, numpy.minimum,
+                                            numpy.maximum, numpy.maximum)):
+                    node_bounds[i, j] = reduce.reduceat(bounds[:, j], starts)
+                first += len(starts)
+
+        # arrays for hit_many
+        self.bounds = bounds
+        self.node_bounds = node_bounds
+        self.node_start = node_start
+        self.node_end = node_end
+        self.child_start = child_start
+        self.child_end = child_end
+
+        # lists for hit_into; indexing lists is faster than arrays
+        self._node_bounds = [node_bounds[:, i].tolist() for i in range(4)]
+        self._nodes = (node_start.tolist(), node_end.tolist(),
+                       child_start.tolist(), child_end.tolist())
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def hit(self, rect):
+        """Returns the set of items that overlap a rectangle."""
+        return set(self.hit_into(Rect(rect), []))
+
+    def hit_rect(self, rect):
+        """Returns the rects of the items that overlap a rectangle."""
+        return set(tuple(Rect(item)) for item in self.hit(rect))
+
+    def hit_into(self, rect, out):
+        """Appends the items that overlap a rectangle to a list.
+
+        @param rect:
+            The pygame.Rect being tested against the quad-tree.
+
+        @param out:
+            The list to append the items to.
+
+        @return:
+            out
+        """
+        left, top, right, bottom = rect.left, rect.top, rect.right, rect.bottom
+        if left >= right or top >= bottom or not self.items:
+            return out
+        items = self.items
+        rects = self.rects
+        append = out.append
+        collide = rect.collidelistall
+        nl, nt, nr, nb = self._node_bounds
+        node_start, node_end, child_start, child_end = self._nodes
+        stack = [0]
+        pop = stack.pop
+        while stack:
+            i = pop()
+            l, t, r, b = nl[i], nt[i], nr[i], nb[i]
+            if l >= right or r <= left or t >= bottom or b <= top:
+                continue
+            if left <= l and r <= right and top <= t and b <= bottom:
+                # all of the items are inside the rect
+                out.extend(items[node_start[i]:node_end[i]])
+            elif child_start[i] < child_end[i]:
+                stack.extend(range(child_start[i], child_end[i]))
+            else:
+                start = node_start[i]
+                for j in collide(rects[start:node_end[i]]):
+                    append(items[start + j])
+        return out
+
+    def hit_many(self, rects, outs=None):
+        """Finds the items that overlap each of many rectangles.
+
+        @param rects:
+            A sequence of pygame.Rects.
+
+        @param outs:
+            A list for each rect to append its items to, or None to make
+            new lists.
+
+        @return:
+            outs
+        """
+        if outs is None:
+            outs = [[] for rect in rects]
+        if not rects or not self.items:
+            return outs
+
+        query = numpy.array([tuple(rect) for rect in rects],
+                            dtype=numpy.int64).reshape(-1, 4)
+        query[:, 2] += query[:, 0]
+        query[:, 3] += query[:, 1]
+
+        def overlaps(bounds, q):
+            return ((bounds[:, 0] < query[q, 2]) &
+                    (bounds[:, 2] > query[q, 0]) &
+                    (bounds[:, 1] < query[q, 3]) &
+                    (bounds[:, 3] > query[q, 1]))
+
+        # pairs of (query, quadrant) which may overlap, one level at a time
+        q = numpy.flatnonzero((query[:, 2] > query[:, 0]) &
+                              (query[:, 3] > query[:, 1]))
+        node = numpy.zeros(len(q), dtype=numpy.int64)
+        hit_q = list()
+        hit_item = list()
+        while len(q):
+            keep = overlaps(self.node_bounds[node], q)
+            q = q[keep]
+            node = node[keep]
+            count = self.child_end[node] - self.child_start[node]
+            leaf = count == 0
+
+            # test the items of leaves
+            lq = q[leaf]
+            ln = node[leaf]
+            size = self.node_end[ln] - self.node_start[ln]
+            item = _ranges(self.node_start[ln], size)
+            item_q = numpy.repeat(lq, size)
+            found = overlaps(self.bounds[item], item_q)
+            hit_q.append(item_q[found])
+            hit_item.append(item[found])
+
+            count = count[~leaf]
+            node = _ranges(self.child_start[node[~leaf]], count)
+            q = numpy.repeat(q[~leaf], count)
+
+        hit_q = numpy.concatenate(hit_q)
+        hit_item = numpy.concatenate(hit_item)
+        order = numpy.argsort(hit_q, kind='stable')
+        items = self.items
+        for j, i in zip(hit_q[order].tolist(), hit_item[order].tolist()):
+            outs[j].append(items[i])
+        return outs
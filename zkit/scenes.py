@@ -7,6 +7,8 @@ from pygame.draw import rect as draw_rect
 from pygame.time import Clock
 
 from zkit import config
+from zkit.eventbus import EventBus
+from zkit.scheduler import FrameScheduler
 
 
 class Game(object):
@@ -17,6 +19,7 @@ class Game(object):
         self.target_fps = target_fps
         self.clock = Clock()
         self.main_surface = main_surface
+        self.scheduler = FrameScheduler(1000. / target_fps)
 
     def register_scene(self, scene):
         self.scenes[scene.name] = scene
@@ -37,7 +40,8 @@ class Game(object):
     def loop(self):
         DEBUG = config.getboolean('display', 'debug')
 
-        draw_interval = 1 / float(self.target_fps)
+        # delta is in ms
+        draw_interval = 1000. / config.getfloat('display', 'draw-fps')
         tick_fps = self.target_fps
         draw_timer = 0
         tick = self.clock.tick
@@ -45,52 +49,68 @@ class Game(object):
         fps_display_acc = 0
         get_fps = self.clock.get_fps
         poll_event = event.poll
+        scheduler = self.scheduler
+        scheduler.budget = 1000. / tick_fps
+        scheduler.max_skipped_draws = config.getint('display',
+                                                    'max_skipped_draws')
+        run = scheduler.run
 
         while len(self.scene_stack) > 0:
-            events = list()
-            e = poll_event()
-            while e:
-                events.append(e)
-                if e.type == QUIT:
-                    while len(self.scene_stack) > 0:
-                        self.pop_scene()
-                    sys.exit()
-                e = poll_event()
-
+            # the clock sleeps here, so the frame begins after it
             delta = tick(tick_fps)
+            scheduler.begin_frame()
             fps = get_fps()
 
             fps_display_acc += delta
             if fps_display_acc >= 10000:
-                set_caption("FPS ::: %.4f" % fps)
+                set_caption("FPS ::: %.4f  %s" % (fps, scheduler.report()))
                 fps_display_acc = 0
 
-            self.current_scene.update_events()
-            self.current_scene.update(delta, events)
+            events = run('events', self.poll_events, poll_event)
+
+            run('update_events', self.current_scene.update_events)
+            run('update', self.current_scene.update, delta, events)
 
             draw_timer += delta
-            if draw_timer >= draw_interval:
+            if draw_timer >= draw_interval and scheduler.should_draw():
                 if DEBUG:
                     main_surface.fill((0, 0, 0))
 
-                draw_timer -= draw_interval
-                self.current_scene.clear(main_surface)
-                dirty = self.current_scene.draw(main_surface)
+                # do not try to catch up on frames that were not drawn
+                draw_timer = min(draw_timer - draw_interval, draw_interval)
+                run('clear', self.current_scene.clear, main_surface)
+                dirty = run('draw', self.current_scene.draw, main_surface)
 
                 if DEBUG:
                     for rect in dirty:
                         draw_rect(main_surface, (0, 255, 0), rect, 1)
                         flip()
                 else:
-                    update(dirty)
+                    run('display', update, dirty)
+
+            scheduler.run_deferred()
+            scheduler.end_frame()
+
+    def poll_events(self, poll_event):
+        events = list()
+        e = poll_event()
+        while e:
+            events.append(e)
+            if e.type == QUIT:
+                while len(self.scene_stack) > 0:
+                    self.pop_scene()
+                sys.exit()
+            e = poll_event()
+        return events
 
 
 class Scene(object):
     def __init__(self, name, game):
         self.game = game
         self.name = name
-        self.state = {"events": {}}
-        # events are stored as {"event-name": list of kwargs dicts}
+        self.events = EventBus()
+        self.state = {"events": self.events}
+        # state["events"].get("event-name") returns a list of kwargs dicts
 
     def setup(self):
         raise NotImplemented("Not implemented by subclass")
@@ -111,28 +131,10 @@ class Scene(object):
         pass
 
     def raise_event(self, originator, event_name, **kwargs):
-        event = dict(kwargs)
-        event["originator"] = originator
-        event["frames_left"] = 2
-        try:
-            events = self.state["events"][event_name]
-        except KeyError:
-            events = list()
-            self.state['events'][event_name] = events
-        finally:
-            events.append(event)
+        self.events.raise_event(originator, event_name, **kwargs)
 
     def update_events(self):
-        events = self.state["events"]
-        for event_type, event_list in events.items():
-            dead = list()
-            for e in event_list:
-                e["frames_left"] -= 1
-                if e["frames_left"] <= 0:
-                    dead.append(e)
-
-            for e in dead:
-                event_list.remove(e)
+        self.events.expire()
 
     def clear_events(self):
-        self.state["events"] = dict()
+        self.events.clear()
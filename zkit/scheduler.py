@@ -0,0 +1,170 @@
+"""
+Frame scheduler for the game loop.
+
+The scheduler measures the time spent in each phase of a frame (polling
+events, updating, drawing), runs deferred low priority work in the time
+left over once the frame is done, and tells the game loop when frames are
+over budget so it can skip drawing.  All times are in milliseconds, like
+the deltas of the game loop.
+
+Scenes can defer work through game.scheduler:
+
+    game.scheduler.defer(self.refresh_paths, priority=1, cost=2)
+
+and can check scheduler.degraded to do less, such as updating the AI of
+distant sprites less often, while the game is running slow.  HexMapView
+draws the map chunks around the viewport this way, and holds off while
+the game is degraded.
+"""
+from heapq import heappush, heappop
+from itertools import count
+from time import perf_counter
+
+
+__all__ = ['FrameScheduler']
+
+
+class FrameScheduler(object):
+    """Measure the phases of frames and run deferred tasks in slack time
+
+    :param budget: milliseconds per frame
+    :param max_skipped_draws: most frames in a row that drawing is skipped
+    :param max_delay: frames a deferred task can wait before it is run,
+                      even if there is no time left
+    :param smoothing: weight of the last frame in the averages
+    """
+
+    def __init__(self, budget, max_skipped_draws=2, max_delay=30,
+                 smoothing=.1):
+        self.budget = float(budget)
+        self.max_skipped_draws = max_skipped_draws
+        self.max_delay = max_delay
+        self.smoothing = smoothing
+
+        # ms of each phase in the last frame, and averaged over frames
+        self.phase_times = dict()
+        self.phase_averages = dict()
+
+        self.frame = 0
+        self.frame_start = perf_counter()
+        self.frame_time = 0.
+        self.average_frame_time = 0.
+        self.skipped_draws = 0
+
+        # heap of (priority, sequence, frame deferred, cost, task)
+        self.deferred = list()
+        self._sequence = count()
+
+    def begin_frame(self):
+        self.frame += 1
+        self.frame_start = perf_counter()
+        self.phase_times.clear()
+
+    def end_frame(self):
+        """Record the time of the frame and update the averages"""
+        self.frame_time = self.elapsed()
+        a = self.smoothing
+        if self.frame == 1:
+            self.average_frame_time = self.frame_time
+        else:
+            self.average_frame_time += a * (self.frame_time -
+                                            self.average_frame_time)
+        averages = self.phase_averages
+        for name, ms in self.phase_times.items():
+            try:
+                averages[name] += a * (ms - averages[name])
+            except KeyError:
+                averages[name] = ms
+
+    def elapsed(self):
+        """Return ms since the frame began"""
+        return (perf_counter() - self.frame_start) * 1000.
+
+    def remaining(self):
+        """Return ms left in the budget of this frame"""
+        return self.budget - self.elapsed()
+
+    def run(self, name, func, *args):
+        """Call func as a phase of the frame and return its result"""
+        start = perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.record(name, (perf_counter() - start) * 1000.)
+
+    def record(self, name, ms):
+        """Add ms to the time of a phase in this frame"""
+        times = self.phase_times
+        times[name] = times.get(name, 0.) + ms
+
+    @property
+    def degraded(self):
+        """True if frames are taking longer than the budget"""
+        return self.average_frame_time > self.budget
+
+    def should_draw(self):
+        """Return False if this frame is over budget and should not draw
+
+        Drawing is never skipped more than max_skipped_draws frames in a
+        row.
+        """
+        if self.remaining() < 0 and \
+                self.skipped_draws < self.max_skipped_draws:
+            self.skipped_draws += 1
+            return False
+        self.skipped_draws = 0
+        return True
+
+    def defer(self, task, priority=0, cost=0.):
+        """Run a task when there is time left at the end of a frame
+
+        Tasks with smaller priority numbers run first, and tasks with the
+        same priority run in the order they were deferred.  If task
+        returns True, it has more to do and is deferred again.
+
+        :param task: callable which takes no arguments
+        :param priority: smaller numbers run first
+        :param cost: estimate of the ms the task takes
+        """
+        heappush(self.deferred, (priority, next(self._sequence),
+                                 self.frame, cost, task))
+
+    def run_deferred(self):
+        """Run deferred tasks while there is time left; return number run
+
+        Tasks which have waited more than max_delay frames are run even if
+        the frame is over budget, so they are not put off forever.
+        """
+        deferred = self.deferred
+        oldest = self.frame - self.max_delay
+        start = perf_counter()
+        again = list()
+        ran = 0
+        while deferred:
+            priority, sequence, frame, cost, task = deferred[0]
+            if self.remaining() < cost and frame >= oldest:
+                # a later task may be overdue, even if this one is not
+                overdue = [i for i in deferred if i[2] < oldest]
+                if not overdue:
+                    break
+                item = min(overdue)
+                deferred.remove(item)
+                deferred.sort()
+                priority, sequence, frame, cost, task = item
+            else:
+                heappop(deferred)
+            ran += 1
+            if task():
+                again.append((priority, next(self._sequence), self.frame,
+                              cost, task))
+        for item in again:
+            heappush(deferred, item)
+        self.record('deferred', (perf_counter() - start) * 1000.)
+        return ran
+
+    def report(self):
+        """Return text with the average ms of each phase"""
+        phases = ["%s %.1f" % (name, ms) for name, ms in
+                  sorted(self.phase_averages.items())]
+        return "frame %.1fms: %s" % (self.average_frame_time,
+                                     ", ".join(phases))
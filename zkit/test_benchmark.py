@@ -0,0 +1,61 @@
+import io
+import json
+import os
+import tempfile
+from contextlib import redirect_stdout
+from unittest import TestCase
+
+from zkit import benchmark
+
+
+class BenchmarkTestCase(TestCase):
+
+    def test_scenarios_run(self):
+        for name in benchmark.scenarios:
+            result = benchmark.run_scenario(name, .05, repeat=2, warmup=1)
+            self.assertEqual(result['samples'], 2)
+            self.assertGreater(result['items'], 0)
+            self.assertLessEqual(result['min'], result['median'])
+
+    def test_scenarios_are_seeded(self):
+        a = benchmark.run_scenario('pathfind', .1, repeat=1, warmup=0)
+        b = benchmark.run_scenario('pathfind', .1, repeat=1, warmup=0)
+        self.assertEqual(a['items'], b['items'])
+
+    def test_stats(self):
+        result = benchmark.stats([float(i) for i in range(1, 101)], 10)
+        self.assertEqual(result['median'], 51)
+        self.assertEqual(result['p90'], 91)
+        self.assertEqual(result['max'], 100)
+        self.assertAlmostEqual(result['throughput'], 10000 / 51.)
+
+    def test_compare(self):
+        baseline = {'a': {'median': 1., 'scale': 1.},
+                    'b': {'median': 1., 'scale': 1.},
+                    'c': {'median': 1., 'scale': 2.}}
+        results = {'a': {'median': 1.05, 'scale': 1.},
+                   'b': {'median': 1.5, 'scale': 1.},
+                   'c': {'median': 9., 'scale': 1.}}
+        self.assertEqual(benchmark.compare(results, baseline, .1),
+                         [('b', 1.5)])
+
+    def test_report_columns_fit_names(self):
+        result = {'items': 1, 'median': 1., 'p90': 1., 'p99': 1.,
+                  'max': 1., 'throughput': 1.}
+        results = {'a': result, 'hex_view_moving_far': result}
+        lines = benchmark.report(results).splitlines()
+        self.assertEqual(len(set(len(line) for line in lines)), 1)
+
+    def test_save_and_compare(self):
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        argv = ['quadtree', '--scale', '.05', '--repeat', '3']
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(benchmark.main(argv + ['--save', path]), 0)
+            with open(path) as fp:
+                baseline = json.load(fp)
+            baseline['quadtree']['median'] /= 100.
+            with open(path, 'w') as fp:
+                json.dump(baseline, fp)
+            self.assertEqual(benchmark.main(argv + ['--compare', path]), 1)
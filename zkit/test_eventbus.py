@@ -0,0 +1,104 @@
+from unittest import TestCase
+
+from zkit.eventbus import EventBus
+from zkit.scenes import Scene
+
+
+class Entity(object):
+    pass
+
+
+class EventBusTestCase(TestCase):
+
+    def setUp(self):
+        self.bus = EventBus()
+        self.a = Entity()
+        self.b = Entity()
+        self.c = Entity()
+
+    def test_get_like_dict_of_lists(self):
+        self.bus.raise_event('scene', 'Switch', key='door-1', state=True)
+        self.bus.expire()
+        self.bus.raise_event('scene', 'Switch', key='door-2', state=False)
+        events = self.bus.get('Switch', list())
+        self.assertEqual([e['key'] for e in events], ['door-1', 'door-2'])
+        self.assertEqual(events[0]['originator'], 'scene')
+        self.assertEqual(self.bus['Switch'], events)
+        self.assertEqual(self.bus.get('Collision', list()), [])
+        self.assertIsNone(self.bus.get('Collision'))
+        self.assertIn('Switch', self.bus)
+        self.assertEqual(list(self.bus), ['Switch'])
+        with self.assertRaises(KeyError):
+            self.bus['Collision']
+
+    def test_involving(self):
+        self.bus.raise_event('physics', 'Collision', left=self.a, right=self.b)
+        self.bus.raise_event('physics', 'Collision', left=self.b, right=self.c)
+        self.bus.raise_event(self.a, 'Collision', left=self.a, right=self.c)
+        self.assertEqual(len(self.bus.involving('Collision', self.a)), 2)
+        self.assertEqual(len(self.bus.involving('Collision', self.b)), 2)
+        self.assertEqual(self.bus.involving('Separation', self.a), [])
+        self.assertEqual(len(self.bus.involving('Collision', 'physics')), 2)
+
+    def test_events_live_for_lifetime(self):
+        self.bus.raise_event('scene', 'Switch')
+        self.bus.expire()
+        self.assertEqual(len(self.bus.get('Switch')), 1)
+        self.bus.raise_event(self.a, 'Collision', left=self.a, right=self.b)
+        self.bus.expire()
+        self.assertIsNone(self.bus.get('Switch'))
+        self.assertEqual(len(self.bus.involving('Collision', self.b)), 1)
+        self.bus.expire()
+        self.assertEqual(self.bus.involving('Collision', self.b), [])
+        self.assertEqual(len(self.bus), 0)
+
+    def test_events_read_like_dicts(self):
+        event = self.bus.raise_event(self.a, 'Switch', key='door-1',
+                                     state=True)
+        self.assertIs(event['originator'], self.a)
+        self.assertEqual(event['key'], 'door-1')
+        self.assertIs(event.get('state'), True)
+        self.assertIsNone(event.get('left'))
+        self.assertIsNone(event['left'])
+        self.assertIn('right', event)
+        self.assertNotIn('heading', event)
+        with self.assertRaises(KeyError):
+            event['heading']
+
+        event = self.bus.raise_event('physics', 'Collision',
+                                     left=self.a, right=self.b)
+        self.assertIsNone(event.extra)
+        self.assertIs(event['right'], self.b)
+        with self.assertRaises(KeyError):
+            event['key']
+
+    def test_expired_events_are_reused(self):
+        first = [self.bus.raise_event('physics', 'Collision', left=self.a,
+                                      right=self.b) for i in range(10)]
+        self.bus.expire()
+        self.bus.expire()
+        self.assertEqual(len(self.bus.pool), 10)
+        again = [self.bus.raise_event('physics', 'Separation', left=self.b,
+                                      right=self.c) for i in range(10)]
+        self.assertEqual(set(map(id, first)), set(map(id, again)))
+        self.assertEqual(self.bus.involving('Collision', self.a), [])
+        self.assertEqual(len(self.bus.involving('Separation', self.c)), 10)
+        self.assertEqual(again[0]['left'], self.b)
+
+    def test_clear(self):
+        self.bus.raise_event('scene', 'Switch')
+        self.bus.clear()
+        self.assertNotIn('Switch', self.bus)
+
+
+class SceneEventsTestCase(TestCase):
+
+    def test_scene_events(self):
+        scene = Scene('test', None)
+        entity = Entity()
+        scene.raise_event('scene', 'Collision', left=entity, right='wall')
+        scene.update_events()
+        self.assertEqual(len(scene.state['events'].get('Collision')), 1)
+        self.assertEqual(len(scene.events.involving('Collision', entity)), 1)
+        scene.update_events()
+        self.assertEqual(scene.state['events'].get('Collision', []), [])
@@ -5,6 +5,7 @@ from pygame.event import Event
 from pygame.sprite import Sprite
 
 from zkit.eventgroup import EventGroup
+from zkit.eventgroup import EventQueue
 from zkit.eventgroup import subscribe
 
 
@@ -60,6 +61,37 @@ class InfiniteEventSpriteB(Sprite):
         EventGroup.publish(self, TestEvent(key="infinite-a"))
 
 
+class KillerSprite(Sprite):
+
+    def __init__(self, victim, *groups):
+        Sprite.__init__(self, *groups)
+        self.victim = victim
+
+    @subscribe(pygame.KEYDOWN)
+    def on_keydown(self, event, delta):
+        self.victim.kill()
+
+
+class OrderedEvent(TestEvent):
+
+    def __init__(self, name, priority=None):
+        TestEvent.__init__(self, "ordered")
+        self.name = name
+        if priority is not None:
+            self.event_priority = priority
+
+
+class RecorderSprite(Sprite):
+
+    def __init__(self, *groups):
+        Sprite.__init__(self, *groups)
+        self.names = list()
+
+    @subscribe("ordered")
+    def on_ordered(self, event, delta):
+        self.names.append(event.name)
+
+
 class EventGroupTestCase(TestCase):
 
     def setUp(self):
@@ -113,3 +145,87 @@ class EventGroupTestCase(TestCase):
         self.g.update([Event(pygame.KEYDOWN, key=pygame.K_ESCAPE)], 0)
         self.assertEqual(len(self.s.called_events), 0)
         self.assertEqual(len(test_sprite2.called_events), 1)
+
+    def test_subscriptions_are_indexed_by_key(self):
+        self.assertEqual(sorted(map(str, self.g.subscriptions)),
+                         sorted(map(str, [pygame.KEYDOWN, "some-key"])))
+        self.s.kill()
+        self.assertEqual(self.g.subscriptions, {})
+        self.assertNotIn(self.s, self.g.sprite_subscriptions)
+
+    def test_removing_many_sprites(self):
+        sprites = [TestSprite(self.g) for i in range(4000)]
+        removed = [i for n, i in enumerate(sprites) if n % 4]
+        kept = [i for n, i in enumerate(sprites) if not n % 4]
+        for sprite in removed:
+            sprite.kill()
+        self.g.update([Event(pygame.KEYDOWN, key=pygame.K_ESCAPE)], 0)
+        self.assertTrue(all(len(i.called_events) == 1 for i in kept))
+        self.assertFalse(any(i.called_events for i in removed))
+        self.assertLessEqual(len(self.g.subscriptions[pygame.KEYDOWN]),
+                             2 * (len(kept) + 1))
+
+        self.g.remove(*kept)
+        self.g.update([TestEvent()], 0)
+        self.assertEqual(len(self.s.called_events), 2)
+        self.assertTrue(all(len(i.called_events) == 1 for i in kept))
+        self.g.empty()
+        self.assertEqual(self.g.subscriptions, {})
+        self.assertEqual(self.g.dead_subscriptions, {})
+
+    def test_sprites_killed_by_handler_do_not_handle_event(self):
+        self.g.empty()
+        victim = TestSprite()
+        self.g.add(KillerSprite(victim), victim)
+        self.g.update([Event(pygame.KEYDOWN, key=pygame.K_ESCAPE)], 0)
+        self.assertEqual(victim.called_events, [])
+
+    def test_sprites_added_with_constructor_are_subscribed(self):
+        test_sprite2 = TestSprite(self.g)
+        self.g.update([Event(pygame.KEYDOWN, key=pygame.K_ESCAPE)], 0)
+        self.assertEqual(len(test_sprite2.called_events), 1)
+
+    def test_many_filters(self):
+        subscription = subscribe("key", a=1, b=2)(None)()
+        self.assertTrue(subscription.match(Event(1, a=1, b=2)))
+        self.assertFalse(subscription.match(Event(1, a=1, b=3)))
+        self.assertIsNone(subscribe("key")(None)().match)
+
+    def test_events_with_same_priority_are_not_compared(self):
+        recorder = RecorderSprite(self.g)
+        for name in "abc":
+            self.g.publish_event(OrderedEvent(name))
+        self.g.update([], 0)
+        self.assertEqual(recorder.names, ["c", "b", "a"])
+
+    def test_events_are_handled_in_priority_order(self):
+        recorder = RecorderSprite(self.g)
+        for name, priority in [("a", 5), ("b", None), ("c", 1), ("d", 5)]:
+            self.g.publish_event(OrderedEvent(name, priority))
+        self.g.update([], 0)
+        self.assertEqual(recorder.names, ["c", "d", "a", "b"])
+
+    def test_update_stats(self):
+        self.g.add(OtherSprite(), OtherSprite())
+        self.g.profile = True
+        self.g.update([], 0)
+        self.assertEqual(self.g.events_handled, 2)
+        self.assertEqual(self.g.queue_depth, 2)
+        self.assertGreaterEqual(self.g.handler_time, 0)
+        self.assertEqual(list(self.g.handler_times), ["some-key"])
+
+
+class EventQueueTestCase(TestCase):
+
+    def test_queue(self):
+        queue = EventQueue()
+        self.assertFalse(queue)
+        queue.push(2, "a")
+        queue.push(1, "b")
+        queue.push(2, "c")
+        self.assertEqual(len(queue), 3)
+        self.assertEqual([queue.pop() for i in range(3)],
+                         [(1, "b"), (2, "c"), (2, "a")])
+        self.assertEqual(queue.max_depth, 3)
+        with self.assertRaises(IndexError):
+            queue.pop()
@@ -0,0 +1,120 @@
+import os
+import random
+import tempfile
+from unittest import TestCase
+
+from zkit.environ import maze
+from zkit.hex_array import ArrayHexMapModel, CellArray, CellView
+from zkit.hex_model import HexMapModel, Cell, evenr_to_axial
+
+
+def build_model(model_class, width=8, height=6):
+    model = model_class()
+    for q in range(width):
+        for r in range(height):
+            cell = Cell(filename='tileGrass.png', cost=q, height=r)
+            model.add_cell(evenr_to_axial((q, r)), cell)
+    return model
+
+
+class CellArrayTestCase(TestCase):
+
+    def setUp(self):
+        self.array = CellArray()
+
+    def test_store_and_get(self):
+        self.array[(3, -2)] = Cell(cost=4, filename='a.png', raised=True)
+        cell = self.array[(3, -2)]
+        self.assertIsInstance(cell, CellView)
+        self.assertEqual(cell.cost, 4)
+        self.assertEqual(cell.filename, 'a.png')
+        self.assertTrue(cell.raised)
+        self.assertEqual(len(self.array), 1)
+
+    def test_missing_cell(self):
+        self.assertIsNone(self.array.get((0, 0)))
+        with self.assertRaises(KeyError):
+            self.array[(0, 0)]
+
+    def test_views_write_through(self):
+        self.array[(0, 0)] = Cell()
+        self.array[(0, 0)].raised = True
+        self.array[(0, 0)].height = 2.5
+        self.assertTrue(self.array.raised_at((0, 0)))
+        self.assertEqual(self.array[(0, 0)].height, 2.5)
+
+    def test_views_survive_resize(self):
+        self.array[(0, 0)] = Cell(cost=7)
+        view = self.array[(0, 0)]
+        for i in range(1, 20):
+            self.array[(i, i)] = Cell()
+            self.array[(-i, -i)] = Cell()
+        self.assertEqual(view.cost, 7)
+
+    def test_views_are_equal(self):
+        self.array[(1, 1)] = Cell()
+        self.assertEqual(self.array[(1, 1)], self.array[(1, 1)])
+        self.assertIn(self.array[(1, 1)], [self.array[(1, 1)]])
+
+    def test_delete(self):
+        self.array[(1, 1)] = Cell()
+        del self.array[(1, 1)]
+        self.assertNotIn((1, 1), self.array)
+        self.assertEqual(len(self.array), 0)
+
+    def test_tiles_are_interned(self):
+        self.array[(0, 0)] = Cell(filename='a.png')
+        self.array[(1, 0)] = Cell(filename='a.png')
+        self.assertEqual(self.array.tile_names, [None, 'a.png'])
+
+    def test_planes_share_memory(self):
+        self.array[(2, 2)] = Cell()
+        self.array.plane('raised')[:] = True
+        self.assertTrue(self.array[(2, 2)].raised)
+
+
+class ArrayHexMapModelTestCase(TestCase):
+
+    def setUp(self):
+        self.dict_model = build_model(HexMapModel)
+        self.model = build_model(ArrayHexMapModel)
+
+    def test_same_cells(self):
+        self.assertEqual(sorted(self.model._data),
+                         sorted(self.dict_model._data))
+        for coords, cell in self.dict_model.cells:
+            self.assertEqual(self.model.get_cell(coords).to_json(),
+                             cell.to_json())
+
+    def test_same_size(self):
+        self.assertEqual(self.model.size, self.dict_model.size)
+
+    def test_same_surrounding(self):
+        self.model.get_cell((2, 2)).raised = True
+        self.dict_model.get_cell((2, 2)).raised = True
+        for coords, cell in self.dict_model.cells:
+            for avoid_raised in (True, False):
+                self.assertEqual(
+                    sorted(self.model.surrounding(coords, avoid_raised)),
+                    sorted(self.dict_model.surrounding(coords, avoid_raised)))
+
+    def test_save_and_load(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self.model.save_to_disk(path)
+            model = ArrayHexMapModel()
+            model.load_from_disk(path)
+        finally:
+            os.remove(path)
+        self.assertIsInstance(model._data, CellArray)
+        self.assertEqual(model.to_model()._make_file_data(),
+                         self.dict_model._make_file_data())
+
+    def test_maze(self):
+        random.seed(1)
+        model = maze.new_maze(12, 12, model_class=ArrayHexMapModel)
+        random.seed(1)
+        expected = maze.new_maze(12, 12)
+        self.assertEqual(model.to_model()._make_file_data()['data'],
+                         expected._make_file_data()['data'])
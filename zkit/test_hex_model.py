@@ -0,0 +1,400 @@
+import random
+from unittest import TestCase
+
+import numpy
+
+from zkit.environ import maze, util
+from zkit.hex_array import ArrayHexMapModel
+from zkit.hex_model import HexMapModel, Cell, evenr_to_axial
+from zkit.hex_model import collide_hex, hex_round, hex_round_array
+from zkit.hex_model import axial_to_evenr, axial_to_evenr_array
+from zkit.hex_model import evenr_to_axial_array
+from zkit.hex_model import pixel_to_axial, pixel_to_axial_array
+from zkit.hex_model import sprites_to_axial, sprites_to_axial_array
+from zkit.hex_model import axial_to_sprites, axial_to_sprites_array
+
+
+def build_model(width=10, height=10, model_class=HexMapModel):
+    model = model_class()
+    for q in range(width):
+        for r in range(height):
+            model.add_cell(evenr_to_axial((q, r)), Cell())
+    return model
+
+
+class PathfindTestCase(TestCase):
+    model_class = HexMapModel
+
+    def setUp(self):
+        self.model = build_model(model_class=self.model_class)
+
+    def raise_cells(self, cells):
+        for coords in cells:
+            self.model.get_cell(coords).raised = True
+
+    def assertPathValid(self, path, start, end):
+        self.assertEqual(path[0], start)
+        self.assertEqual(path[-1], end)
+        for a, b in zip(path, path[1:]):
+            self.assertEqual(self.model.dist(a, b), 1)
+            self.assertFalse(self.model.get_cell(b).raised)
+
+    def test_straight_path(self):
+        path, complete = self.model.pathfind((0, 0), (5, 0))
+        self.assertTrue(complete)
+        self.assertEqual(path, [(i, 0) for i in range(6)])
+
+    def test_path_around_wall(self):
+        self.raise_cells([(3, r) for r in range(0, 8)])
+        path, complete = self.model.pathfind((1, 2), (6, 2))
+        self.assertTrue(complete)
+        self.assertPathValid(path, (1, 2), (6, 2))
+
+    def test_prefers_cheap_cells(self):
+        for q in range(1, 5):
+            self.model.get_cell((q, 0)).cost = 10
+        path, complete = self.model.pathfind((0, 0), (5, 0))
+        self.assertTrue(complete)
+        self.assertPathValid(path, (0, 0), (5, 0))
+        self.assertNotIn((2, 0), path)
+
+    def test_no_path(self):
+        self.raise_cells(self.model.neighbor_table()[(0, 0)])
+        path, complete = self.model.pathfind((0, 0), (5, 5))
+        self.assertIsNone(path)
+        self.assertTrue(complete)
+
+    def test_blacklist(self):
+        path, complete = self.model.pathfind((0, 0), (3, 0),
+                                             blacklist={(1, 0)})
+        self.assertNotIn((1, 0), path)
+        self.assertPathValid(path, (0, 0), (3, 0))
+
+    def test_budget_returns_partial_path(self):
+        path, complete = self.model.pathfind((0, 0), (4, 8), budget=2)
+        self.assertFalse(complete)
+        self.assertEqual(path[0], (0, 0))
+
+    def test_search_can_resume(self):
+        search = self.model.search((0, 0), (4, 8))
+        steps = 0
+        while not search.step(1):
+            steps += 1
+        path, complete = search.result()
+        self.assertTrue(complete)
+        self.assertGreater(steps, 1)
+        self.assertPathValid(path, (0, 0), (4, 8))
+
+    def test_neighbor_table_follows_cells(self):
+        table = self.model.neighbor_table()
+        self.model.remove_cell((1, 0))
+        self.assertNotIn((1, 0), table)
+        self.assertNotIn((1, 0), table[(0, 0)])
+        self.model.add_cell((1, 0), Cell())
+        self.assertIn((1, 0), table[(0, 0)])
+        self.assertIn((0, 0), table[(1, 0)])
+
+    def test_ramble_stays_near_home(self):
+        home = (4, 4)
+        for i in range(10):
+            path, complete = self.model.pathfind_ramble(home, home, 2)
+            self.assertTrue(complete)
+            for coords in path:
+                self.assertLessEqual(self.model.dist(coords, home), 2)
+
+
+class ArrayPathfindTestCase(PathfindTestCase):
+    model_class = ArrayHexMapModel
+
+
+class HierarchyTestCase(TestCase):
+
+    def setUp(self):
+        random.seed(2)
+        self.model = maze.new_maze(40, 40)
+        self.model.enable_hierarchy(8)
+        self.open_cells = sorted(coords for coords, cell in self.model.cells
+                                 if not cell.raised)
+
+    def follow(self, start, end):
+        current = start
+        for i in range(100):
+            path, complete = self.model.pathfind(current, end)
+            self.assertEqual(path[0], current)
+            for a, b in zip(path, path[1:]):
+                self.assertEqual(self.model.dist(a, b), 1)
+                self.assertFalse(self.model.get_cell(b).raised)
+            current = path[-1]
+            if complete:
+                return current
+
+    def test_routes_match_astar(self):
+        random.seed(5)
+        for i in range(20):
+            start, end = random.sample(self.open_cells, 2)
+            search = self.model.search(start, end)
+            search.step()
+            path, complete = search.result()
+            route, cost = self.model.hierarchy.find_route(start, end)
+            self.assertEqual(path is None, route is None)
+            if route is not None:
+                self.assertEqual(route[0], start)
+                self.assertEqual(route[-1], end)
+                self.assertEqual(self.follow(start, end), end)
+
+    def test_touch_rebuilds_only_nearby_clusters(self):
+        hierarchy = self.model.hierarchy
+        rebuilt = list()
+        build_cluster = hierarchy._build_cluster
+
+        def spy(key):
+            rebuilt.append(key)
+            build_cluster(key)
+
+        hierarchy._build_cluster = spy
+        coords = self.open_cells[len(self.open_cells) // 2]
+        self.model.get_cell(coords).raised = True
+        self.model.touch_cell(coords)
+        hierarchy.update()
+        key = hierarchy.cluster_of(coords)
+        self.assertIn(key, rebuilt)
+        self.assertLess(len(rebuilt), len(hierarchy.clusters))
+
+    def test_touch_updates_routes(self):
+        hierarchy = self.model.hierarchy
+        start, end = self.open_cells[0], self.open_cells[-1]
+        route, cost = hierarchy.find_route(start, end)
+        self.assertIsNotNone(route)
+        blocked = route[1]
+        self.model.get_cell(blocked).raised = True
+        self.model.touch_cell(blocked)
+        route, cost = hierarchy.find_route(start, end)
+        self.assertTrue(route is None or blocked not in route)
+
+    def test_add_and_remove_cells(self):
+        hierarchy = self.model.hierarchy
+        coords = self.open_cells[0]
+        self.model.remove_cell(coords)
+        hierarchy.update()
+        self.assertNotIn(coords, hierarchy.clusters[
+            hierarchy.cluster_of(coords)])
+        self.model.add_cell(coords, Cell())
+        hierarchy.update()
+        self.assertIn(coords, hierarchy.clusters[
+            hierarchy.cluster_of(coords)])
+
+
+class FlowFieldTestCase(TestCase):
+    model_class = HexMapModel
+
+    def setUp(self):
+        random.seed(2)
+        self.model = maze.new_maze(20, 20, model_class=self.model_class)
+        self.open_cells = sorted(coords for coords, cell in self.model.cells
+                                 if not cell.raised)
+        self.goal = self.open_cells[len(self.open_cells) // 2]
+
+    def test_paths_lead_to_goal(self):
+        field = self.model.flow_field(self.goal)
+        for coords in self.open_cells:
+            path = field.path(coords)
+            if path is None:
+                continue
+            self.assertEqual(path[-1], self.goal)
+            cost = sum(1 + self.model.get_cell(i).cost for i in path[1:])
+            self.assertEqual(cost, field.distance(coords))
+
+    def test_distance_matches_astar(self):
+        field = self.model.flow_field(self.goal)
+        for coords in self.open_cells[::10]:
+            path, complete = self.model.pathfind(coords, self.goal,
+                                                 budget=None)
+            if path is None:
+                self.assertIsNone(field.distance(coords))
+            else:
+                self.assertEqual(field.distance(coords), len(path) - 1)
+
+    def test_goal_has_no_next_step(self):
+        field = self.model.flow_field(self.goal)
+        self.assertEqual(field.distance(self.goal), 0)
+        self.assertIsNone(field.next_step(self.goal))
+
+    def test_max_cost(self):
+        field = self.model.flow_field(self.goal, max_cost=3)
+        for coords in self.open_cells:
+            distance = field.distance(coords)
+            self.assertTrue(distance is None or distance <= 3)
+
+    def test_fields_are_cached(self):
+        field = self.model.flow_field(self.goal)
+        self.assertIs(self.model.flow_field(self.goal), field)
+        self.assertIs(self.model.flow_field(self.goal, max_cost=5), field)
+
+    def assertFieldIsFresh(self, field):
+        fresh = type(field)(self.model, self.goal, field.max_cost)
+        self.assertEqual(len(field), len(fresh))
+        for coords, cell in self.model.cells:
+            self.assertEqual(field.distance(coords), fresh.distance(coords))
+        for coords in self.open_cells:
+            path = field.path(coords)
+            if path is not None:
+                cost = sum(1 + self.model.get_cell(i).cost
+                           for i in path[1:])
+                self.assertEqual(cost, field.distance(coords))
+
+    def test_missing_goal_makes_empty_field(self):
+        field = self.model.flow_field((-50, -50))
+        self.assertEqual(len(field), 0)
+        self.assertIsNone(field.distance(self.goal))
+        self.assertIsNone(field.path(self.goal))
+
+    def test_touch_repairs_affected_fields(self):
+        field = self.model.flow_field(self.goal)
+        path = field.path(self.open_cells[0])
+        blocked = path[len(path) // 2]
+        self.model.get_cell(blocked).raised = True
+        self.model.touch_cell(blocked)
+        self.assertIs(self.model.flow_field(self.goal), field)
+        self.assertNotIn(blocked, field)
+        self.assertFieldIsFresh(field)
+
+        self.model.get_cell(blocked).raised = False
+        self.model.touch_cell(blocked)
+        self.assertFieldIsFresh(field)
+
+        self.model.get_cell(path[1]).cost = 5
+        self.model.touch_cell(path[1])
+        self.assertFieldIsFresh(field)
+
+    def test_touch_repairs_opened_cells(self):
+        field = self.model.flow_field(self.goal, max_cost=12)
+        for coords, cell in list(self.model.cells):
+            if cell.raised and field.affected_by(coords):
+                cell.raised = False
+                self.model.touch_cell(coords)
+        self.assertFieldIsFresh(field)
+
+    def test_touch_repairs_removed_cells(self):
+        field = self.model.flow_field(self.goal)
+        path = field.path(self.open_cells[-1])
+        self.model.remove_cell(path[len(path) // 2])
+        self.assertFieldIsFresh(field)
+
+    def test_touch_goal(self):
+        field = self.model.flow_field(self.goal)
+        self.model.get_cell(self.goal).raised = True
+        self.model.touch_cell(self.goal)
+        self.assertFieldIsFresh(field)
+
+    def test_touch_keeps_unaffected_fields(self):
+        field = self.model.flow_field(self.goal, max_cost=2)
+        far = max(self.open_cells,
+                  key=lambda coords: self.model.dist(coords, self.goal))
+        self.model.touch_cell(far)
+        self.assertIs(self.model.flow_field(self.goal, max_cost=2), field)
+
+
+class ArrayFlowFieldTestCase(FlowFieldTestCase):
+    model_class = ArrayHexMapModel
+
+
+class WallTestCase(TestCase):
+    model_class = HexMapModel
+
+    def setUp(self):
+        random.seed(4)
+        self.model = maze.new_maze(12, 12, model_class=self.model_class)
+        self.circles = [(random.uniform(-1, 13), random.uniform(-1, 13),
+                         random.choice((.3, .5, .9))) for i in range(500)]
+
+    def brute_force(self, coords, radius):
+        """ the test collidecircle did before wall masks """
+        q, r = [int(i) for i in hex_round(coords)]
+        retval = list()
+        for n in util.surrounding_noclip((q, r)):
+            cell = self.model.get_cell(n)
+            if cell is not None and cell.raised and \
+                    collide_hex((coords[0], coords[1] - .1), n, radius, .9):
+                retval.append(n)
+        return sorted(retval)
+
+    def test_matches_brute_force(self):
+        for q, r, radius in self.circles:
+            self.assertEqual(sorted(self.model.collidecircle((q, r), radius)),
+                             self.brute_force((q, r), radius))
+
+    def test_batched_query(self):
+        q, r, radius = zip(*self.circles)
+        hits = self.model.collidecircles(q, r, radius)
+        for hit, (q, r, radius) in zip(hits, self.circles):
+            self.assertEqual(hit, bool(self.brute_force((q, r), radius)))
+
+    def test_touch_updates_walls(self):
+        coords = (5, 5)
+        cell = self.model.get_cell(coords)
+        for raised in (True, False, True):
+            cell.raised = raised
+            self.model.touch_cell(coords)
+            hit = self.model.collidecircle((6, 5), .9)
+            self.assertEqual(coords in hit, raised)
+            for q, r, radius in self.circles[:100]:
+                self.assertEqual(
+                    sorted(self.model.collidecircle((q, r), radius)),
+                    self.brute_force((q, r), radius))
+
+    def test_removed_cells_are_not_walls(self):
+        coords = (5, 5)
+        self.model.get_cell(coords).raised = True
+        self.model.touch_cell(coords)
+        self.assertIn(coords, self.model.collidecircle((6, 5), .9))
+        self.model.remove_cell(coords)
+        self.assertNotIn(coords, self.model.collidecircle((6, 5), .9))
+
+
+class ArrayWallTestCase(WallTestCase):
+    model_class = ArrayHexMapModel
+
+
+class TransformArrayTestCase(TestCase):
+
+    def setUp(self):
+        random.seed(6)
+        self.points = [(random.uniform(-50, 50), random.uniform(-50, 50))
+                       for i in range(500)]
+        self.cells = [(random.randint(-30, 30), random.randint(-30, 30))
+                      for i in range(500)]
+
+    def assertMatches(self, function, array_function, points, *args):
+        x, y = zip(*points)
+        result = array_function(numpy.array(x), numpy.array(y), *args)
+        self.assertEqual(len(result), 2)
+        for point, a, b in zip(points, *result):
+            expected = function(point, *args) if args else function(point)
+            self.assertAlmostEqual(a, expected[0])
+            self.assertAlmostEqual(b, expected[1])
+
+    def test_hex_round(self):
+        self.assertMatches(hex_round, hex_round_array, self.points)
+        q, r = hex_round_array([.4, 2.6], [0, -1.2])
+        self.assertEqual(q.dtype.kind, 'i')
+        self.assertEqual((q.tolist(), r.tolist()), ([0, 3], [0, -1]))
+
+    def test_evenr(self):
+        self.assertMatches(evenr_to_axial, evenr_to_axial_array, self.cells)
+        self.assertMatches(axial_to_evenr, axial_to_evenr_array, self.cells)
+
+    def test_pixel_to_axial(self):
+        self.assertMatches(pixel_to_axial, pixel_to_axial_array,
+                           self.points, 30)
+
+    def test_sprites(self):
+        self.assertMatches(sprites_to_axial, sprites_to_axial_array,
+                           self.points)
+        self.assertMatches(axial_to_sprites, axial_to_sprites_array,
+                           self.points)
+
+    def test_empty(self):
+        q, r = sprites_to_axial_array([], [])
+        self.assertEqual(len(q), 0)
+        q, r = hex_round_array(q, r)
+        self.assertEqual(len(r), 0)
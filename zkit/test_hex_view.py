@@ -0,0 +1,422 @@
+import os
+import random
+from math import sqrt
+from unittest import TestCase, mock
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import pygame
+
+from zkit import hex_view
+from zkit import resources
+from zkit.chunks import ChunkCache
+from zkit.euclid import Vector2, Vector3
+from zkit.hex_model import HexMapModel, Cell, evenr_to_axial
+from zkit.hex_model import axial_to_sprites
+from zkit.hex_view import HexMapView
+from zkit.scheduler import FrameScheduler
+
+
+tile_colors = {
+    'tileGrass.png': (40, 160, 40, 255),
+    'tileRock_full.png': (120, 120, 120, 200),
+    'tileMagic_full.png': (160, 40, 160, 160),
+}
+
+
+def load_fake_resources():
+    for i, (filename, color) in enumerate(sorted(tile_colors.items())):
+        tile = pygame.Surface((40, 40 + i * 6), pygame.SRCALPHA)
+        tile.fill(color)
+        pygame.draw.circle(tile, (0, 0, 0, 0), (20, 20), 6)
+        resources.tiles[filename] = tile
+    backdrop = pygame.Surface((640, 480))
+    backdrop.fill((10, 20, 30))
+    resources.images['backdrop'] = backdrop
+
+
+class Marker(pygame.sprite.DirtySprite):
+
+    def __init__(self, coords, size=12):
+        super(Marker, self).__init__()
+        self.image = pygame.Surface((size, size))
+        self.rect = self.image.get_rect()
+        self.anchor = Vector2(size / 2, size)
+        self.position = Vector3(*axial_to_sprites(coords) + (0,))
+
+
+def build_model(width=12, height=10):
+    random.seed(7)
+    model = HexMapModel()
+    for q in range(width):
+        for r in range(height):
+            cell = Cell(filename='tileGrass.png')
+            if random.random() < .2:
+                cell.raised = True
+                cell.height = random.choice((1, 2))
+                cell.filename = 'tileRock_full.png'
+            model.add_cell(evenr_to_axial((q, r)), cell)
+    return model
+
+
+class DirtyRegionTestCase(TestCase):
+
+    def setUp(self):
+        load_fake_resources()
+        self.surface = pygame.Surface((640, 480), pygame.SRCALPHA)
+        self.model = build_model()
+        self.view = self.new_view()
+
+    def new_view(self):
+        view = HexMapView(None, self.model, 20)
+        view.draw(self.surface)
+        return view
+
+    def assertMatchesFullRedraw(self):
+        fresh = self.new_view()
+        self.assertEqual(pygame.image.tostring(self.view.map_buffer, 'RGBA'),
+                         pygame.image.tostring(fresh.map_buffer, 'RGBA'))
+        for coords, rect in fresh.cell_rects.items():
+            self.assertEqual(self.view.cell_rects[coords], rect)
+        for key, chunk in fresh.chunks.chunks.items():
+            mine = self.view.chunks.chunks[key]
+            self.assertEqual(len(mine.upper), len(chunk.upper))
+            upper = dict((up.coords, up) for up in chunk.upper)
+            for up in mine.upper:
+                self.assertEqual(up.rect, upper[up.coords].rect)
+                self.assertEqual(
+                    pygame.image.tostring(up.surface, 'RGBA'),
+                    pygame.image.tostring(upper[up.coords].surface, 'RGBA'))
+            self.assertEqual(mine.nbytes, chunk.nbytes)
+
+    def change_cell(self, coords, height, filename):
+        cell = self.model.get_cell(coords)
+        cell.height = height
+        cell.filename = filename
+        self.view.invalidate_cell(coords)
+        return self.view.draw(self.surface)
+
+    def test_raise_cell(self):
+        coords = evenr_to_axial((5, 5))
+        dirty = self.change_cell(coords, 3, 'tileMagic_full.png')
+        self.assertTrue(dirty)
+        area = sum(rect.width * rect.height for rect in dirty)
+        self.assertLess(area, 640 * 480 / 10)
+        self.assertMatchesFullRedraw()
+
+    def test_lower_cell(self):
+        coords = evenr_to_axial((5, 5))
+        self.change_cell(coords, 3, 'tileMagic_full.png')
+        self.change_cell(coords, 0, 'tileGrass.png')
+        self.assertMatchesFullRedraw()
+
+    def test_many_cells(self):
+        random.seed(3)
+        for i in range(10):
+            q, r = random.randrange(12), random.randrange(10)
+            self.change_cell(evenr_to_axial((q, r)), random.choice((0, 1, 3)),
+                             random.choice(sorted(tile_colors)))
+        self.assertMatchesFullRedraw()
+
+    def test_removed_cell_redraws_map(self):
+        coords = evenr_to_axial((5, 5))
+        self.model.remove_cell(coords)
+        self.model.add_cell(coords, Cell(filename='tileGrass.png'))
+        self.view.invalidate_cell((99, 99))
+        dirty = self.view.draw(self.surface)
+        self.assertEqual(dirty, [self.surface.get_rect()])
+
+
+class ChunkTestCase(TestCase):
+
+    def setUp(self):
+        load_fake_resources()
+        self.surface = pygame.Surface((320, 240), pygame.SRCALPHA)
+        self.model = build_model(40, 40)
+
+    def new_view(self, chunk_size=128, budget=None):
+        view = HexMapView(None, self.model, 20)
+        view.draw(self.surface)
+        if budget is None:
+            budget = 1 << 30
+        view.chunks = ChunkCache(chunk_size, budget, view.render_chunk)
+        view.needs_refresh = True
+        view.draw(self.surface)
+        return view
+
+    def test_chunk_size_does_not_change_picture(self):
+        small = self.new_view(64)
+        large = self.new_view(1024)
+        self.assertEqual(pygame.image.tostring(small.map_buffer, 'RGBA'),
+                         pygame.image.tostring(large.map_buffer, 'RGBA'))
+
+    def test_only_visible_chunks_are_drawn(self):
+        view = self.new_view()
+        self.assertTrue(view.chunks.chunks)
+        for key in view.chunks.chunks:
+            self.assertTrue(view.chunks.rect(key).colliderect(view.viewport))
+
+    def test_scroll(self):
+        view = self.new_view()
+        point = 100, 100
+        coords = view.cell_coords_from_surface(point)
+        view.scroll(200, 120)
+        dirty = view.draw(self.surface)
+        self.assertEqual(dirty, [self.surface.get_rect()])
+        self.assertEqual(view.cell_coords_from_surface((-100, -20)), coords)
+        for key in view.chunks.keys(view.viewport):
+            self.assertIn(key, view.chunks)
+
+    def test_budget(self):
+        chunk_bytes = 64 * 64 * 4
+        view = self.new_view(64, chunk_bytes * 30)
+        for i in range(20):
+            view.scroll(50, 30)
+            view.draw(self.surface)
+            pinned = sum(view.chunks.chunks[key].nbytes
+                         for key in view.chunks.pinned)
+            self.assertLessEqual(view.chunks.nbytes,
+                                 max(view.chunks.budget, pinned))
+
+    def test_cells_are_cut_for_visible_chunks(self):
+        view = self.new_view()
+        keys = set(view.chunks.keys(view.viewport))
+        self.assertEqual(set(view.chunks.chunks), keys)
+        tall = [coords for coords, cell in self.model.cells
+                if cell.height > 0]
+        cut = [up for key, chunk in view.chunks.chunks.items()
+               for up in chunk.upper]
+        self.assertTrue(cut)
+        self.assertLess(len(cut), len(tall) / 4)
+        self.assertLess(len(view.cell_rects), len(self.model.cells) / 4)
+        for key, chunk in view.chunks.chunks.items():
+            for up in chunk.upper:
+                self.assertTrue(view.chunks.rect(key).collidepoint(
+                    up.rect.topleft))
+
+        # cuts count against the budget, and are dropped with the chunk
+        nbytes = sum(chunk.nbytes for chunk in view.chunks.chunks.values())
+        self.assertEqual(view.chunks.nbytes, nbytes)
+        self.assertGreater(nbytes, len(keys) * 128 * 128 * 4)
+        key = next(iter(keys))
+        view.chunks.discard(key)
+        self.assertEqual(view.chunks.nbytes, sum(
+            chunk.nbytes for chunk in view.chunks.chunks.values()))
+
+    def test_cut_cells_match_any_chunk_size(self):
+        small = self.new_view(64)
+        large = self.new_view(1024)
+
+        def cuts(view):
+            return dict((up.coords, (up.rect, pygame.image.tostring(
+                up.surface, 'RGBA')))
+                for up in view.upper_in_rect(view.viewport, list()))
+
+        self.assertEqual(cuts(small), cuts(large))
+
+    def test_chunks_around_view_are_drawn_in_spare_time(self):
+        view = self.new_view()
+        view.scheduler = FrameScheduler(1000.)
+        view.scroll(10, 0)
+        view.draw(self.surface)
+        self.assertEqual(len(view.scheduler.deferred), 1)
+        view.scroll(10, 0)
+        view.draw(self.surface)
+        self.assertEqual(len(view.scheduler.deferred), 1)
+        visible = set(view.chunks.chunks)
+        view.scheduler.begin_frame()
+        self.assertEqual(view.scheduler.run_deferred(), 1)
+        around = set(view.chunks.keys(view.viewport.inflate(256, 256)))
+        self.assertEqual(set(view.chunks.chunks), around)
+        self.assertLess(visible, around)
+        self.assertEqual(view.chunks.pinned,
+                         set(view.chunks.keys(view.viewport)))
+        self.assertFalse(view.scheduler.deferred)
+
+    def test_prefetch_waits_while_degraded(self):
+        view = self.new_view()
+        view.scheduler = FrameScheduler(10.)
+        view.scheduler.average_frame_time = 20.
+        view.scroll(10, 0)
+        view.draw(self.surface)
+        cached = len(view.chunks)
+        view.scheduler.begin_frame()
+        view.scheduler.run_deferred()
+        self.assertEqual(len(view.chunks), cached)
+        self.assertEqual(len(view.scheduler.deferred), 1)
+
+    def test_invalidate_cell_updates_cached_chunks(self):
+        view = self.new_view(64)
+        coords = view.cell_coords_from_surface((160, 120))
+        cell = self.model.get_cell(coords)
+        cell.height = 3
+        cell.filename = 'tileMagic_full.png'
+        view.invalidate_cell(coords)
+        view.draw(self.surface)
+        fresh = self.new_view(64)
+        self.assertEqual(pygame.image.tostring(view.map_buffer, 'RGBA'),
+                         pygame.image.tostring(fresh.map_buffer, 'RGBA'))
+
+
+class CameraTestCase(TestCase):
+
+    def setUp(self):
+        load_fake_resources()
+        self.surface = pygame.Surface((320, 240), pygame.SRCALPHA)
+        self.model = build_model(20, 20)
+        self.view = HexMapView(None, self.model, 20)
+        self.view.draw(self.surface)
+
+    def assertRoundTrip(self):
+        view = self.view
+        for q, r in [evenr_to_axial((i, j)) for i in (0, 5, 19)
+                     for j in (0, 7, 19)]:
+            x, y = view.project((q, r)) - view.viewport.topleft
+            self.assertEqual(view.cell_coords_from_surface((x, y)), (q, r))
+            x += view.hex_radius * .4
+            self.assertEqual(view.cell_coords_from_surface((x, y)), (q, r))
+
+    def test_map_is_centered(self):
+        self.assertEqual(self.view.viewport.center,
+                         self.view.map_rect.center)
+
+    def test_round_trip(self):
+        for zoom in (1, .5, 2.5):
+            self.view.camera.zoom_to(zoom)
+            self.view.draw(self.surface)
+            self.assertRoundTrip()
+
+    def test_pan(self):
+        self.view.camera.zoom_to(2)
+        self.view.draw(self.surface)
+        x, y = self.view.viewport.topleft
+        self.view.scroll(30, -20)
+        self.view.draw(self.surface)
+        self.assertEqual(self.view.viewport.topleft, (x + 30, y - 20))
+        self.assertRoundTrip()
+
+    def test_zoom_keeps_anchor(self):
+        point = 40, 200
+        coords = self.view.coords_from_surface(point)
+        self.view.zoom(2, point)
+        self.view.draw(self.surface)
+        self.assertEqual(self.view.hex_radius, 40)
+        for a, b in zip(self.view.coords_from_surface(point), coords):
+            self.assertAlmostEqual(a, b, 1)
+
+    def test_zoom_is_clamped(self):
+        self.view.zoom(100)
+        self.assertEqual(self.view.camera.zoom,
+                         self.view.camera.max_zoom)
+
+    def test_zoom_reuses_scaled_tiles(self):
+        picture = pygame.image.tostring(self.view.map_buffer, 'RGBA')
+        with mock.patch.object(hex_view, 'smoothscale',
+                               wraps=hex_view.smoothscale) as smoothscale:
+            self.view.zoom(2)
+            self.view.draw(self.surface)
+            scaled = smoothscale.call_count
+            self.assertEqual(scaled, len(tile_colors))
+            self.view.zoom(.5)
+            self.view.draw(self.surface)
+            self.assertEqual(smoothscale.call_count, scaled)
+        self.assertEqual(pygame.image.tostring(self.view.map_buffer, 'RGBA'),
+                         picture)
+
+    def test_zoom_does_not_lay_out_map(self):
+        view = HexMapView(None, build_model(60, 60), 20)
+        view.draw(self.surface)
+        with mock.patch.object(view, 'cut_upper_cells',
+                               wraps=view.cut_upper_cells) as cut:
+            view.zoom(2)
+            view.draw(self.surface)
+            self.assertEqual(cut.call_count, len(view.chunks))
+        self.assertLess(len(view.cell_rects), len(view.data.cells) / 4)
+        self.assertEqual(set(view.chunks.chunks),
+                         set(view.chunks.keys(view.viewport)))
+
+    def test_scaled_tiles_are_evicted(self):
+        self.view.tile_sets.size = 2
+        widths = list()
+        for zoom in (1.5, 2, 3):
+            self.view.camera.zoom_to(zoom)
+            self.view.draw(self.surface)
+            widths.append(self.view.hex_radius * sqrt(3) + 1)
+        self.assertEqual(len(self.view.tile_sets), 2)
+        self.assertNotIn(widths[0], self.view.tile_sets)
+        self.assertIn(widths[2], self.view.tile_sets)
+
+
+class SpriteOverlapTestCase(TestCase):
+
+    def setUp(self):
+        load_fake_resources()
+        self.surface = pygame.Surface((640, 480), pygame.SRCALPHA)
+        self.view = HexMapView(None, build_model(20, 20), 20)
+        self.view.draw(self.surface)
+        random.seed(8)
+        self.markers = [Marker((random.uniform(0, 15), random.uniform(0, 15)),
+                               random.choice((8, 12, 30)))
+                        for i in range(200)]
+        self.view.add(*self.markers)
+
+    def overlapping(self):
+        """ sprites whose drawn rects overlap another, by brute force """
+        rects = [(sprite, rect) for sprite, rect in
+                 self.view.spritedict.items() if rect and sprite != "hover"]
+        retval = set()
+        for sprite, rect in rects:
+            for other, other_rect in rects:
+                if other is not sprite and rect.colliderect(other_rect):
+                    retval.add(sprite)
+        return retval
+
+    def test_overlapping_sprites_stay_dirty(self):
+        for frame in range(3):
+            self.view.draw(self.surface)
+            dirty = set(sprite for sprite in self.markers if sprite.dirty)
+            self.assertEqual(dirty, self.overlapping())
+        self.assertTrue(dirty)
+        self.assertLess(len(dirty), len(self.markers))
+
+    def test_moved_sprite_marks_new_neighbors(self):
+        self.view.draw(self.surface)
+        clean = [sprite for sprite in self.markers if not sprite.dirty]
+        mover, target = clean[:2]
+        mover.position = Vector3(*target.position)
+        mover.dirty = 1
+        self.view.draw(self.surface)
+        self.assertTrue(mover.dirty)
+        self.assertTrue(target.dirty)
+
+    def test_most_sprites_moving(self):
+        self.view.rebuild_share = .5
+        self.view.rebuild_sprites = 100
+        for frame in range(3):
+            for marker in self.markers:
+                marker.position.x += random.uniform(-.3, .3)
+                marker.dirty = 1
+            self.view.draw(self.surface)
+            self.assertTrue(self.view._sprite_quadtree_stale)
+            dirty = set(sprite for sprite in self.markers if sprite.dirty)
+            self.assertEqual(dirty, self.overlapping())
+
+        # with fewer sprites drawn, the persistent quadtree is used again
+        self.view.rebuild_share = 1.
+        self.view.draw(self.surface)
+        self.assertFalse(self.view._sprite_quadtree_stale)
+        self.assertEqual(set(self.view.sprite_quadtree),
+                         set(self.view.sprite_rects.values()))
+        dirty = set(sprite for sprite in self.markers if sprite.dirty)
+        self.assertEqual(dirty, self.overlapping())
+
+    def test_killed_sprites_leave_index(self):
+        self.view.rebuild_share = 1.
+        self.view.draw(self.surface)
+        marker = self.markers[0]
+        item = self.view.sprite_rects[marker]
+        self.assertIn(item, self.view.sprite_quadtree)
+        marker.kill()
+        self.assertNotIn(marker, self.view.sprite_rects)
+        self.assertNotIn(item, self.view.sprite_quadtree)
+        self.view.draw(self.surface)
@@ -0,0 +1,357 @@
+import random
+from unittest import TestCase
+
+from pygame.sprite import Sprite
+
+from zkit.euclid import Vector3
+from zkit.hex_model import HexMapModel, Cell, collide_hex, sprites_to_axial
+from zkit.hex_model import axial_to_sprites
+from zkit.physics import PhysicsGroup, ArrayPhysicsGroup, time_of_impact
+
+
+class Sound(object):
+    def play(self):
+        pass
+
+
+class Body(Sprite):
+    """ bodies start in the air, so they are not put to sleep """
+
+    def __init__(self, x=0.0, y=0.0, radius=.4):
+        Sprite.__init__(self)
+        self.position = Vector3(x, y, 10)
+        self.velocity = Vector3(0, 0, 0)
+        self.acceleration = Vector3(0, 0, 0)
+        self.max_velocity = [.15, .15, 100]
+        self.radius = radius
+        self.gravity = True
+        self.dirty = 0
+        self.bounce_sound = Sound()
+
+
+class Scene(object):
+
+    def __init__(self):
+        self.events = list()
+
+    def raise_event(self, originator, event_name, **kwargs):
+        self.events.append((event_name, kwargs['left'], kwargs['right']))
+
+
+def build_model(width=10, height=10):
+    model = HexMapModel()
+    for q in range(width):
+        for r in range(height):
+            model.add_cell((q, r), Cell())
+    return model
+
+
+class PhysicsGroupTestCase(TestCase):
+    group_class = PhysicsGroup
+
+    def setUp(self):
+        self.group = self.group_class(build_model())
+        self.scene = Scene()
+
+    def step(self, frames=1):
+        for i in range(frames):
+            self.group.update(self.group.timestep, self.scene)
+
+    def test_collision_and_separation(self):
+        a = Body(0, 0)
+        b = Body(.5, 0)
+        self.group.add(a, b)
+        self.step()
+        self.assertIn(('Collision', a, b), self.scene.events)
+        self.assertIn(('Collision', b, a), self.scene.events)
+
+        self.scene.events = list()
+        b.position.x = 20
+        self.group.wake_sprite(a)
+        self.group.wake_sprite(b)
+        self.step()
+        self.assertIn(('Separation', a, b), self.scene.events)
+        self.assertIn(('Separation', b, a), self.scene.events)
+
+    def test_far_sprites_do_not_collide(self):
+        self.group.add(Body(0, 0), Body(5, 5))
+        self.step()
+        self.assertEqual(self.scene.events, [])
+
+    def test_removed_sprites_forget_contacts(self):
+        a = Body(0, 0)
+        b = Body(.5, 0)
+        self.group.add(a, b)
+        self.step()
+        b.kill()
+        self.assertNotIn(b, self.group.broadphase)
+        self.assertEqual(self.group.stale, set())
+
+    def test_sprites_placed_after_add_are_found(self):
+        a = Body(0, 0)
+        a.position.z = 0
+        self.group.add(a)
+        a.position.x = 6
+        a.position.y = 6
+        self.step()
+        self.assertIn(a, self.group.sleeping)
+        self.assertIn(a, self.group.broadphase.query(6, 6, 1))
+
+        a.position.x = 3
+        self.group.wake_sprite(a)
+        self.assertIn(a, self.group.broadphase.query(3, 6, 1))
+        b = Body(3.5, 6)
+        b.position.z = 0
+        b.velocity.x = -.01
+        self.group.add(b)
+        self.step()
+        self.assertIn(('Collision', b, a), self.scene.events)
+
+    def test_broadphase_matches_brute_force(self):
+        random.seed(1)
+        bodies = [Body(random.uniform(0, 15), random.uniform(0, 15),
+                       random.choice((.4, .5, .8))) for i in range(150)]
+        self.group.add(*bodies)
+        self.step()
+        expected = set()
+        for a in bodies:
+            for b in bodies:
+                if a is not b and collide_hex(sprites_to_axial(a.position),
+                                              sprites_to_axial(b.position),
+                                              a.radius, b.radius):
+                    expected.add(('Collision', a, b))
+        self.assertEqual(set(self.scene.events), expected)
+
+
+class ArrayPhysicsGroupTestCase(PhysicsGroupTestCase):
+    group_class = ArrayPhysicsGroup
+
+    def simulate(self, group_class, frames):
+        random.seed(3)
+        model = build_model(20, 20)
+        for i in range(30):
+            coords = random.randrange(20), random.randrange(20)
+            model.get_cell(coords).raised = True
+        group = group_class(model)
+        scene = Scene()
+        bodies = list()
+        for i in range(40):
+            body = Body(random.uniform(2, 12), random.uniform(2, 12))
+            body.position.z = random.choice((0, 0, 1, 10))
+            body.velocity.x = random.uniform(-.1, .1)
+            body.velocity.y = random.uniform(-.1, .1)
+            body.acceleration.x = random.uniform(-.001, .001)
+            body.gravity = random.random() > .2
+            bodies.append(body)
+            group.add(body)
+            if i % 2:
+                group.collide_walls.add(body)
+        trace = list()
+        for frame in range(frames):
+            group.update(group.timestep, scene)
+            trace.append([tuple(body.position) + tuple(body.velocity) +
+                          (body in group.sleeping,) for body in bodies])
+        return trace
+
+    def test_matches_physics_group(self):
+        expected = self.simulate(PhysicsGroup, 200)
+        result = self.simulate(ArrayPhysicsGroup, 200)
+        for frame0, frame1 in zip(expected, result):
+            for body0, body1 in zip(frame0, frame1):
+                for a, b in zip(body0, body1):
+                    self.assertAlmostEqual(a, b)
+
+    def test_vectors_are_rows_of_state(self):
+        group = ArrayPhysicsGroup(build_model())
+        bodies = [Body(i, 1) for i in range(3)]
+        group.add(*bodies)
+        body = bodies[1]
+        position = body.position
+        self.assertEqual(tuple(group.state[1, :3]), (1, 1, 10))
+        body.velocity.x = .05
+        group.update(group.timestep, Scene())
+        self.assertIs(body.position, position)
+        self.assertEqual(tuple(group.state[1, :3]), tuple(position))
+        self.assertGreater(position.x, 1)
+        self.assertIs(type(position + (1, 0, 0)), Vector3)
+        self.assertIs(type(Vector3(1, 0, 0) + position), Vector3)
+        self.assertIs(type(position - position), Vector3)
+
+    def test_new_vectors_are_adopted(self):
+        group = ArrayPhysicsGroup(build_model())
+        body = Body(1, 1)
+        group.add(body)
+        body.position = Vector3(5, 5, 0)
+        body.velocity = Vector3(.05, 0, 0)
+        group.update(group.timestep, Scene())
+        self.assertEqual(tuple(group.state[0, :2]),
+                         (body.position.x, body.position.y))
+        self.assertGreater(body.position.x, 5)
+        self.assertIs(body.velocity, group.vectors[0][1])
+
+    def test_removed_rows_are_filled(self):
+        group = ArrayPhysicsGroup(build_model())
+        bodies = [Body(i, i) for i in range(20)]
+        group.add(*bodies)
+        removed = bodies.pop(3)
+        removed.kill()
+        self.assertIs(type(removed.position), Vector3)
+        self.assertEqual(tuple(removed.position), (3, 3, 10))
+        removed.position.x = 7
+        self.assertEqual(len(group.bodies), 19)
+        for body in bodies:
+            row = group.rows[body]
+            self.assertIs(group.bodies[row], body)
+            self.assertEqual(tuple(group.state[row, :3]), tuple(body.position))
+            self.assertEqual(body.position.x, body.position.y)
+        group.add(removed)
+        self.assertEqual(tuple(group.state[19, :3]), (7, 3, 10))
+
+
+class FixedStepTestCase(TestCase):
+
+    def setUp(self):
+        self.group = PhysicsGroup(build_model())
+        self.scene = Scene()
+        self.body = Body(1, 1)
+        self.body.velocity.x = .01
+        self.group.add(self.body)
+        self.timestep = self.group.timestep
+
+    def test_steps_fit_in_delta(self):
+        self.assertEqual(self.group.advance(self.timestep * 2.5,
+                                            self.scene), 2)
+        self.assertAlmostEqual(self.group.alpha, .5)
+        self.assertEqual(self.group.advance(self.timestep * .5,
+                                            self.scene), 1)
+        self.assertAlmostEqual(self.group.alpha, 0)
+
+    def test_steps_are_capped(self):
+        self.group.max_steps = 4
+        steps = self.group.advance(self.timestep * 100.25, self.scene)
+        self.assertEqual(steps, 4)
+        self.assertLess(self.group.accumulator, self.timestep)
+
+    def test_interpolated_position(self):
+        self.group.advance(self.timestep, self.scene)
+        x0 = self.group.previous[self.body][0]
+        x1 = self.body.position.x
+        self.assertEqual(self.group.interpolated(self.body).x, x0)
+        self.group.advance(self.timestep * .5, self.scene)
+        self.assertAlmostEqual(self.group.interpolated(self.body).x,
+                               (x0 + x1) / 2)
+
+
+class IslandTestCase(TestCase):
+
+    def setUp(self):
+        self.group = PhysicsGroup(build_model())
+        self.scene = Scene()
+
+    def step(self, frames=1):
+        for i in range(frames):
+            self.group.update(self.group.timestep, self.scene)
+
+    def resting_body(self, x, y):
+        body = Body(x, y)
+        body.position.z = 0
+        self.group.add(body)
+        return body
+
+    def test_resting_sprites_sleep(self):
+        bodies = [self.resting_body(i * 2, 0) for i in range(5)]
+        self.step()
+        self.assertEqual(self.group.awake, set())
+        self.assertEqual(self.group.sleeping, set(bodies))
+
+    def test_island_sleeps_as_a_unit(self):
+        a = self.resting_body(0, 0)
+        b = self.resting_body(1.5, 0)
+        c = Body(2, 0)
+        self.group.add(c)
+        self.step()
+        # b is at rest, but touching c, which is still falling
+        self.assertEqual(self.group.island(b), {b, c})
+        self.assertEqual(self.group.sleeping, {a})
+        while c in self.group.awake:
+            self.assertIn(b, self.group.awake)
+            self.step()
+        self.assertEqual(self.group.sleeping, {a, b, c})
+
+    def test_wake_island(self):
+        a = self.resting_body(0, 0)
+        b = self.resting_body(.5, 0)
+        c = self.resting_body(5, 5)
+        self.group.link(a, b)
+        self.step()
+        self.group.wake_sprite(a)
+        self.assertEqual(self.group.awake, {a, b})
+        self.assertEqual(self.group.sleeping, {c})
+
+    def test_collision_wakes_sleeping_sprite(self):
+        a = self.resting_body(0, 0)
+        self.step()
+        self.assertIn(a, self.group.sleeping)
+        b = Body(.5, 0)
+        self.group.add(b)
+        self.step()
+        self.assertIn(a, self.group.awake)
+        self.assertIn(('Collision', b, a), self.scene.events)
+
+
+class ContinuousTestCase(TestCase):
+    group_class = PhysicsGroup
+
+    def setUp(self):
+        model = build_model(20, 20)
+        for r in range(20):
+            model.get_cell((10, r)).raised = True
+        self.group = self.group_class(model)
+        self.scene = Scene()
+
+    def fast_body(self, coords, continuous):
+        body = Body(*axial_to_sprites(coords))
+        body.position.z = 0
+        body.max_velocity = [2, 2, 100]
+        body.velocity.x = 1
+        self.group.add(body)
+        if continuous:
+            self.group.continuous.add(body)
+        return body
+
+    def test_time_of_impact(self):
+        self.assertAlmostEqual(time_of_impact((0, 0), (10, 0), (5, 0), 1), .4)
+        self.assertEqual(time_of_impact((0, 0), (10, 0), (5, 0), 6), 0)
+        self.assertIsNone(time_of_impact((0, 0), (10, 0), (5, 2), 1))
+        self.assertIsNone(time_of_impact((0, 0), (2, 0), (5, 0), 1))
+
+    def test_discrete_tunnels_through_walls(self):
+        body = self.fast_body((7, 5), False)
+        self.group.collide_walls.add(body)
+        self.group.update(self.group.timestep, self.scene)
+        self.assertGreater(sprites_to_axial(body.position)[0], 10)
+
+    def test_continuous_stops_at_walls(self):
+        body = self.fast_body((7, 5), True)
+        self.group.collide_walls.add(body)
+        for i in range(5):
+            self.group.update(self.group.timestep, self.scene)
+        q = sprites_to_axial(body.position)[0]
+        self.assertGreater(q, 8)
+        self.assertLess(q, 10)
+
+    def test_continuous_hits_passed_sprites(self):
+        for continuous in (False, True):
+            self.scene.events = list()
+            body = self.fast_body((2, 5), continuous)
+            other = Body(*axial_to_sprites((4, 5)))
+            self.group.add(other)
+            self.group.update(self.group.timestep, self.scene)
+            self.assertEqual(('Collision', body, other) in self.scene.events,
+                             continuous)
+            body.kill()
+            other.kill()
+
+
+class ArrayContinuousTestCase(ContinuousTestCase):
+    group_class = ArrayPhysicsGroup
@@ -0,0 +1,75 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from zkit.eventbus import EventBus
+from zkit.hex_view import HexMapView
+from zkit.physics import PhysicsGroup
+from zkit.profiler import Profiler
+from zkit.scheduler import FrameScheduler
+
+
+class ProfilerTestCase(TestCase):
+
+    def setUp(self):
+        self.profiler = Profiler()
+        self.addCleanup(self.profiler.disable)
+
+    def test_disabled_profiler_leaves_methods_alone(self):
+        methods = [FrameScheduler.run, PhysicsGroup.update, HexMapView.draw,
+                   EventBus.raise_event]
+        self.profiler.enable()
+        self.assertIsNot(HexMapView.draw, methods[2])
+        self.profiler.disable()
+        self.assertEqual([FrameScheduler.run, PhysicsGroup.update,
+                          HexMapView.draw, EventBus.raise_event], methods)
+        self.assertNotIn('update', vars(HexMapView))
+        with self.profiler.timer('section'):
+            pass
+        self.assertEqual(self.profiler.times, {})
+
+    def test_game_is_instrumented(self):
+        self.profiler.enable()
+        scheduler = FrameScheduler(16)
+        bus = EventBus()
+        for frame in range(3):
+            scheduler.begin_frame()
+            for i in range(frame):
+                scheduler.run('update', bus.raise_event, 'scene', 'Switch')
+            scheduler.end_frame()
+        frames = list(self.profiler.frames)
+        self.assertEqual(len(frames), 3)
+        self.assertEqual([c.get('events raised', 0) for t, c in frames],
+                         [0, 1, 2])
+        self.assertEqual(len(self.profiler.frame_times('loop.update')), 3)
+        self.assertEqual(self.profiler.frame_times('loop.update')[0], 0)
+
+    def test_histogram_and_summary(self):
+        profiler = self.profiler
+        profiler.enable()
+        for ms in (.5, 3, 3, 100):
+            profiler.add_time('draw', 0, ms / 1000.)
+            profiler.count('dirty rects', 4)
+            profiler.end_frame()
+        self.assertEqual(profiler.histogram('draw', (1, 4, 16)),
+                         [1, 2, 0, 1])
+        summary = profiler.summary()
+        self.assertIn('draw', summary)
+        self.assertIn('dirty rects', summary)
+
+    def test_write_trace(self):
+        profiler = self.profiler
+        profiler.enable()
+        with profiler.timer('section'):
+            profiler.count('things', 2)
+        profiler.end_frame()
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        profiler.write_trace(path)
+        with open(path) as fp:
+            events = json.load(fp)['traceEvents']
+        self.assertEqual([e['ph'] for e in events], ['X', 'C'])
+        self.assertEqual(events[0]['name'], 'section')
+        self.assertEqual(events[1]['args'], {'things': 2})
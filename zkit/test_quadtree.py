@@ -0,0 +1,219 @@
+import random
+from unittest import TestCase
+
+from pygame import Rect
+
+from zkit.quadtree import FastQuadTree, DynamicQuadTree, LinearQuadTree
+
+
+class Item(object):
+
+    def __init__(self, rect):
+        self.rect = Rect(rect)
+
+    # FastQuadTree reads the sides of its items
+    left = property(lambda self: self.rect.left)
+    top = property(lambda self: self.rect.top)
+    right = property(lambda self: self.rect.right)
+    bottom = property(lambda self: self.rect.bottom)
+
+
+class RectItem(object):
+    """ item with only a rect, like SpriteRect of hex_view """
+    __slots__ = ['rect']
+
+    def __init__(self, rect):
+        self.rect = Rect(rect)
+
+
+def random_rect(size=40):
+    return Rect(random.randint(-50, 1000), random.randint(-50, 750),
+                random.randint(0, size), random.randint(0, size))
+
+
+class FastQuadTreeTestCase(TestCase):
+    item_class = Item
+
+    def setUp(self):
+        random.seed(10)
+        self.items = [self.item_class(random_rect()) for i in range(400)]
+        self.tree = FastQuadTree(self.items, 5)
+        self.queries = [random_rect(200) for i in range(100)]
+
+    def brute_force(self, query):
+        return set(item for item in self.items
+                   if query.colliderect(item.rect))
+
+    def test_hit(self):
+        for query in self.queries:
+            self.assertEqual(self.tree.hit(query), self.brute_force(query))
+
+    def test_hit_into_has_no_duplicates(self):
+        out = ['marker']
+        for query in self.queries:
+            del out[1:]
+            self.tree.hit_into(query, out)
+            self.assertEqual(out[0], 'marker')
+            self.assertEqual(len(out) - 1, len(set(out[1:])))
+            self.assertEqual(set(out[1:]), self.brute_force(query))
+
+    def test_hit_into_without_dedupe(self):
+        duplicates = 0
+        for query in self.queries:
+            out = self.tree.hit_into(query, [], dedupe=False)
+            self.assertEqual(set(out), self.brute_force(query))
+            duplicates += len(out) - len(set(out))
+        self.assertGreater(duplicates, 0)
+
+    def test_hit_many(self):
+        outs = self.tree.hit_many(self.queries)
+        for query, out in zip(self.queries, outs):
+            self.assertEqual(len(out), len(set(out)))
+            self.assertEqual(set(out), self.brute_force(query))
+
+    def test_hit_point(self):
+        for query in self.queries:
+            x, y = query.center
+            out = self.tree.hit_point(x, y, [])
+            self.assertEqual(len(out), len(set(out)))
+            self.assertEqual(set(out), set(
+                item for item in self.items if item.rect.collidepoint(x, y)))
+
+    def test_hit_point_on_item_edge(self):
+        item = self.items[0]
+        for x, y in (item.rect.topleft, (item.rect.right - 1, item.rect.top)):
+            self.assertIn(item, self.tree.hit_point(x, y, []))
+
+    def test_hit_circle(self):
+        for query in self.queries:
+            x, y = query.center
+            radius = query.width / 2.
+            expected = set()
+            for item in self.items:
+                r = item.rect
+                dx = x - min(max(x, r.left), r.right)
+                dy = y - min(max(y, r.top), r.bottom)
+                if r.width and r.height and dx * dx + dy * dy <= radius ** 2:
+                    expected.add(item)
+            self.assertEqual(set(self.tree.hit_circle(x, y, radius, [])),
+                             expected)
+
+
+class RectItemFastQuadTreeTestCase(FastQuadTreeTestCase):
+    item_class = RectItem
+
+
+class DynamicQuadTreeTestCase(TestCase):
+
+    def setUp(self):
+        random.seed(9)
+        self.items = [Item(random_rect()) for i in range(300)]
+        self.tree = DynamicQuadTree((0, 0, 960, 720), self.items)
+        self.queries = [random_rect(200) for i in range(50)]
+
+    def assertMatchesBruteForce(self):
+        self.assertEqual(len(self.tree), len(self.items))
+        for query in self.queries:
+            expected = set(item for item in self.items
+                           if query.colliderect(item.rect))
+            self.assertEqual(self.tree.hit(query), expected)
+            self.assertEqual(self.tree.hit_rect(query),
+                             set(tuple(item.rect) for item in expected))
+
+    def depth(self, node=None):
+        node = node or self.tree.root
+        if node.children is None:
+            return 1
+        return 1 + max(self.depth(child) for child in node.children)
+
+    def test_matches_fast_quadtree(self):
+        fast = FastQuadTree(self.items, 4)
+        for query in self.queries:
+            self.assertEqual(self.tree.hit(query), fast.hit(query))
+
+    def test_hit_into(self):
+        for query in self.queries:
+            out = self.tree.hit_into(query, [])
+            self.assertEqual(len(out), len(set(out)))
+            self.assertEqual(set(out), self.tree.hit(query))
+
+    def test_insert(self):
+        self.assertMatchesBruteForce()
+        self.assertGreater(self.depth(), 2)
+
+    def test_remove_merges_quadrants(self):
+        random.shuffle(self.items)
+        while len(self.items) > 3:
+            self.tree.remove(self.items.pop())
+            if len(self.items) % 50 == 0:
+                self.assertMatchesBruteForce()
+        self.assertEqual(self.depth(), 1)
+        self.assertRaises(KeyError, self.tree.remove, Item((0, 0, 1, 1)))
+
+    def test_update(self):
+        for frame in range(10):
+            for item in random.sample(self.items, 100):
+                item.rect.move_ip(random.randint(-80, 80),
+                                  random.randint(-80, 80))
+                self.tree.update(item)
+            self.assertMatchesBruteForce()
+
+    def test_items_outside_boundary(self):
+        item = Item((5000, -5000, 10, 10))
+        self.items.append(item)
+        self.tree.insert(item)
+        self.assertEqual(self.tree.hit((4990, -5010, 40, 40)), {item})
+        item.rect.topleft = 100, 100
+        self.tree.update(item)
+        self.assertIn(item, self.tree.hit((100, 100, 5, 5)))
+        self.assertMatchesBruteForce()
+
+    def test_small_items_go_deep(self):
+        item = Item((479, 359, 4, 4))
+        self.tree.insert(item)
+        self.assertGreater(self.tree.nodes[item].depth, 1)
+
+
+class LinearQuadTreeTestCase(TestCase):
+
+    def setUp(self):
+        random.seed(11)
+        self.items = [Item(random_rect()) for i in range(1000)]
+        self.tree = LinearQuadTree(self.items)
+        self.queries = [random_rect(300) for i in range(100)]
+
+    def brute_force(self, query):
+        return set(item for item in self.items
+                   if query.colliderect(item.rect))
+
+    def test_hit(self):
+        self.assertGreater(self.tree.depth, 1)
+        for query in self.queries:
+            out = self.tree.hit_into(query, [])
+            self.assertEqual(len(out), len(set(out)))
+            self.assertEqual(set(out), self.brute_force(query))
+            self.assertEqual(self.tree.hit(query), self.brute_force(query))
+
+    def test_hit_many(self):
+        outs = self.tree.hit_many(self.queries)
+        for query, out in zip(self.queries, outs):
+            self.assertEqual(len(out), len(set(out)))
+            self.assertEqual(set(out), self.brute_force(query))
+
+    def test_depth_follows_item_count(self):
+        small = LinearQuadTree(self.items[:8])
+        self.assertEqual(small.depth, 0)
+        self.assertLess(small.depth, self.tree.depth)
+        self.assertEqual(small.hit(self.queries[0]),
+                         set(item for item in self.items[:8]
+                             if self.queries[0].colliderect(item.rect)))
+
+    def test_items_are_stored_once(self):
+        self.assertEqual(len(self.tree.items),
+                         len([item for item in self.items
+                              if item.rect.width and item.rect.height]))
+
+    def test_empty(self):
+        tree = LinearQuadTree([])
+        self.assertEqual(tree.hit((0, 0, 10, 10)), set())
+        self.assertEqual(tree.hit_many([Rect(0, 0, 10, 10)]), [[]])
@@ -0,0 +1,98 @@
+from unittest import TestCase, mock
+
+from zkit import scheduler
+from zkit.scheduler import FrameScheduler
+
+
+class Clock(object):
+    """ perf_counter that only moves when told to """
+
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, ms):
+        self.now += ms / 1000.
+
+
+class FrameSchedulerTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch.object(scheduler, 'perf_counter', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.scheduler = FrameScheduler(10, max_skipped_draws=2)
+        self.ran = list()
+
+    def task(self, name, ms=0, again=False):
+        def run():
+            self.ran.append(name)
+            self.clock.advance(ms)
+            return again
+        return run
+
+    def test_phase_times(self):
+        s = self.scheduler
+        for frame in range(2):
+            s.begin_frame()
+            s.run('update', self.clock.advance, 3)
+            s.run('draw', self.clock.advance, 4 + frame * 2)
+            s.end_frame()
+        self.assertAlmostEqual(s.phase_times['draw'], 6)
+        self.assertAlmostEqual(s.phase_averages['update'], 3)
+        self.assertAlmostEqual(s.phase_averages['draw'], 4.2)
+        self.assertAlmostEqual(s.frame_time, 9)
+        self.assertIn('draw 4.2', s.report())
+
+    def test_deferred_tasks_run_in_slack(self):
+        s = self.scheduler
+        s.defer(self.task('low'), priority=2, cost=2)
+        s.defer(self.task('a', 4), priority=1, cost=4)
+        s.defer(self.task('b', 4), priority=1, cost=4)
+        s.begin_frame()
+        self.clock.advance(1)
+        self.assertEqual(s.run_deferred(), 2)
+        self.assertEqual(self.ran, ['a', 'b'])
+        s.begin_frame()
+        s.run_deferred()
+        self.assertEqual(self.ran, ['a', 'b', 'low'])
+        self.assertFalse(s.deferred)
+
+    def test_unfinished_tasks_are_deferred_again(self):
+        s = self.scheduler
+        s.defer(self.task('chunk', 4, again=True), cost=4)
+        s.begin_frame()
+        self.assertEqual(s.run_deferred(), 1)
+        self.assertEqual(len(s.deferred), 1)
+        s.begin_frame()
+        s.run_deferred()
+        self.assertEqual(self.ran, ['chunk', 'chunk'])
+
+    def test_overdue_tasks_run_over_budget(self):
+        s = self.scheduler
+        s.max_delay = 3
+        s.defer(self.task('first'), priority=0, cost=5)
+        s.defer(self.task('late'), priority=1, cost=5)
+        for frame in range(5):
+            s.begin_frame()
+            self.clock.advance(20)
+            s.run_deferred()
+            s.end_frame()
+            if frame < 3:
+                self.assertEqual(self.ran, [])
+        self.assertEqual(self.ran, ['first', 'late'])
+        self.assertTrue(s.degraded)
+
+    def test_draw_is_skipped_over_budget(self):
+        s = self.scheduler
+        draws = list()
+        for frame in range(6):
+            s.begin_frame()
+            self.clock.advance(12)
+            draws.append(s.should_draw())
+        self.assertEqual(draws, [False, False, True, False, False, True])
+        s.begin_frame()
+        self.assertTrue(s.should_draw())